@@ -0,0 +1,192 @@
+"""
+ADMISSION - throttling in front of /api/validate
+
+Token buckets per client IP, per HWID and per key prefix (the first group
+of the key), checked before a request may touch the store. A request takes
+a token from each of its buckets or from none; when one is empty it gets a
+429 with Retry-After. With the redis backend the buckets live in redis (one
+Lua call), so the budgets hold across workers and hosts; otherwise each
+process keeps them in a bounded LRU, so gunicorn -w N allows N times the
+per-IP rate.
+
+On top of that, at most VALIDATE_CONCURRENCY validations per process run at
+once; the rest wait up to VALIDATE_QUEUE_WAIT and are shed with a 429 - a
+flood queues here, not on the store's file lock.
+
+All of it is off until configured - unset, /api/validate behaves as it
+always has.
+"""
+
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Budgets as "<requests per second>/<burst>", '' or 0 = unlimited (the default).
+# A launcher re-checks now and then, so e.g. THROTTLE_IP=5/100, THROTTLE_HWID=0.5/10,
+# THROTTLE_PREFIX=2/40 only stop floods and key guessing.
+THROTTLE_IP = os.environ.get('THROTTLE_IP', '')
+THROTTLE_HWID = os.environ.get('THROTTLE_HWID', '')
+THROTTLE_PREFIX = os.environ.get('THROTTLE_PREFIX', '')
+
+# Characters of the key that make its prefix (4 = first group)
+THROTTLE_PREFIX_LEN = int(os.environ.get('THROTTLE_PREFIX_LEN', 4))
+
+# Buckets kept per process before the least recently used are forgotten (local mode)
+THROTTLE_TRACKED = int(os.environ.get('THROTTLE_TRACKED', 100000))
+
+# Reverse proxies in front of the app; the client IP is that many entries from the end of X-Forwarded-For
+THROTTLE_PROXY_HOPS = int(os.environ.get('THROTTLE_PROXY_HOPS', 0))
+
+# Validations running at once per process, 0 = no limit (the default; 32 suits most hosts)
+VALIDATE_CONCURRENCY = int(os.environ.get('VALIDATE_CONCURRENCY', 0))
+
+# Seconds a validation may wait for a slot before it's shed
+VALIDATE_QUEUE_WAIT = float(os.environ.get('VALIDATE_QUEUE_WAIT', 0.05))
+
+# KEYS = bucket hashes, ARGV = now, then rate and burst per bucket.
+# Returns {seconds to wait as a string, 1-based index of the empty bucket}; {'0', 0} = admitted.
+THROTTLE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local wait, empty = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', key, 't', 'ts')
+    local t = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    t = math.min(burst, t + math.max(0, now - ts) * rate)
+    tokens[i] = t
+    if t < 1 and (1 - t) / rate > wait then
+        wait, empty = (1 - t) / rate, i
+    end
+end
+if empty == 0 then
+    for i, key in ipairs(KEYS) do
+        local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+        redis.call('HSET', key, 't', tokens[i] - 1, 'ts', now)
+        redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000))
+    end
+end
+return {tostring(wait), empty}
+"""
+
+def parse_budget(text):
+    """'5/100' -> (5.0, 100.0); None when unlimited"""
+    rate, _, burst = (text or '').partition('/')
+    rate = float(rate or 0)
+    if rate <= 0:
+        return None
+    return rate, max(1.0, float(burst or rate))
+
+def client_ip(remote_addr, forwarded_for=None):
+    """The caller's address, trusting THROTTLE_PROXY_HOPS entries of X-Forwarded-For"""
+    if THROTTLE_PROXY_HOPS and forwarded_for:
+        hops = [part.strip() for part in forwarded_for.split(',') if part.strip()]
+        if hops:
+            return hops[-min(THROTTLE_PROXY_HOPS, len(hops))]
+    return remote_addr or 'unknown'
+
+class Admission:
+    """Token buckets + the validation concurrency limit for one process"""
+
+    def __init__(self, store):
+        self.budgets = {
+            'ip': parse_budget(THROTTLE_IP),
+            'hwid': parse_budget(THROTTLE_HWID),
+            'prefix': parse_budget(THROTTLE_PREFIX),
+        }
+        self.buckets = OrderedDict()    # (kind, id) -> [tokens, stamp]
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(VALIDATE_CONCURRENCY) if VALIDATE_CONCURRENCY > 0 else None
+        # Shared budgets need a shared store - redis is the only one cheap enough to hit per request
+        self.redis = getattr(store, 'r', None) if store.name == 'redis' else None
+        if self.redis is not None:
+            self.prefix = store.k('throttle', '')
+            self._throttle = self.redis.register_script(THROTTLE_SCRIPT)
+
+    @property
+    def shared(self):
+        return self.redis is not None
+
+    @property
+    def enabled(self):
+        return any(self.budgets.values()) or self.slots is not None
+
+    def check(self, ip, hwid=None, key=None):
+        """
+        Take a token from each bucket this request falls in. Returns
+        (seconds to wait, bucket kind) when one is empty, else (0, None).
+        """
+        wanted = [('ip', ip)]
+        if hwid and hwid != 'unknown':
+            wanted.append(('hwid', hwid))
+        if key:
+            wanted.append(('prefix', key.strip().upper()[:THROTTLE_PREFIX_LEN]))
+        wanted = [(kind, ident, self.budgets[kind]) for kind, ident in wanted if self.budgets[kind]]
+        if not wanted:
+            return 0, None
+
+        wait, kind = self._check_shared(wanted) if self.shared else self._check_local(wanted)
+        if wait:
+            metrics.inc('atlas_throttled_total', reason=kind)
+        return wait, kind
+
+    def _check_local(self, wanted):
+        now = time.monotonic()
+        with self.lock:
+            states = []
+            for kind, ident, (rate, burst) in wanted:
+                state = self.buckets.get((kind, ident))
+                if state is None:
+                    state = self.buckets[kind, ident] = [burst, now]
+                    if len(self.buckets) > THROTTLE_TRACKED:
+                        self.buckets.popitem(last=False)
+                else:
+                    self.buckets.move_to_end((kind, ident))
+                    state[0] = min(burst, state[0] + (now - state[1]) * rate)
+                    state[1] = now
+                states.append(state)
+            empty = [((1 - state[0]) / rate, kind)
+                     for state, (kind, _, (rate, _)) in zip(states, wanted) if state[0] < 1]
+            if empty:
+                return max(empty)
+            for state in states:
+                state[0] -= 1
+        return 0, None
+
+    def _check_shared(self, wanted):
+        keys = [self.prefix + f'{kind}:{ident}' for kind, ident, _ in wanted]
+        args = [time.time()]
+        for _, _, (rate, burst) in wanted:
+            args += [rate, burst]
+        try:
+            wait, empty = self._throttle(keys=keys, args=args)
+        except Exception as e:
+            # Fail open - a redis outage shows up on the store calls anyway
+            print(f"[WARNING] Throttle check failed, admitting: {e}")
+            return 0, None
+        return (float(wait), wanted[int(empty) - 1][0]) if int(empty) else (0, None)
+
+    def enter(self, wait=VALIDATE_QUEUE_WAIT):
+        """Claim a validation slot - False means shed the request"""
+        if self.slots is None or self.slots.acquire(timeout=wait):
+            return True
+        metrics.inc('atlas_throttled_total', reason='busy')
+        return False
+
+    def leave(self):
+        if self.slots is not None:
+            self.slots.release()
+
+def rejection(wait):
+    """429 body - `valid`/`message` so launchers that only read those still show something sensible"""
+    return {'valid': False, 'message': f'Too many requests - try again in {retry_after(wait)}s',
+            'error': 'Too many requests', 'retry_after': int(retry_after(wait))}
+
+def retry_after(wait):
+    """Retry-After header value - whole seconds, at least 1"""
+    return str(max(1, math.ceil(wait)))
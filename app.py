@@ -8,17 +8,36 @@ import os
 import json
 import secrets
 import hashlib
+import hmac
+import math
+import base64
 import threading
 import time
+import gzip
 import signal
 import sys
-import shutil
 import atexit
+import queue
+import urllib.request
+import urllib.error
 from datetime import datetime, timedelta
-from flask import Flask, render_template, render_template_string, jsonify, request, session, redirect
+from flask import Flask, Response, g, render_template, render_template_string, jsonify, request, session, redirect
 from flask_cors import CORS
 from functools import wraps
 
+import storage
+import metrics
+import backups
+import archive
+import admission
+import rollups
+import replication
+
+try:
+    import brotli
+except ImportError:    # optional - pages go out gzip'd or plain without it
+    brotli = None
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 
@@ -26,39 +45,72 @@ app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 CORS(app, resources={
     r"/api/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "methods": ["GET", "POST", "PATCH", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization", "If-Match", "If-None-Match"],
+        "expose_headers": ["ETag"]
     }
 })
 
+@app.errorhandler(storage.CommitFailed)
+def commit_failed(e):
+    print(f"[ERROR] {request.method} {request.path}: {e}")
+    return jsonify(SAVE_FAILED), 500
+
+@app.before_request
+def start_request_timer():
+    start_threads()
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Per-route count + latency; the route pattern keeps label cardinality bounded"""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    started = g.get('started')
+    if started is not None:
+        metrics.observe('atlas_http_request_duration_seconds', time.perf_counter() - started, route=route)
+    metrics.inc('atlas_http_requests_total', route=route, method=request.method, status=response.status_code)
+    return response
+
 # Also add CORS headers to all responses
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,If-Match,If-None-Match')
+    response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,PATCH,DELETE,OPTIONS')
     return response
 
 # ============================================================================
 # DATA STORAGE - ABSOLUTE PATHS FOR RELIABILITY
 # ============================================================================
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-KEYS_FILE = os.path.join(BASE_DIR, 'keys.json')
-PROFILES_FILE = os.path.join(BASE_DIR, 'profiles.json')
-STATS_FILE = os.path.join(BASE_DIR, 'stats.json')
-BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
-
-KEYS = {}
-USER_PROFILES = {}
-STATS = {'validations': 0, 'generations': 0, 'last_reset': datetime.now().isoformat()}
+DATA_DIR = storage.DATA_DIR
+BACKUP_DIR = os.path.join(DATA_DIR, 'backups')
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')    # one snapshot per worker pid
+
+# STORAGE_BACKEND=json (default, single worker) or redis (gunicorn -w N);
+# REPLICA_OF makes this process a read replica of a json primary
+STORE = storage.ReplicaStorage() if replication.REPLICA_OF else storage.create_storage()
+FOLLOWER = replication.Follower(STORE) if replication.REPLICA_OF else None
+PRIMARY = None
+if replication.REPLICATION_LISTEN and not FOLLOWER:
+    if STORE.name == 'json':
+        PRIMARY = replication.Primary(STORE)
+    else:
+        print(f"[WARNING] REPLICATION_LISTEN ignored - {STORE.name} is shared by every worker already")
+
+# Full + incremental gzip backups, written by a background thread
+BACKUPS = backups.BackupWriter(STORE, BACKUP_DIR)
+
+# Keys long past expiry move out of STORE into a compressed archive
+ARCHIVE = archive.KeyArchive()
+REAPER = archive.Reaper(STORE, ARCHIVE)
+
+# Token buckets + concurrency limit in front of /api/validate
+ADMISSION = admission.Admission(STORE)
 
 ADMIN_USER = "admin"
 ADMIN_PASS = os.environ.get('ADMIN_PASSWORD', 'atlas2024')
 
-# Thread lock for file operations
-file_lock = threading.Lock()
-_data_modified = False
-
 # ============================================================================
 # PERSISTENCE FUNCTIONS - BULLETPROOF
 # ============================================================================
@@ -68,129 +120,77 @@ def ensure_dirs():
     if not os.path.exists(BACKUP_DIR):
         os.makedirs(BACKUP_DIR)
 
-def atomic_write(filepath, data):
-    """
-    ATOMIC FILE WRITE - Prevents corruption even if PC crashes mid-write
-    1. Write to temp file
-    2. Force sync to disk
-    3. Rename (atomic operation)
-    """
-    temp_file = filepath + '.tmp'
-    try:
-        with open(temp_file, 'w') as f:
-            json.dump(data, f, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-
-        if os.path.exists(filepath):
-            backup_path = filepath + '.bak'
-            shutil.copy2(filepath, backup_path)
-
-        os.replace(temp_file, filepath)
-        return True
-    except Exception as e:
-        print(f"[ERROR] Write failed {filepath}: {e}")
-        if os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-            except:
-                pass
-        return False
+# Body of a 500 for a change that didn't reach disk - `valid` for launchers hitting /api/validate
+SAVE_FAILED = {'success': False, 'valid': False, 'error': 'Save failed', 'message': 'Save failed - try again'}
 
 def save_data(force=False):
     """Save all data to disk - THREAD SAFE"""
-    global _data_modified
-
-    with file_lock:
-        try:
-            success = True
-            success &= atomic_write(KEYS_FILE, KEYS)
-            success &= atomic_write(PROFILES_FILE, USER_PROFILES)
-            success &= atomic_write(STATS_FILE, STATS)
-
-            if success:
-                _data_modified = False
-                if force:
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 💾 Data saved to disk")
-            return success
-        except Exception as e:
-            print(f"[ERROR] Save failed: {e}")
-            return False
+    return STORE.save(force=force)
 
 def load_data():
     """Load data with automatic corruption recovery"""
-    global KEYS, USER_PROFILES, STATS
-
-    def load_file(filepath, default):
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"[WARNING] {os.path.basename(filepath)} corrupted: {e}")
-                bak_path = filepath + '.bak'
-                if os.path.exists(bak_path):
-                    try:
-                        with open(bak_path, 'r') as f:
-                            data = json.load(f)
-                        print(f"[RECOVERED] Loaded from backup: {os.path.basename(filepath)}")
-                        return data
-                    except Exception as e2:
-                        print(f"[ERROR] Backup also corrupted: {e2}")
-                return default
-        return default
-
-    KEYS = load_file(KEYS_FILE, {})
-    USER_PROFILES = load_file(PROFILES_FILE, {})
-    STATS = load_file(STATS_FILE, {'validations': 0, 'generations': 0, 'last_reset': datetime.now().isoformat()})
-
-    print(f"[INFO] Loaded {len(KEYS)} keys, {len(USER_PROFILES)} profiles")
-    return True
-
-def create_backup():
-    """Create timestamped backup"""
-    ensure_dirs()
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-    for filename in ['keys.json', 'profiles.json', 'stats.json']:
-        src = os.path.join(BASE_DIR, filename)
-        if os.path.exists(src):
-            dst = os.path.join(BACKUP_DIR, f"{filename}.{timestamp}")
-            shutil.copy2(src, dst)
-
-    cleanup_backups()
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] 📁 Backup created: {timestamp}")
-
-def cleanup_backups():
-    """Keep only last 20 backups of each file"""
-    if not os.path.exists(BACKUP_DIR):
+    return STORE.load()
+
+def create_backup(full=False, wait=False):
+    """Queue a backup (wait=True writes it before returning)"""
+    if wait:
+        return BACKUPS.run(full=full)
+    BACKUPS.request(full=full)
+
+def start_threads():
+    """Background threads of this process - again in every forked worker"""
+    metrics.start(METRICS_DIR)
+    ROLLUPS.start()
+    STORE.start()
+    if FOLLOWER:
+        FOLLOWER.start()    # the primary does the backups, reaping and compaction
         return
-
-    for prefix in ['keys.json', 'profiles.json', 'stats.json']:
-        files = sorted([f for f in os.listdir(BACKUP_DIR) if f.startswith(prefix)])
-        while len(files) > 20:
-            old = os.path.join(BACKUP_DIR, files.pop(0))
-            try:
-                os.remove(old)
-            except:
-                pass
-
-def auto_save_worker():
-    global _data_modified
-    while True:
-        time.sleep(30)
-        if _data_modified:
-            save_data()
-            print(f"[{datetime.now().strftime('%H:%M')}] Auto-saved")
+    BACKUPS.start()
+    REAPER.start()
+    if PRIMARY:
+        PRIMARY.start()
+
+# Load at import time so gunicorn workers (which never run __main__) see the data
+ensure_dirs()
+metrics.start(METRICS_DIR)
+load_data()
+if FOLLOWER:
+    FOLLOWER.start()
+    if not FOLLOWER.ready.wait(replication.REPLICA_WAIT):
+        print(f"[WARNING] No snapshot from {replication.REPLICA_OF} yet - serving an empty replica")
+
+def after_fork():
+    """
+    gunicorn post_fork hook (see gunicorn.conf.py). With preload_app the
+    data was loaded once in the master; threads don't survive the fork, so
+    each worker starts its own here.
+    """
+    STORE.after_fork()
+    start_threads()
+    watch_revocations()
 
 # ============================================================================
 # SHUTDOWN HANDLERS
 # ============================================================================
 
+# A process that forks workers (gunicorn master with preload_app) keeps a
+# copy of the data that goes stale - only the workers may save on exit
+data_owner = os.getpid()
+
+def set_data_owner(pid):
+    global data_owner
+    data_owner = pid
+
+os.register_at_fork(after_in_parent=lambda: set_data_owner(None),
+                    after_in_child=lambda: set_data_owner(os.getpid()))
+
 def emergency_save():
+    ROLLUPS.flush()    # what this process counted - replicas included
+    if data_owner != os.getpid() or FOLLOWER:
+        return
     print("\n[SHUTDOWN] Saving data before exit...")
     save_data(force=True)
-    create_backup()
+    create_backup(wait=True)
     print("[SHUTDOWN] Data saved safely. Goodbye!")
 
 def signal_handler(signum, frame):
@@ -206,119 +206,637 @@ signal.signal(signal.SIGTERM, signal_handler)
 # KEY FUNCTIONS
 # ============================================================================
 
+DURATIONS = {
+    '1hour': timedelta(hours=1),
+    '1day': timedelta(days=1),
+    '7days': timedelta(days=7),
+    '30days': timedelta(days=30),
+    '365days': timedelta(days=365),
+    'lifetime': timedelta(days=9999)
+}
+
+# Validations / activations / generations per minute, hour and day (rollups.bin)
+ROLLUPS = rollups.Rollups(DURATIONS)
+
+MAX_BATCH_GENERATE = int(os.environ.get('MAX_BATCH_GENERATE', 100000))
+MAX_BATCH_VALIDATE = int(os.environ.get('MAX_BATCH_VALIDATE', 1000))
+
+def new_key_ids(count):
+    """
+    Draw `count` fresh key ids. Collisions are removed with one bulk
+    membership check against the store per round instead of a lookup per key.
+    """
+    fresh = set()
+    while len(fresh) < count:
+        need = count - len(fresh)
+        drawn = {'-'.join(secrets.token_hex(2).upper() for _ in range(6)) for _ in range(need)}
+        fresh |= STORE.missing(drawn - fresh)
+    return list(fresh)
+
+def generate_keys(count, duration='7days'):
+    """Generate `count` keys in memory - ONE durable write for the whole batch"""
+    now = time.time()
+    expiry = now + DURATIONS.get(duration, timedelta(days=7)).total_seconds()
+
+    new_keys = new_key_ids(count)
+    STORE.add_keys({key: storage.KeyRecord(now, duration, expiry) for key in new_keys})
+    ROLLUPS.count(f'generation:{duration}', count, now)
+    STORE.publish({'event': 'generated', 'count': count, 'duration': duration,
+                   'keys': new_keys[:EVENT_KEY_LIMIT]})
+    return new_keys
+
 def generate_key(duration='7days'):
     """Generate new key - SAVES IMMEDIATELY"""
-    global _data_modified
+    return generate_keys(1, duration)[0]
 
-    key = '-'.join([secrets.token_hex(2).upper() for _ in range(6)])
+def validate_key(key, hwid):
+    """Validate key - SAVES IMMEDIATELY on success"""
+    key = key.strip().upper()
+    now = time.time()
+
+    result, data = STORE.activate(key, hwid, now)
+    if result == 'invalid' and ARCHIVE.has(key):
+        result = 'expired'    # reaped into the archive
+
+    if result == 'ok' and data.activations == 1:
+        STORE.publish({'event': 'activated', 'keys': [key], 'duration': data.duration})
+        ROLLUPS.count(f'activation:{data.duration}', now=now)
+
+    return validation_result(key, hwid, result, data, now)
+
+def validate_keys(items):
+    """Validate many {key, hwid} pairs - ONE durable write for the whole batch"""
+    now = time.time()
+    pairs = [(str(item.get('key', '')).strip().upper(), item.get('hwid', 'unknown')) for item in items]
+
+    results = STORE.activate_many(pairs, now)
+    archived = ARCHIVE.among(key for (key, _), (result, _) in zip(pairs, results) if result == 'invalid')
+    if archived:
+        results = [('expired', data) if key in archived else (result, data)
+                   for (key, _), (result, data) in zip(pairs, results)]
+
+    activated = [(key, data.duration) for (key, _), (result, data) in zip(pairs, results)
+                 if result == 'ok' and data.activations == 1]
+    for _, duration in activated:
+        ROLLUPS.count(f'activation:{duration}', now=now)
+    activated = [key for key, _ in activated]
+    if activated:
+        STORE.publish({'event': 'activated', 'keys': activated[:EVENT_KEY_LIMIT], 'count': len(activated)})
+
+    return [validation_result(key, hwid, result, data, now)
+            for (key, hwid), (result, data) in zip(pairs, results)]
+
+def validation_result(key, hwid, result, data, now):
+    """Response body for one activate() outcome"""
+    metrics.inc('atlas_validations_total', outcome=result)
+    ROLLUPS.validation(result, now)
+    if result == 'invalid':
+        return {'valid': False, 'message': 'Invalid key'}
 
-    duration_map = {
-        '1hour': timedelta(hours=1),
-        '1day': timedelta(days=1),
-        '7days': timedelta(days=7),
-        '30days': timedelta(days=30),
-        '365days': timedelta(days=365),
-        'lifetime': timedelta(days=9999)
-    }
+    if result == 'expired':
+        return {'valid': False, 'message': 'Key expired'}
 
-    expiry = datetime.now() + duration_map.get(duration, timedelta(days=7))
+    if result == 'in_use':
+        return {'valid': False, 'message': 'Key in use on another device'}
 
-    KEYS[key] = {
-        'created': datetime.now().isoformat(),
-        'duration': duration,
-        'expiry': expiry.isoformat(),
-        'used': False,
-        'hwid': None,
-        'activated': None,
-        'activations': 0
-    }
+    lease, lease_expires = issue_lease(key, hwid, data, now)
 
-    STATS['generations'] += 1
-    _data_modified = True
-    save_data(force=True)
-    return key
+    return dict(time_left(data.expiry, now), **{
+        'valid': True,
+        'message': 'Key activated',
+        'expiry': storage.iso(data.expiry),
+        'duration': data.duration,
+        'activations': data.activations,
+        'lease': lease,
+        'lease_expires': storage.iso(lease_expires)
+    })
 
-def validate_key(key, hwid):
-    """Validate key - SAVES IMMEDIATELY on success"""
-    global _data_modified
+def time_left(expiry, now):
+    days_left, rest = divmod(int(expiry - now), 86400)
+    hours_left = rest // 3600
+    return {
+        'days_left': max(0, days_left),
+        'hours_left': hours_left if days_left == 0 else None
+    }
 
-    key = key.strip().upper()
+# ============================================================================
+# VALIDATION LEASES - re-checks without touching the key store
+# ============================================================================
 
-    if key not in KEYS:
+LEASE_TTL = int(os.environ.get('LEASE_TTL', 3600))
+LEASE_KEY_FILE = os.path.join(DATA_DIR, 'lease.key')
+
+def load_lease_secret():
+    """LEASE_SECRET env, else a random secret shared by all workers via DATA_DIR"""
+    secret = os.environ.get('LEASE_SECRET')
+    if secret:
+        return secret.encode()
+    os.makedirs(DATA_DIR, exist_ok=True)
+    try:
+        fd = os.open(LEASE_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker may still be writing it
+        for _ in range(50):
+            with open(LEASE_KEY_FILE, 'rb') as f:
+                secret = f.read()
+            if secret:
+                return secret
+            time.sleep(0.01)
+        raise RuntimeError(f'{LEASE_KEY_FILE} is empty')
+    secret = secrets.token_hex(32).encode()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+        f.flush()
+        os.fsync(f.fileno())
+    return secret
+
+LEASE_SECRET = load_lease_secret()
+
+# key -> when it was deleted / reset; leases issued by then are void
+revoked_keys = {}
+revoked_lock = threading.Lock()
+revocation_pid = None
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def lease_signature(body):
+    return hmac.new(LEASE_SECRET, body.encode(), hashlib.sha256).digest()
+
+def issue_lease(key, hwid, data, now):
+    """Token binding key + HWID until min(now + LEASE_TTL, key expiry), stamped with its issue time"""
+    lease_expires = min(now + LEASE_TTL, data.expiry)
+    body = b64(json.dumps([key, hwid, data.duration, data.expiry, lease_expires, now],
+                          separators=(',', ':')).encode())
+    return f'{body}.{b64(lease_signature(body))}', lease_expires
+
+def revoke_keys(keys, at=None):
+    at = time.time() if at is None else at
+    with revoked_lock:
+        for key in keys:
+            revoked_keys[key] = max(at, revoked_keys.get(key, 0))
+
+def on_store_event(event):
+    if event.get('event') in ('deleted', 'revoked'):
+        revoke_keys(event['keys'], event.get('at'))
+
+def watch_revocations():
+    """Follow 'deleted' / 'revoked' events from every worker - re-armed after fork"""
+    global revocation_pid
+    if revocation_pid != os.getpid():
+        revocation_pid = os.getpid()
+        STORE.listen(on_store_event)
+
+watch_revocations()
+
+def is_revoked(key, now, issued):
+    """Leases issued up to the key's deletion / reset; ones issued after stay valid"""
+    at = revoked_keys.get(key)
+    if at is None:
+        return False
+    if at + LEASE_TTL > now:
+        return issued <= at
+    # Every lease from before it has expired by now
+    with revoked_lock:
+        if revoked_keys.get(key) == at:
+            del revoked_keys[key]
+    return False
+
+def verify_lease(lease, hwid):
+    """Signature, expiry and revocation check only - pure CPU, no I/O"""
+    now = time.time()
+    try:
+        body, signature = lease.split('.')
+        if not hmac.compare_digest(unb64(signature), lease_signature(body)):
+            return {'valid': False, 'message': 'Invalid lease'}
+        key, lease_hwid, duration, expiry, lease_expires, *issued = json.loads(unb64(body))
+        # Leases from before the issue time was stamped: assume the earliest it could be
+        issued = issued[0] if issued else lease_expires - LEASE_TTL
+    except (ValueError, TypeError, AttributeError):
+        return {'valid': False, 'message': 'Invalid lease'}
+
+    if lease_hwid != hwid:
+        return {'valid': False, 'message': 'Key in use on another device'}
+    if expiry <= now:
+        return {'valid': False, 'message': 'Key expired'}
+    if lease_expires <= now:
+        return {'valid': False, 'message': 'Lease expired'}
+    if is_revoked(key, now, issued):
         return {'valid': False, 'message': 'Invalid key'}
 
-    data = KEYS[key]
-    now = datetime.now()
-    expiry = datetime.fromisoformat(data['expiry'])
+    return dict(time_left(expiry, now), **{
+        'valid': True,
+        'message': 'Lease valid',
+        'expiry': storage.iso(expiry),
+        'duration': duration,
+        'lease_expires': storage.iso(lease_expires)
+    })
 
-    if expiry < now:
-        return {'valid': False, 'message': 'Key expired'}
+# ============================================================================
+# LIVE EVENTS (SSE)
+# ============================================================================
 
-    if data['used'] and data['hwid'] and data['hwid'] != hwid:
-        return {'valid': False, 'message': 'Key in use on another device'}
+EVENT_TICK = float(os.environ.get('EVENT_TICK', 1))
+EVENT_KEY_LIMIT = 100
 
-    if not data['used']:
-        data['used'] = True
-        data['activated'] = now.isoformat()
+class EventBus:
+    """
+    In-process fan-out to open SSE streams. Events from other workers arrive
+    through STORE.listen(); counters and expiries are sampled by event_ticker.
+    """
 
-    data['hwid'] = hwid
-    data['activations'] += 1
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}    # queue -> set of event names it wants
+        self.pid = None
+
+    def subscribe(self, events, q=None):
+        """`q` needs put_nowait() raising queue.Full - asgi.py passes one that feeds an event loop"""
+        self._ensure_started()
+        q = q or queue.Queue(maxsize=256)
+        with self.lock:
+            self.subscribers[q] = events
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.pop(q, None)
+
+    def emit(self, event, data):
+        with self.lock:
+            targets = [q for q, wanted in self.subscribers.items() if event in wanted]
+        for q in targets:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                pass    # slow client - it will catch up from the next stats push
 
-    STATS['validations'] += 1
-    _data_modified = True
-    save_data(force=True)
+    def on_store_event(self, event):
+        self.emit(event['event'], event)
 
-    days_left = (expiry - now).days
-    hours_left = (expiry - now).seconds // 3600
+    def _ensure_started(self):
+        # On the first subscriber in each worker
+        if storage.start_once(self, event_ticker):
+            STORE.listen(self.on_store_event)
 
+BUS = EventBus()
+
+def status_payload():
+    stats = STORE.stats()
     return {
-        'valid': True,
-        'message': 'Key activated',
-        'expiry': data['expiry'],
-        'duration': data['duration'],
-        'days_left': max(0, days_left),
-        'hours_left': hours_left if days_left == 0 else None,
-        'activations': data['activations']
+        'online': True,
+        'keys_total': STORE.key_count(),
+        'keys_used': STORE.used_count(),
+        'validations': stats.get('validations', 0),
+        'generations': stats.get('generations', 0)
     }
 
+def admin_stats_payload():
+    total = STORE.key_count()
+    used = STORE.used_count()
+    stats = STORE.stats()
+    return {
+        'total': total,
+        'used': used,
+        'available': total - used,
+        'expired': STORE.expired_count(time.time()),
+        'archived': ARCHIVE.count(),
+        'validations': stats.get('validations', 0),
+        'generations': stats.get('generations', 0)
+    }
+
+def event_ticker():
+    """Push counters when they change and 'expired' as keys age - O(1) per tick"""
+    last_status = last_stats = None
+    last_tick = time.time()
+    while True:
+        time.sleep(EVENT_TICK)
+        now = time.time()
+        if not BUS.subscribers:
+            last_tick = now
+            continue
+        try:
+            expired = STORE.expired_between(last_tick, now)
+            last_tick = now
+            if expired:
+                BUS.emit('expired', {'event': 'expired', 'count': len(expired), 'keys': expired[:EVENT_KEY_LIMIT]})
+
+            current = status_payload()
+            if current != last_status:
+                last_status = current
+                BUS.emit('status', dict(current, time=datetime.now().isoformat()))
+
+            current = admin_stats_payload()
+            if current != last_stats:
+                last_stats = current
+                BUS.emit('stats', current)
+        except Exception as e:
+            print(f"[WARNING] Event ticker: {e}")
+
+def sse_stream(events, initial):
+    """text/event-stream body; a comment every 15 s keeps proxies from closing it"""
+    q = BUS.subscribe(events)
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            for event, data in initial:
+                yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+            while True:
+                try:
+                    event, data = q.get(timeout=15)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+        finally:
+            BUS.unsubscribe(q)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# ============================================================================
+# PAGES & COMPRESSION - rendered once, compressed once
+# ============================================================================
+
+# Seconds browsers may reuse / and /admin before revalidating (a 304 after that)
+PAGE_MAX_AGE = int(os.environ.get('PAGE_MAX_AGE', 86400))
+
+# JSON responses at least this big are gzip'd for clients that accept it
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+
+def prerender(html):
+    """
+    The pages have no template variables - render once at startup and keep
+    {encoding: (etag, bytes)}, so a page hit is a dict lookup and a write.
+    """
+    with app.app_context():
+        body = render_template_string(html).encode()
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    variants = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+    if brotli:
+        variants['br'] = brotli.compress(body, quality=11)
+    # Strong ETags name one exact byte sequence, so each encoding gets its own
+    return {enc: (f'{digest}-{enc}', data) for enc, data in variants.items()}
+
+def serve_page(page, cache):
+    """The smallest variant the client accepts, 304 if it already has it"""
+    accepted = request.accept_encodings
+    enc = next((enc for enc in ('br', 'gzip') if enc in page and accepted[enc]), 'identity')
+    tag, body = page[enc]
+    response = not_modified(tag) or Response(body, mimetype='text/html')
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = f'{cache}, max-age={PAGE_MAX_AGE}'
+    response.vary.add('Accept-Encoding')
+    if enc != 'identity' and response.status_code == 200:
+        response.headers['Content-Encoding'] = enc
+    return response
+
+@app.after_request
+def compress_json(response):
+    """gzip big JSON bodies (the admin key list) for clients that accept it"""
+    if (response.mimetype != 'application/json' or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    response.set_data(gzip.compress(body, 6, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    # Same content, different bytes - weak, so If-None-Match still matches
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        response.set_etag(tag, weak=True)
+    return response
+
+# ============================================================================
+# READ REPLICA - local reads, everything else forwarded to the primary
+# ============================================================================
+
+# Answered from the replicated copy (validations only when already bound)
+REPLICA_ENDPOINTS = {'home', 'status', 'status_events', 'api_validate', 'api_validate_batch',
+                     'api_lease_verify', 'get_profiles', 'prometheus_metrics'}
+
+# Not passed through the proxy - per connection, or set again by this app
+PROXY_SKIP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+                      'host', 'content-length', 'server', 'date'}
+
+@app.before_request
+def replica_forward():
+    if FOLLOWER and request.method != 'OPTIONS' and request.endpoint not in REPLICA_ENDPOINTS:
+        return forward_to_primary()
+
+def forward_to_primary():
+    """Proxy this request to PRIMARY_URL; the answer is streamed back (SSE included)"""
+    url = replication.PRIMARY_URL.rstrip('/') + request.path
+    if request.query_string:
+        url += '?' + request.query_string.decode()
+    headers = {name: value for name, value in request.headers.items()
+               if name.lower() not in PROXY_SKIP_HEADERS}
+    # The primary throttles by client IP - set THROTTLE_PROXY_HOPS there to trust this
+    forwarded = request.headers.get('X-Forwarded-For')
+    headers['X-Forwarded-For'] = f'{forwarded}, {request.remote_addr}' if forwarded else request.remote_addr
+    upstream_request = urllib.request.Request(url, data=request.get_data() or None,
+                                              headers=headers, method=request.method)
+    try:
+        upstream = urllib.request.urlopen(upstream_request, timeout=30)
+    except urllib.error.HTTPError as e:
+        upstream = e    # 4xx / 5xx still carry the primary's answer
+    except OSError as e:
+        return jsonify({'error': f'Primary unavailable: {e}'}), 503
+
+    def stream():
+        with upstream:
+            while True:
+                chunk = upstream.read1(65536)
+                if not chunk:
+                    break
+                yield chunk
+
+    passed = [(name, value) for name, value in upstream.headers.items()
+              if name.lower() not in PROXY_SKIP_HEADERS and not name.lower().startswith('access-control-')]
+    return Response(stream(), status=upstream.status, headers=passed)
+
+def replica_validate(pairs):
+    """
+    validation_result()s for re-validations the replica can answer without a
+    write - expired, bound to this HWID, or bound to another. None when any
+    pair needs the primary (first activation, unknown or archived key).
+    Activation counts and the validations stat only move on the primary.
+    """
+    now = time.time()
+    outcomes = []
+    for key, hwid in pairs:
+        data = STORE.get_key(key)
+        if data is None:
+            return None
+        if data.expiry < now:
+            outcomes.append((key, hwid, 'expired', data))
+        elif data.used and data.hwid:
+            outcomes.append((key, hwid, 'ok' if data.hwid == hwid else 'in_use', data))
+        else:
+            return None
+    return [validation_result(key, hwid, result, data, now) for key, hwid, result, data in outcomes]
+
 # ============================================================================
 # FLASK ROUTES
 # ============================================================================
 
 @app.route('/')
 def home():
-    return render_template_string(INDEX_HTML)
+    return serve_page(PAGES['index'], 'public')
 
 @app.route('/api/status')
 def status():
-    return jsonify({
-        'online': True,
-        'time': datetime.now().isoformat(),
-        'keys_total': len(KEYS),
-        'keys_used': sum(1 for k in KEYS if KEYS[k].get('used')),
-        'validations': STATS.get('validations', 0),
-        'generations': STATS.get('generations', 0)
-    })
+    return jsonify(dict(status_payload(), time=datetime.now().isoformat()))
+
+@app.route('/api/events')
+def status_events():
+    """Live /api/status pushes for the public page"""
+    return sse_stream({'status'}, [('status', dict(status_payload(), time=datetime.now().isoformat()))])
+
+def validation_request(item):
+    """(key, hwid) of one validation - None unless it's an object with string fields"""
+    if not isinstance(item, dict):
+        return None
+    key, hwid = item.get('key', ''), item.get('hwid', 'unknown')
+    if not isinstance(key, str) or not isinstance(hwid, str):
+        return None
+    return key, hwid
 
 @app.route('/api/validate', methods=['POST'])
 def api_validate():
+    parsed = validation_request(request.json)
+    if parsed is None:
+        return jsonify({'valid': False, 'message': 'key and hwid must be strings'}), 400
+    key, hwid = parsed
+    wait = throttle_wait(hwid, key)
+    if wait:
+        return too_many_requests(wait)
+    if FOLLOWER:
+        local = replica_validate([(key.strip().upper(), hwid)])
+        return jsonify(local[0]) if local else forward_to_primary()
+    return admitted(validate_key, key, hwid)
+
+@app.route('/api/validate/batch', methods=['POST'])
+def api_validate_batch():
+    """{"items": [{"key": ..., "hwid": ...}, ...]} -> {"results": [...]} in the same order"""
     data = request.json
-    key = data.get('key', '')
-    hwid = data.get('hwid', 'unknown')
-    return jsonify(validate_key(key, hwid))
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not all(validation_request(item) for item in items):
+        return jsonify({'error': 'Expected a list of {key, hwid} objects with string fields'}), 400
+    if len(items) > MAX_BATCH_VALIDATE:
+        return jsonify({'error': f'At most {MAX_BATCH_VALIDATE} items per batch'}), 400
+    # One token from the caller's IP bucket - batches come from integrations, not launchers
+    wait = throttle_wait()
+    if wait:
+        return too_many_requests(wait)
+    if FOLLOWER:
+        local = replica_validate([(str(item.get('key', '')).strip().upper(), item.get('hwid', 'unknown'))
+                                  for item in items])
+        return jsonify({'results': local}) if local is not None else forward_to_primary()
+    return admitted(lambda: {'results': validate_keys(items)})
+
+def throttle_wait(hwid=None, key=None):
+    """Seconds until this caller has budget again, 0 = go ahead"""
+    ip = admission.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    return ADMISSION.check(ip, hwid, key)[0]
+
+def too_many_requests(wait):
+    response = jsonify(admission.rejection(wait))
+    response.headers['Retry-After'] = admission.retry_after(wait)
+    return response, 429
+
+def admitted(validate, *args):
+    """Run a validation in one of VALIDATE_CONCURRENCY slots - shed with 429 when none frees up"""
+    if not ADMISSION.enter():
+        return too_many_requests(1)
+    try:
+        return jsonify(validate(*args))
+    finally:
+        ADMISSION.leave()
+
+def lease_request(data):
+    """(lease, hwid) of a /api/lease/verify body - None unless it's an object with string fields"""
+    if not isinstance(data, dict):
+        return None
+    lease, hwid = data.get('lease', ''), data.get('hwid', 'unknown')
+    if not isinstance(lease, str) or not isinstance(hwid, str):
+        return None
+    return lease, hwid
+
+@app.route('/api/lease/verify', methods=['POST'])
+def api_lease_verify():
+    """Re-check a lease from /api/validate; call /api/validate again once it lapses"""
+    parsed = lease_request(request.json)
+    if parsed is None:
+        return jsonify({'valid': False, 'message': 'lease and hwid must be strings'}), 400
+    watch_revocations()
+    return jsonify(verify_lease(*parsed))
 
 @app.route('/api/profiles/<hwid>', methods=['GET'])
 def get_profiles(hwid):
-    return jsonify(USER_PROFILES.get(hwid, {}))
+    """Stored bytes as-is; ETag is the profile version, so re-reads are 304s"""
+    version, body = STORE.profile_entry(hwid)
+    tag = f'p{version}'
+    return not_modified(tag) or etagged(Response(body or '{}', mimetype='application/json'), tag)
 
 @app.route('/api/profiles/<hwid>', methods=['POST'])
 def save_profiles(hwid):
-    global _data_modified
+    """Replace the whole profile document"""
     data = request.json
-    USER_PROFILES[hwid] = data
-    _data_modified = True
-    save_data(force=True)
-    return jsonify({'success': True})
+    return profile_write(hwid, lambda current: data)
+
+@app.route('/api/profiles/<hwid>', methods=['PATCH'])
+def patch_profiles(hwid):
+    """JSON merge patch (RFC 7386) - e.g. {"primary": {"sens": 1.4}}; null deletes a field"""
+    patch = request.get_json(force=True, silent=True)
+    if not isinstance(patch, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    return profile_write(hwid, lambda current: merge_patch(current, patch))
+
+def profile_write(hwid, change):
+    """Apply `change` atomically; If-Match: "p<version>" makes it conditional"""
+    status, body, version = profile_update(hwid, change, request.if_match)
+    response = jsonify(body)
+    if version is not None:
+        response.set_etag(f'p{version}')
+    return response, status
+
+def profile_update(hwid, change, if_match):
+    """(HTTP status, JSON body, version or None) - shared with asgi.py"""
+    expect = None
+    if if_match and not if_match.star_tag:
+        tags = list(if_match)
+        expect = int(tags[0][1:]) if len(tags) == 1 and tags[0][1:].isdigit() else -1
+
+    result, version, body = STORE.update_profile(hwid, change, expect)
+    if result == 'conflict':
+        return 412, {'success': False, 'error': 'Profile changed', 'version': version}, version
+    if result == 'failed':
+        return 500, {'success': False, 'error': 'Save failed'}, None
+    return 200, {'success': True, 'version': version}, version
+
+def merge_patch(target, patch):
+    """RFC 7386: objects merge recursively, null removes, anything else replaces"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for name, value in patch.items():
+        if value is None:
+            result.pop(name, None)
+        else:
+            result[name] = merge_patch(result.get(name), value)
+    return result
 
 # ============================================================================
 # ADMIN PANEL
@@ -331,7 +849,7 @@ def admin_login():
         return ('Admin Access Required', 401, {
             'WWW-Authenticate': 'Basic realm="ATLAS Admin"'
         })
-    return render_template_string(ADMIN_HTML)
+    return serve_page(PAGES['admin'], 'private')
 
 @app.route('/admin/api/stats')
 def admin_stats():
@@ -339,24 +857,174 @@ def admin_stats():
     if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    now = datetime.now()
-    expired = sum(1 for v in KEYS.values() if datetime.fromisoformat(v['expiry']) < now)
+    return etagged(jsonify(admin_stats_payload()))
 
-    return jsonify({
-        'total': len(KEYS),
-        'used': sum(1 for k in KEYS if KEYS[k].get('used')),
-        'available': len(KEYS) - sum(1 for k in KEYS if KEYS[k].get('used')),
-        'expired': expired,
-        'validations': STATS.get('validations', 0),
-        'generations': STATS.get('generations', 0)
-    })
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text format, summed over every worker (scrape with basic_auth)"""
+    auth = request.authorization
+    if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    total = STORE.key_count()
+    used = STORE.used_count()
+    expired = STORE.expired_count(time.time())
+    gauges = [
+        ('atlas_keys', 'Keys in the store by state', {'state': 'total'}, total),
+        ('atlas_keys', 'Keys in the store by state', {'state': 'used'}, used),
+        ('atlas_keys', 'Keys in the store by state', {'state': 'expired'}, expired),
+        ('atlas_archived_keys', 'Keys in the archive', {}, ARCHIVE.count()),
+        ('atlas_profiles', 'HWID profiles in the store', {}, STORE.profile_count()),
+    ]
+    if PRIMARY:
+        gauges.append(('atlas_replication_offset', 'Journal records streamed to replicas', {'role': 'primary'},
+                       PRIMARY.current()))
+        gauges.append(('atlas_replication_followers', 'Connected replicas', {}, PRIMARY.followers))
+    if FOLLOWER:
+        gauges.append(('atlas_replication_offset', 'Journal records applied from the primary',
+                       {'role': 'replica'}, FOLLOWER.offset or 0))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/api/events')
+def admin_events():
+    """Live counters plus generated / activated / deleted / expired key events"""
+    auth = request.authorization
+    if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    return sse_stream({'stats', 'generated', 'activated', 'deleted', 'expired'},
+                      [('stats', admin_stats_payload())])
+
+def etagged(response, tag=None):
+    """Strong ETag + revalidate-every-time; unchanged payloads become 304s"""
+    if tag:
+        response.set_etag(tag)
+    else:
+        response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def not_modified(tag):
+    """Answer 304 before doing any work if the client already has `tag`"""
+    # Weak comparison (RFC 9110) - gzip'd responses carry W/"tag"
+    if request.if_none_match.contains_weak(tag):
+        response = Response(status=304)
+        response.set_etag(tag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+def encode_cursor(value, key):
+    return base64.urlsafe_b64encode(json.dumps([value, key]).encode()).decode()
+
+def decode_cursor(cursor):
+    value, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return float(value), str(key)
+
+def key_row(key, rec, now):
+    row = rec.to_json()
+    row['key'] = key
+    row['status'] = storage.key_status(rec, now)
+    return row
 
 @app.route('/admin/api/keys', methods=['GET'])
 def admin_get_keys():
+    """
+    Paginated key list:
+      ?limit=100&cursor=<next_cursor>&sort=created|expiry&order=desc|asc
+      &status=unused|active|expired&duration=7days&hwid=<prefix>&prefix=<key prefix>
+    ?format=ndjson streams every matching key instead (full export).
+    ?since=<version> returns only keys created / activated / updated / deleted since then.
+    """
     auth = request.authorization
     if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
         return jsonify({'error': 'Unauthorized'}), 401
-    return jsonify(KEYS)
+
+    args = request.args
+    sort = args.get('sort', 'created')
+    status = args.get('status') or None
+    if sort not in storage.KEY_SORTS or (status and status not in storage.KEY_STATUSES):
+        return jsonify({'error': 'Invalid sort or status'}), 400
+
+    now = time.time()
+    version = STORE.version()
+    if args.get('since') is not None:
+        return key_changes(args['since'], version, now)
+
+    filters = {
+        'status': status,
+        'duration': args.get('duration') or None,
+        'hwid_prefix': args.get('hwid') or None,
+        'key_prefix': (args.get('prefix') or '').strip().upper() or None,
+    }
+
+    if args.get('format') == 'ndjson':
+        def stream():
+            for key, rec in STORE.iter_keys():
+                if storage.key_matches(key, rec, now, **filters):
+                    yield json.dumps(key_row(key, rec, now)) + '\n'
+        return Response(stream(), mimetype='application/x-ndjson', headers={
+            'Content-Disposition': 'attachment; filename=keys.ndjson'
+        })
+
+    # Statuses also change as keys age, so the expired count is part of the tag
+    tag = hashlib.sha1(f"{version}:{STORE.expired_count(now)}:{request.query_string}".encode()).hexdigest()
+    cached = not_modified(tag)
+    if cached:
+        return cached
+
+    try:
+        limit = min(max(int(args.get('limit', 100)), 1), 1000)
+        after = decode_cursor(args['cursor']) if args.get('cursor') else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+
+    page = STORE.query_keys(sort, args.get('order', 'desc') != 'asc', after, limit, now=now, **filters)
+    next_cursor = None
+    if len(page) == limit:
+        last_key, last_rec = page[-1]
+        next_cursor = encode_cursor(getattr(last_rec, sort) or 0.0, last_key)
+
+    return etagged(jsonify({
+        'keys': [key_row(key, rec, now) for key, rec in page],
+        'next_cursor': next_cursor,
+        'total': STORE.key_count(),
+        'version': version
+    }), tag)
+
+def key_changes(since, version, now):
+    """Delta feed for the admin list - latest state of each key touched since `since`"""
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'error': 'Invalid since'}), 400
+
+    tag = f"{since}:{version}:{STORE.expired_count(now)}"
+    cached = not_modified(tag)
+    if cached:
+        return cached
+
+    changes = STORE.changes_since(since)
+    if changes is None:
+        return etagged(jsonify({'version': version, 'resync': True, 'changes': []}), tag)
+
+    latest = {}
+    for v, op, key in changes:
+        latest.pop(key, None)
+        latest[key] = op
+        version = max(version, v)
+
+    rows = []
+    for key, op in latest.items():
+        rec = None if op == 'deleted' else STORE.get_key(key)
+        if rec is None:
+            rows.append({'key': key, 'op': 'deleted'})
+        else:
+            row = key_row(key, rec, now)
+            row['op'] = op
+            rows.append(row)
+
+    return etagged(jsonify({'version': version, 'resync': False, 'changes': rows}), tag)
 
 @app.route('/admin/api/generate', methods=['POST'])
 def admin_generate():
@@ -364,27 +1032,245 @@ def admin_generate():
     if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    data = request.json
-    count = min(int(data.get('count', 1)), 100)
+    data = request.json or {}
     duration = data.get('duration', '7days')
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid count'}), 400
+
+    if count < 1:
+        return jsonify({'success': False, 'message': 'count must be at least 1'}), 400
+    count = min(count, 100)    # larger drops: /admin/api/generate/batch
+    if duration not in DURATIONS:
+        return jsonify({'success': False, 'message': 'Invalid duration'}), 400
 
-    new_keys = [generate_key(duration) for _ in range(count)]
+    new_keys = generate_keys(count, duration)
     return jsonify({'success': True, 'keys': new_keys, 'duration': duration})
 
+@app.route('/admin/api/generate/batch', methods=['POST'])
+def admin_generate_batch():
+    """
+    Large key drops: {"count": 50000, "duration": "30days", "format": "ndjson"}
+    Keys are committed in one write, then streamed back as json, ndjson or csv.
+    """
+    auth = request.authorization
+    if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.json or {}
+    duration = data.get('duration', '7days')
+    fmt = data.get('format', 'json')
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid count'}), 400
+
+    if count < 1 or count > MAX_BATCH_GENERATE:
+        return jsonify({'success': False, 'message': f'count must be 1-{MAX_BATCH_GENERATE}'}), 400
+    if duration not in DURATIONS:
+        return jsonify({'success': False, 'message': 'Invalid duration'}), 400
+
+    new_keys = generate_keys(count, duration)
+    expiry = storage.iso(STORE.get_key(new_keys[0]).expiry)
+
+    if fmt == 'ndjson':
+        def stream():
+            for key in new_keys:
+                yield json.dumps({'key': key, 'duration': duration, 'expiry': expiry}) + '\n'
+        return Response(stream(), mimetype='application/x-ndjson')
+
+    if fmt == 'csv':
+        def stream():
+            yield 'key,duration,expiry\n'
+            for key in new_keys:
+                yield f'{key},{duration},{expiry}\n'
+        return Response(stream(), mimetype='text/csv', headers={
+            'Content-Disposition': f'attachment; filename=keys_{duration}_{count}.csv'
+        })
+
+    return jsonify({'success': True, 'keys': new_keys, 'duration': duration, 'expiry': expiry})
+
 @app.route('/admin/api/delete/<key>', methods=['DELETE'])
 def admin_delete(key):
-    global _data_modified
     auth = request.authorization
     if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    if key in KEYS:
-        del KEYS[key]
-        _data_modified = True
-        save_data(force=True)
+    if STORE.delete_key(key):
+        revoke_keys([key])
+        STORE.publish({'event': 'deleted', 'keys': [key]})
         return jsonify({'success': True})
     return jsonify({'success': False}), 404
 
+# Keys listed back in a bulk operation's response (the counts cover all of them)
+BULK_SAMPLE = 100
+
+# Largest expiry shift a bulk extend accepts, either way
+BULK_MAX_DAYS = 36500
+
+BULK_FILTERS = {'status', 'duration', 'hwid', 'hwid_prefix', 'key_prefix', 'keys',
+                'created_from', 'created_to', 'expiry_from', 'expiry_to'}
+
+def parse_bulk_filter(spec):
+    """Request "filter" object -> STORE.select_keys() arguments; ValueError when unusable"""
+    if not isinstance(spec, dict):
+        raise ValueError('filter must be an object')
+    unknown = set(spec) - BULK_FILTERS
+    if unknown:
+        raise ValueError(f"Unknown filter field: {', '.join(sorted(unknown))}")
+
+    selected = {}
+    if spec.get('status'):
+        if spec['status'] not in storage.KEY_STATUSES:
+            raise ValueError('Invalid status')
+        selected['status'] = spec['status']
+    if spec.get('duration'):
+        if spec['duration'] not in DURATIONS:
+            raise ValueError('Invalid duration')
+        selected['duration'] = spec['duration']
+    for field in ('hwid', 'hwid_prefix'):
+        if spec.get(field):
+            selected[field] = str(spec[field])
+    if spec.get('key_prefix'):
+        selected['key_prefix'] = str(spec['key_prefix']).strip().upper()
+    if spec.get('keys') is not None:
+        if not isinstance(spec['keys'], list):
+            raise ValueError('keys must be a list')
+        selected['keys'] = {str(key).strip().upper() for key in spec['keys']}
+    for field in ('created', 'expiry'):
+        low, high = spec.get(f'{field}_from'), spec.get(f'{field}_to')
+        if low or high:
+            try:
+                selected[field] = (storage.epoch(low), storage.epoch(high))
+            except (TypeError, ValueError):
+                raise ValueError(f'{field}_from / {field}_to must be ISO dates') from None
+    if not selected:
+        raise ValueError('filter must not be empty')
+    return selected
+
+def bulk_change(operation, body, now):
+    """
+    (change, revokes) for a non-delete operation: change(key, rec) for
+    STORE.update_keys() returns the new record or None to leave it, and
+    revokes says whether leases issued before it must stop working.
+    """
+    if operation == 'extend':
+        try:
+            days = float(body.get('days') or 0)
+        except (TypeError, ValueError):
+            days = 0
+        if not days or not math.isfinite(days) or abs(days) > BULK_MAX_DAYS:
+            raise ValueError(f'days must be a non-zero number up to {BULK_MAX_DAYS} either way')
+
+        def change(key, rec):
+            rec.expiry += days * 86400
+            return rec
+        # A lease never outlives the expiry it was issued against - only a cut needs revoking
+        return change, days < 0
+
+    if operation == 'reset_hwid':
+        def change(key, rec):
+            if not rec.used and rec.hwid is None:
+                return None
+            rec.used, rec.hwid, rec.activated = False, None, None
+            return rec
+        return change, True
+
+    if operation == 'set_duration':
+        duration = body.get('duration')
+        if duration not in DURATIONS:
+            raise ValueError('Invalid duration')
+
+        def change(key, rec):
+            expiry = (rec.created or now) + DURATIONS[duration].total_seconds()
+            if rec.duration == duration and rec.expiry == expiry:
+                return None
+            rec.duration, rec.expiry = duration, expiry
+            return rec
+        return change, True
+
+    raise ValueError('operation must be one of delete, extend, reset_hwid, set_duration')
+
+def bulk_keys(operation, selected, body, dry_run):
+    """
+    Apply `operation` to every key `selected` matches: one pass over an
+    index, then ONE durable write for all of them. Returns (matched count,
+    affected keys, whether their old leases are revoked).
+    """
+    now = time.time()
+    matched = list(STORE.select_keys(now, **selected))
+
+    def still_selected(key, rec):
+        # The key may have changed since the scan - filter what's being written
+        return storage.key_selected(key, rec, now, **selected)
+
+    if operation == 'delete':
+        if dry_run:
+            return len(matched), [key for key, _ in matched], True
+        doomed = [key for key, _ in matched]
+        verdicts = {}    # the last call per key wins - redis re-checks after a conflict
+
+        def predicate(key, rec):
+            verdicts[key] = still_selected(key, rec)
+            return verdicts[key]
+        STORE.remove_keys(doomed, predicate)
+        return len(matched), [key for key in doomed if verdicts.get(key)], True
+
+    change, revokes = bulk_change(operation, body, now)
+    if dry_run:
+        return len(matched), [key for key, rec in matched if change(key, rec.copy()) is not None], revokes
+
+    def recheck(key, rec):
+        return change(key, rec) if still_selected(key, rec) else None
+
+    updated = STORE.update_keys([key for key, _ in matched], recheck)
+    return len(matched), [key for key, _, _ in updated], revokes
+
+@app.route('/admin/api/keys/bulk', methods=['POST'])
+def admin_bulk_keys():
+    """
+    {"operation": "delete" | "extend" | "reset_hwid" | "set_duration",
+     "filter": {status, duration, hwid, hwid_prefix, key_prefix, keys,
+                created_from, created_to, expiry_from, expiry_to},
+     "days": 30, "duration": "30days", "dry_run": false}
+    Every matching key is changed in one durable write; dry_run only counts.
+    """
+    auth = request.authorization
+    if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    operation = body.get('operation')
+    dry_run = bool(body.get('dry_run'))
+    try:
+        selected = parse_bulk_filter(body.get('filter'))
+        matched, affected, revokes = bulk_keys(operation, selected, body, dry_run)
+    except ValueError as e:
+        # Every ValueError here carries a message written for the caller
+        return jsonify({'error': str(e)}), 400
+
+    if affected and not dry_run:
+        # Leases already handed out carry the old binding / expiry
+        event = 'deleted' if operation == 'delete' else 'revoked'
+        if revokes:
+            now = time.time()
+            revoke_keys(affected, now)
+            for i in range(0, len(affected), 1000):
+                STORE.publish({'event': event, 'keys': affected[i:i + 1000], 'at': now})
+        print(f"[INFO] Bulk {operation}: {len(affected)} of {matched} matching keys")
+
+    return jsonify({
+        'success': True,
+        'operation': operation,
+        'dry_run': dry_run,
+        'matched': matched,
+        'affected': len(affected),
+        'keys': affected[:BULK_SAMPLE],
+    })
+
 @app.route('/admin/api/backup', methods=['POST'])
 def admin_backup():
     auth = request.authorization
@@ -392,12 +1278,42 @@ def admin_backup():
         return jsonify({'error': 'Unauthorized'}), 401
 
     try:
-        create_backup()
-        save_data(force=True)
-        return jsonify({'success': True, 'message': 'Backup created'})
+        # Reads the live store - every change is already journaled, nothing to save first
+        create_backup(full=bool((request.get_json(silent=True) or {}).get('full')))
+        return jsonify({'success': True, 'message': 'Backup queued'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/admin/api/archive', methods=['GET'])
+def admin_archive():
+    """Archived records by ?key= or ?hwid= (support lookups)"""
+    auth = request.authorization
+    if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    key = request.args.get('key', '').strip().upper()
+    hwid = request.args.get('hwid', '').strip()
+    if not key and not hwid:
+        return jsonify({'error': 'key or hwid required'}), 400
+    return jsonify({'keys': ARCHIVE.lookup(key=key, hwid=hwid)})
+
+@app.route('/admin/api/rollups', methods=['GET'])
+def admin_rollups():
+    """
+    Counts over time - ?resolution=minute|hour|day (default hour), ?series=
+    validation,activation,generation (default all), ?limit= periods
+    """
+    auth = request.authorization
+    if not auth or auth.username != ADMIN_USER or auth.password != ADMIN_PASS:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    resolution = request.args.get('resolution', 'hour')
+    if resolution not in rollups.RESOLUTIONS:
+        return jsonify({'error': f"resolution must be one of {', '.join(rollups.RESOLUTIONS)}"}), 400
+    groups = {name.strip() for name in request.args.get('series', '').split(',') if name.strip()}
+    limit = request.args.get('limit', type=int)
+    return jsonify(ROLLUPS.query(resolution, groups or None, limit))
+
 # ============================================================================
 # HTML TEMPLATES
 # ============================================================================
@@ -488,8 +1404,22 @@ INDEX_HTML = """
                 document.getElementById('statusText').textContent = 'Server Offline';
             }
         }
-        checkStatus();
-        setInterval(checkStatus, 10000);
+        function showStatus(data) {
+            document.getElementById('statusBar').className = 'status-bar';
+            document.getElementById('statusText').textContent = `Server Online • ${data.keys_total} keys`;
+        }
+        if (window.EventSource) {
+            // Server pushes status changes; EventSource reconnects by itself
+            const events = new EventSource('/api/events');
+            events.addEventListener('status', e => showStatus(JSON.parse(e.data)));
+            events.onerror = () => {
+                document.getElementById('statusBar').className = 'status-bar offline';
+                document.getElementById('statusText').textContent = 'Server Offline';
+            };
+        } else {
+            checkStatus();
+            setInterval(checkStatus, 10000);
+        }
         async function validateKey() {
             const key = keyInput.value.trim();
             if (key.length < 24) {
@@ -575,6 +1505,7 @@ ADMIN_HTML = """
             <div class="stat-card"><div class="stat-value" id="statUsed">0</div><div class="stat-label">Used</div></div>
             <div class="stat-card"><div class="stat-value" id="statAvailable">0</div><div class="stat-label">Available</div></div>
             <div class="stat-card"><div class="stat-value" id="statExpired">0</div><div class="stat-label">Expired</div></div>
+            <div class="stat-card"><div class="stat-value" id="statArchived">0</div><div class="stat-label">Archived</div></div>
         </div>
         <div class="panel">
             <h2>Generate Keys</h2>
@@ -602,17 +1533,66 @@ ADMIN_HTML = """
         </div>
         <div class="panel">
             <h2>All Keys</h2>
+            <div class="form-row">
+                <input type="text" id="filterPrefix" placeholder="Key prefix" oninput="loadKeys()">
+                <input type="text" id="filterHwid" placeholder="HWID prefix" oninput="loadKeys()">
+                <select id="filterStatus" onchange="loadKeys()">
+                    <option value="">Any status</option>
+                    <option value="unused">Unused</option>
+                    <option value="active">Active</option>
+                    <option value="expired">Expired</option>
+                </select>
+                <select id="filterDuration" onchange="loadKeys()">
+                    <option value="">Any duration</option>
+                    <option value="1hour">1 Hour</option>
+                    <option value="1day">1 Day</option>
+                    <option value="7days">7 Days</option>
+                    <option value="30days">30 Days</option>
+                    <option value="365days">365 Days</option>
+                    <option value="lifetime">Lifetime</option>
+                </select>
+                <select id="filterSort" onchange="loadKeys()">
+                    <option value="created">Newest first</option>
+                    <option value="expiry">By expiry</option>
+                </select>
+                <button class="secondary" onclick="exportKeys()">Export NDJSON</button>
+            </div>
+            <div class="form-row" style="margin-top:8px;">
+                <select id="bulkOp">
+                    <option value="extend">Extend by days</option>
+                    <option value="reset_hwid">Reset HWID</option>
+                    <option value="set_duration">Set duration</option>
+                    <option value="delete">Delete</option>
+                </select>
+                <input type="number" id="bulkDays" value="30" placeholder="Days">
+                <select id="bulkDuration">
+                    <option value="1hour">1 Hour</option>
+                    <option value="1day">1 Day</option>
+                    <option value="7days">7 Days</option>
+                    <option value="30days" selected>30 Days</option>
+                    <option value="365days">365 Days</option>
+                    <option value="lifetime">Lifetime</option>
+                </select>
+                <button class="secondary" onclick="bulkKeys()">Apply to filtered keys</button>
+            </div>
+            <div id="bulkStatus" style="margin-top:6px;font-size:12px;color:#6b6b7b;"></div>
             <div class="key-list" id="keyList"></div>
+            <div class="form-row" style="margin-top:12px;">
+                <button class="secondary" id="loadMore" onclick="loadKeys(nextCursor)" style="display:none;">Load more</button>
+            </div>
         </div>
     </div>
     <script>
         async function loadStats() {
             const res = await fetch('/admin/api/stats');
-            const data = await res.json();
+            showStats(await res.json());
+        }
+        function showStats(data) {
             document.getElementById('statTotal').textContent = data.total;
             document.getElementById('statUsed').textContent = data.used;
             document.getElementById('statAvailable').textContent = data.available;
             document.getElementById('statExpired').textContent = data.expired;
+            document.getElementById('statArchived').textContent = data.archived;
         }
         async function generateKeys() {
             const count = document.getElementById('genCount').value;
@@ -624,66 +1604,168 @@ ADMIN_HTML = """
             });
             const data = await res.json();
             const box = document.getElementById('generatedBox');
+            if (!data.success) return alert(data.message);
             box.innerHTML = data.keys.join('<br>');
             box.classList.add('show');
             loadStats();
-            loadKeys();
+            syncKeys();
         }
         async function backupNow() {
             const status = document.getElementById('backupStatus');
-            status.textContent = 'Creating backup...';
+            status.textContent = 'Queueing backup...';
             const res = await fetch('/admin/api/backup', {method: 'POST'});
             const data = await res.json();
-            status.textContent = data.success ? '✅ Backup created!' : '❌ Backup failed';
+            status.textContent = data.success ? '✅ Backup queued!' : '❌ Backup failed';
             setTimeout(() => status.textContent = '', 3000);
         }
-        async function loadKeys() {
-            const res = await fetch('/admin/api/keys');
-            const keys = await res.json();
+        let nextCursor = null;
+        let keyVersion = null;
+        const badges = {unused: ['unused', 'Unused'], active: ['used', 'Active'], expired: ['expired', 'Expired']};
+        function renderKey(k) {
+            const [badge, statusText] = badges[k.status];
+            return `<div class="key-item" data-key="${k.key}"><div class="key-info"><div class="key-code">${k.key} <span class="badge badge-${badge}">${statusText}</span></div><div class="key-meta">Created: ${new Date(k.created).toLocaleDateString()} | Expires: ${new Date(k.expiry).toLocaleDateString()}</div></div><button class="danger" onclick="deleteKey('${k.key}')">Delete</button></div>`;
+        }
+        function matchesFilters(k) {
+            const p = keyFilters();
+            return (!p.get('prefix') || k.key.startsWith(p.get('prefix').toUpperCase()))
+                && (!p.get('hwid') || (k.hwid || '').startsWith(p.get('hwid')))
+                && (!p.get('status') || k.status === p.get('status'))
+                && (!p.get('duration') || k.duration === p.get('duration'));
+        }
+        function keyFilters() {
+            const params = new URLSearchParams();
+            const filters = {prefix: 'filterPrefix', hwid: 'filterHwid', status: 'filterStatus', duration: 'filterDuration', sort: 'filterSort'};
+            for (const [name, id] of Object.entries(filters)) {
+                const value = document.getElementById(id).value.trim();
+                if (value) params.set(name, value);
+            }
+            if (params.get('sort') === 'expiry') params.set('order', 'asc');
+            return params;
+        }
+        async function loadKeys(cursor) {
+            const params = keyFilters();
+            params.set('limit', 100);
+            if (cursor) params.set('cursor', cursor);
+            const res = await fetch('/admin/api/keys?' + params);
+            const data = await res.json();
+            const list = document.getElementById('keyList');
+            const html = data.keys.map(renderKey).join('');
+            list.innerHTML = cursor ? list.innerHTML + html : html;
+            if (!cursor) keyVersion = data.version;
+            nextCursor = data.next_cursor;
+            document.getElementById('loadMore').style.display = nextCursor ? '' : 'none';
+        }
+        function exportKeys() {
+            const params = keyFilters();
+            params.set('format', 'ndjson');
+            window.location = '/admin/api/keys?' + params;
+        }
+        async function bulkKeys() {
+            const params = keyFilters();
+            const filter = {};
+            for (const [param, field] of [['prefix', 'key_prefix'], ['hwid', 'hwid_prefix'], ['status', 'status'], ['duration', 'duration']]) {
+                if (params.get(param)) filter[field] = params.get(param);
+            }
+            if (!Object.keys(filter).length) return alert('Set a filter first');
+            const op = document.getElementById('bulkOp').value;
+            const body = {operation: op, filter: filter,
+                          days: parseFloat(document.getElementById('bulkDays').value),
+                          duration: document.getElementById('bulkDuration').value};
+            const run = async dryRun => (await fetch('/admin/api/keys/bulk', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(Object.assign({dry_run: dryRun}, body))
+            })).json();
+            const preview = await run(true);
+            if (preview.error) return alert(preview.error);
+            if (!preview.affected) return alert('No matching keys need changing');
+            const label = document.getElementById('bulkOp').selectedOptions[0].text;
+            if (!confirm(`${label}: ${preview.affected} keys?`)) return;
+            const data = await run(false);
+            document.getElementById('bulkStatus').textContent = data.error ? '❌ ' + data.error : `✅ ${data.affected} keys changed`;
+            syncKeys();
+            loadStats();
+        }
+        async function syncKeys() {
+            if (keyVersion === null) return loadKeys();
+            const res = await fetch('/admin/api/keys?since=' + keyVersion);
+            const data = await res.json();
+            if (data.resync) return loadKeys();
             const list = document.getElementById('keyList');
-            list.innerHTML = Object.entries(keys).sort((a,b) => new Date(b[1].created) - new Date(a[1].created)).map(([key, data]) => {
-                const now = new Date();
-                const expiry = new Date(data.expiry);
-                const isExpired = expiry < now;
-                let status = data.used ? (isExpired ? 'expired' : 'used') : 'unused';
-                let statusText = data.used ? (isExpired ? 'Expired' : 'Active') : 'Unused';
-                return `<div class="key-item"><div class="key-info"><div class="key-code">${key} <span class="badge badge-${status}">${statusText}</span></div><div class="key-meta">Created: ${new Date(data.created).toLocaleDateString()} | Expires: ${expiry.toLocaleDateString()}</div></div><button class="danger" onclick="deleteKey('${key}')">Delete</button></div>`;
-            }).join('');
+            const newestFirst = document.getElementById('filterSort').value === 'created';
+            for (const k of data.changes) {
+                const row = list.querySelector(`[data-key="${k.key}"]`);
+                if (k.op === 'deleted' || !matchesFilters(k)) {
+                    if (row) row.remove();
+                } else if (row) {
+                    row.outerHTML = renderKey(k);
+                } else if (k.op === 'created') {
+                    if (!newestFirst) return loadKeys();
+                    list.insertAdjacentHTML('afterbegin', renderKey(k));
+                }
+            }
+            keyVersion = data.version;
         }
         async function deleteKey(key) {
             if (!confirm('Delete this key?')) return;
             await fetch('/admin/api/delete/' + key, {method: 'DELETE'});
-            loadKeys();
+            syncKeys();
             loadStats();
         }
         loadStats();
         loadKeys();
-        setInterval(() => { loadStats(); loadKeys(); }, 30000);
+        let syncTimer = null;
+        function scheduleSync() {
+            // Coalesce bursts (e.g. a 10k key drop) into one delta fetch
+            if (!syncTimer) syncTimer = setTimeout(() => { syncTimer = null; syncKeys(); }, 500);
+        }
+        if (window.EventSource) {
+            const events = new EventSource('/admin/api/events');
+            events.addEventListener('stats', e => showStats(JSON.parse(e.data)));
+            for (const name of ['generated', 'activated', 'deleted', 'expired']) {
+                events.addEventListener(name, scheduleSync);
+            }
+        } else {
+            setInterval(() => { loadStats(); syncKeys(); }, 30000);
+        }
     </script>
 </body>
 </html>
 """
 
+# Built at import, so a preloaded gunicorn master does it once for every worker
+PAGES = {'index': prerender(INDEX_HTML), 'admin': prerender(ADMIN_HTML)}
+
 # ============================================================================
 # STARTUP
 # ============================================================================
 
 if __name__ == '__main__':
-    ensure_dirs()
-    load_data()
-
-    threading.Thread(target=auto_save_worker, daemon=True).start()
+    start_threads()
 
     port = int(os.environ.get('PORT', 10000))
     print(f"\n🚀 ATLAS Key System (BULLETPROOF) starting on port {port}")
     print(f"📊 Admin panel: http://localhost:{port}/admin")
     print(f"🔑 Default admin: {ADMIN_USER} / {'*' * len(ADMIN_PASS)}")
-    print(f"💾 Data directory: {BASE_DIR}")
+    print(f"💾 Data directory: {DATA_DIR} ({STORE.name} storage)")
     print(f"📁 Backup directory: {BACKUP_DIR}")
     print(f"\n⚡ PERSISTENCE FEATURES:")
-    print(f"   ✓ Immediate save on every change")
+    print(f"   ✓ Immediate save on every change (append-only journal)")
     print(f"   ✓ Atomic file writes (crash-proof)")
-    print(f"   ✓ Automatic .bak files")
+    print(f"   ✓ mmap'd binary key snapshot (restart time flat in key count)")
+    print(f"   ✓ Automatic .bak files (hard links)")
+    print(f"   ✓ Incremental gzip backups every {backups.BACKUP_INTERVAL:g}s (background)")
+    print(f"   ✓ Expired keys archived after {archive.ARCHIVE_AFTER / 86400:g} days (gzip, append-only)")
+    print(f"   ✓ Pre-rendered pages, {'brotli / ' if brotli else ''}gzip + ETags")
+    if PRIMARY:
+        print(f"   ✓ Streaming to read replicas on {replication.REPLICATION_LISTEN}")
+    if FOLLOWER:
+        print(f"   ✓ Read replica of {replication.REPLICA_OF} (writes -> {replication.PRIMARY_URL})")
+    if ADMISSION.enabled:
+        print(f"   ✓ /api/validate throttled per IP / HWID / key prefix "
+              f"({'shared in redis' if ADMISSION.shared else 'per process'}), 429 + Retry-After")
+    print(f"   ✓ ASGI mode for many keep-alive clients: uvicorn asgi:app")
+    print(f"   ✓ Bulk key operations by filter, one write each: POST /admin/api/keys/bulk")
     print(f"   ✓ Graceful shutdown handling")
     print(f"   ✓ Corruption auto-recovery")
     print(f"\nPress Ctrl+C to stop (data will be saved)\n")
@@ -0,0 +1,195 @@
+"""
+ARCHIVE - cold storage for expired keys, moved out of the hot table by the reaper
+
+  archive/<YYYYMM>.ndjson.gz   append-only; one gzip member per reaper batch
+  archive/index.db             key -> hwid, expiry, file, offset (SQLite)
+
+Records keep the keys.json schema plus `key` and `archived`. Lookups by key
+or HWID go through the index, then decompress only the batch holding the
+record. The archive lives in DATA_DIR, so with redis on several hosts put
+ARCHIVE_DIR on storage they all see.
+"""
+
+import os
+import json
+import gzip
+import zlib
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+import metrics
+import storage
+
+try:
+    import fcntl
+except ImportError:    # Windows - single process there anyway
+    fcntl = None
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(storage.DATA_DIR, 'archive'))
+
+# Seconds past expiry before a key is archived (support can still see it in the admin list until then)
+ARCHIVE_AFTER = float(os.environ.get('ARCHIVE_AFTER', 7 * 86400))
+
+# Seconds between reaper passes, 0 = never reap
+REAP_INTERVAL = float(os.environ.get('REAP_INTERVAL', 600))
+
+# Keys per archive batch (one gzip member, one store write)
+REAP_BATCH = int(os.environ.get('REAP_BATCH', 1000))
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived (
+    key      TEXT PRIMARY KEY,
+    hwid     TEXT,
+    expiry   TEXT NOT NULL,
+    archived TEXT NOT NULL,
+    file     TEXT NOT NULL,
+    offset   INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS archived_hwid ON archived (hwid) WHERE hwid IS NOT NULL;
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('archived', 0);
+"""
+
+class KeyArchive:
+    """Append-only archive of key records; every process gets its own index connection"""
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.db')
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(ARCHIVE_SCHEMA)
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def add(self, items):
+        """
+        Archive [(key, KeyRecord)] - the batch is fsynced and indexed before
+        this returns. Caller holds the reaper lock (one appender at a time).
+        """
+        now = datetime.now()
+        name = now.strftime('%Y%m') + '.ndjson.gz'
+        archived = now.isoformat()
+        lines = [json.dumps(dict(rec.to_json(), key=key, archived=archived), separators=(',', ':'))
+                 for key, rec in items]
+        member = gzip.compress(('\n'.join(lines) + '\n').encode())
+
+        started = time.perf_counter()
+        with open(os.path.join(self.directory, name), 'ab') as f:
+            offset = f.tell()
+            f.write(member)
+            f.flush()
+            storage.fsync(f, 'archive')
+        metrics.observe('atlas_write_duration_seconds', time.perf_counter() - started, file='archive')
+        metrics.inc('atlas_write_bytes_total', len(member), file='archive')
+
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO archived (key, hwid, expiry, archived, file, offset) '
+                           'VALUES (?, ?, ?, ?, ?, ?)',
+                           [(key, rec.hwid, storage.iso(rec.expiry), archived, name, offset) for key, rec in items])
+            db.execute("UPDATE counters SET value = value + ? WHERE name = 'archived'", (db.total_changes - before,))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def has(self, key):
+        return self.db.execute('SELECT 1 FROM archived WHERE key = ?', (key,)).fetchone() is not None
+
+    def among(self, keys):
+        """The subset of `keys` that is archived"""
+        keys = list(keys)
+        found = set()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            found.update(row[0] for row in self.db.execute(
+                f"SELECT key FROM archived WHERE key IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def count(self):
+        return self.db.execute("SELECT value FROM counters WHERE name = 'archived'").fetchone()[0]
+
+    def lookup(self, key=None, hwid=None, limit=100):
+        """Archived records for a key or an HWID (support lookups), newest expiry first"""
+        if key:
+            rows = self.db.execute('SELECT key, file, offset FROM archived WHERE key = ?', (key,)).fetchall()
+        else:
+            rows = self.db.execute('SELECT key, file, offset FROM archived WHERE hwid = ? '
+                                   'ORDER BY expiry DESC LIMIT ?', (hwid, limit)).fetchall()
+        wanted = {}
+        for k, name, offset in rows:
+            wanted.setdefault((name, offset), set()).add(k)
+        found = []
+        for (name, offset), keys in wanted.items():
+            found.extend(rec for rec in self.read_member(name, offset) if rec['key'] in keys)
+        return sorted(found, key=lambda rec: rec['expiry'], reverse=True)
+
+    def read_member(self, name, offset):
+        """Decompress the one gzip member (reaper batch) starting at `offset`"""
+        d = zlib.decompressobj(wbits=31)
+        chunks = []
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            f.seek(offset)
+            while not d.eof:
+                block = f.read(65536)
+                if not block:
+                    break
+                chunks.append(d.decompress(block))
+        return [json.loads(line) for line in b''.join(chunks).decode().splitlines() if line]
+
+class Reaper:
+    """
+    Background thread: every REAP_INTERVAL, archive keys that expired more
+    than ARCHIVE_AFTER ago, in REAP_BATCH batches, then drop them from the store.
+    """
+
+    def __init__(self, store, archive):
+        self.store = store
+        self.archive = archive
+        self.pid = None
+
+    def start(self):
+        if REAP_INTERVAL:
+            storage.start_once(self, self._loop)
+
+    def _loop(self):
+        while True:
+            time.sleep(REAP_INTERVAL)
+            try:
+                self.run()
+            except Exception as e:
+                print(f"[ERROR] Reaper failed: {e}")
+
+    def run(self, now=None):
+        """One pass - returns the number of keys archived (0 if another worker is reaping)"""
+        cutoff = (time.time() if now is None else now) - ARCHIVE_AFTER
+        os.makedirs(self.archive.directory, exist_ok=True)
+        with open(os.path.join(self.archive.directory, '.lock'), 'w') as lock:
+            if fcntl:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0
+            total = 0
+            while True:
+                moved = self.store.reap(cutoff, REAP_BATCH, self.archive.add)
+                total += moved
+                if moved < REAP_BATCH:
+                    break
+        if total:
+            metrics.inc('atlas_archived_keys_total', total)
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] 🗄️ Archived {total} expired keys")
+        return total
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+ATLAS KEY SYSTEM - ASGI ENTRY POINT
+
+    uvicorn asgi:app --host 0.0.0.0 --port 10000 --timeout-keep-alive 75
+    python asgi.py
+
+One event loop holds every connection, so thousands of launchers polling
+/api/status or keeping /api/events open cost a coroutine each instead of a
+thread each. The client routes are async handlers here; whatever may block -
+storage (journal fsync, redis, sqlite) - runs on a pool of ASGI_THREADS
+threads, so the loop never waits on disk.
+
+The admin API and pages are the Flask app itself, called through a small
+WSGI bridge on that same pool: one set of handlers, served by app.py /
+gunicorn or by this. app.py keeps working unchanged.
+"""
+
+import os
+import io
+import re
+import sys
+import json
+import gzip
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from werkzeug.datastructures import Authorization
+from werkzeug.http import parse_accept_header, parse_etags
+
+import app as atlas
+import metrics
+import admission
+
+# Threads for storage calls and Flask routes - the bound on blocking work in flight
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+
+# Request bodies over this many bytes get a 413 (nothing the API takes comes close)
+ASGI_MAX_BODY = int(os.environ.get('ASGI_MAX_BODY', 1 << 20))
+
+# Seconds an idle keep-alive connection stays open (python asgi.py only)
+ASGI_KEEP_ALIVE = int(os.environ.get('ASGI_KEEP_ALIVE', 75))
+
+EXECUTOR = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='atlas-io')
+
+# What app.py's after_request hooks / flask_cors add to every response
+CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Headers', 'Content-Type,Authorization,If-Match,If-None-Match'),
+    ('Access-Control-Allow-Methods', 'GET,PUT,POST,PATCH,DELETE,OPTIONS'),
+    ('Access-Control-Expose-Headers', 'ETag'),
+]
+
+async def blocking(fn, *args):
+    """fn(*args) on the bounded pool - the loop keeps serving meanwhile"""
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, partial(fn, *args))
+
+# ============================================================================
+# REQUEST / RESPONSE
+# ============================================================================
+
+class Request:
+    """One HTTP exchange: the scope and body in, send() out"""
+
+    def __init__(self, scope, body, receive, send):
+        self.scope = scope
+        self.body = body
+        self.receive = receive
+        self.send = send
+        self.headers = {}
+        for name, value in scope['headers']:
+            self.headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            return None
+
+    def authorized(self):
+        auth = Authorization.from_header(self.headers.get('authorization'))
+        return auth is not None and auth.username == atlas.ADMIN_USER and auth.password == atlas.ADMIN_PASS
+
+    def accepts(self, encoding):
+        return bool(parse_accept_header(self.headers.get('accept-encoding'))[encoding])
+
+    async def start(self, status, headers):
+        await self.send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+
+    async def write(self, data, more=True):
+        await self.send({'type': 'http.response.body', 'body': data, 'more_body': more})
+
+    async def respond(self, status, body=b'', content_type='application/json', headers=(), etag=None):
+        """Whole response at once; JSON is gzip'd past COMPRESS_MIN_SIZE like app.compress_json"""
+        headers = [('Content-Type', content_type)] + list(headers) + CORS_HEADERS
+        if status == 200 and content_type == 'application/json' and len(body) >= atlas.COMPRESS_MIN_SIZE:
+            headers.append(('Vary', 'Accept-Encoding'))
+            if self.accepts('gzip'):
+                body = gzip.compress(body, 6, mtime=0)
+                headers.append(('Content-Encoding', 'gzip'))
+                etag = etag and 'W/' + etag
+        if etag:
+            headers.append(('ETag', etag))
+        headers.append(('Content-Length', str(len(body))))
+        await self.start(status, headers)
+        await self.write(body, more=False)
+        return status
+
+    async def reply(self, obj, status=200, **kwargs):
+        return await self.respond(status, json.dumps(obj).encode(), **kwargs)
+
+    async def disconnected(self):
+        while (await self.receive())['type'] != 'http.disconnect':
+            pass
+
+async def read_body(receive):
+    """The whole request body, or None past ASGI_MAX_BODY"""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return b''
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > ASGI_MAX_BODY:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+# ============================================================================
+# WSGI BRIDGE - every route not handled below is the Flask app
+# ============================================================================
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ[name] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+async def bridge(req):
+    """Run the Flask app for this request on the pool and stream its response back"""
+    environ = wsgi_environ(req.scope, req.body)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    def first_chunk():
+        result = atlas.app(environ, start_response)
+        chunks = iter(result)
+        return result, chunks, next(chunks, None)
+
+    result, chunks, chunk = await blocking(first_chunk)
+    try:
+        await req.start(started['status'], started['headers'])
+        while chunk is not None:
+            if chunk:
+                await req.write(chunk)
+            chunk = await blocking(next, chunks, None)
+        await req.write(b'', more=False)
+    finally:
+        if hasattr(result, 'close'):
+            await blocking(result.close)
+    return started['status']
+
+# ============================================================================
+# LIVE EVENTS (SSE) - a coroutine per stream, fed from app.BUS
+# ============================================================================
+
+class LoopQueue:
+    """app.BUS subscriber queue that hands events to a coroutine on `loop`"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=256)
+
+    def put_nowait(self, item):
+        # Called from the event ticker / storage threads
+        try:
+            self.loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:
+            pass    # loop closed - the stream is gone
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            pass    # slow client - it will catch up from the next stats push
+
+async def sse(req, events, initial):
+    """text/event-stream until the client goes; a comment every 15 s keeps proxies from closing it"""
+    q = LoopQueue(asyncio.get_running_loop())
+    atlas.BUS.subscribe(events, q)
+    gone = asyncio.ensure_future(req.disconnected())
+    try:
+        await req.start(200, [('Content-Type', 'text/event-stream'), ('Cache-Control', 'no-cache'),
+                              ('X-Accel-Buffering', 'no')] + CORS_HEADERS)
+        text = 'retry: 3000\n\n' + ''.join(f'event: {event}\ndata: {json.dumps(data)}\n\n'
+                                           for event, data in initial)
+        while True:
+            await req.write(text.encode())
+            get = asyncio.ensure_future(q.queue.get())
+            done, _ = await asyncio.wait({get, gone}, timeout=15, return_when=asyncio.FIRST_COMPLETED)
+            if gone in done:
+                get.cancel()
+                break
+            if get in done:
+                event, data = get.result()
+                text = f'event: {event}\ndata: {json.dumps(data)}\n\n'
+            else:
+                get.cancel()
+                text = ': keepalive\n\n'
+    finally:
+        atlas.BUS.unsubscribe(q)
+        gone.cancel()
+    return 200
+
+# ============================================================================
+# ROUTES - same paths, names and answers as app.py
+# ============================================================================
+
+async def status(req):
+    payload = await blocking(atlas.status_payload)
+    return await req.reply(dict(payload, time=datetime.now().isoformat()))
+
+async def status_events(req):
+    payload = await blocking(atlas.status_payload)
+    return await sse(req, {'status'}, [('status', dict(payload, time=datetime.now().isoformat()))])
+
+async def api_validate(req):
+    parsed = atlas.validation_request(req.json())
+    if parsed is None:
+        return await req.reply({'valid': False, 'message': 'key and hwid must be strings'}, 400)
+    key, hwid = parsed
+    wait = await throttle_wait(req, hwid, key)
+    if wait:
+        return await too_many_requests(req, wait)
+    if atlas.FOLLOWER:
+        local = atlas.replica_validate([(key.strip().upper(), hwid)])
+        return await req.reply(local[0]) if local else await bridge(req)
+    return await admitted(req, atlas.validate_key, key, hwid)
+
+async def api_validate_batch(req):
+    data = req.json()
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not all(atlas.validation_request(item) for item in items):
+        return await req.reply({'error': 'Expected a list of {key, hwid} objects with string fields'}, 400)
+    if len(items) > atlas.MAX_BATCH_VALIDATE:
+        return await req.reply({'error': f'At most {atlas.MAX_BATCH_VALIDATE} items per batch'}, 400)
+    wait = await throttle_wait(req)
+    if wait:
+        return await too_many_requests(req, wait)
+    if atlas.FOLLOWER:
+        local = atlas.replica_validate([(str(item.get('key', '')).strip().upper(), item.get('hwid', 'unknown'))
+                                        for item in items])
+        return await req.reply({'results': local}) if local is not None else await bridge(req)
+    return await admitted(req, lambda: {'results': atlas.validate_keys(items)})
+
+async def throttle_wait(req, hwid=None, key=None):
+    ip = admission.client_ip((req.scope.get('client') or ('',))[0], req.headers.get('x-forwarded-for'))
+    if atlas.ADMISSION.shared:
+        return (await blocking(atlas.ADMISSION.check, ip, hwid, key))[0]
+    return atlas.ADMISSION.check(ip, hwid, key)[0]
+
+async def too_many_requests(req, wait):
+    return await req.reply(admission.rejection(wait), 429, headers=[('Retry-After', admission.retry_after(wait))])
+
+async def admitted(req, validate, *args):
+    # No waiting for a slot on the loop - shed at once
+    if not atlas.ADMISSION.enter(wait=0):
+        return await too_many_requests(req, 1)
+    try:
+        result = await blocking(validate, *args)
+    finally:
+        atlas.ADMISSION.leave()
+    return await req.reply(result)
+
+async def api_lease_verify(req):
+    # Signature + revocation check - pure CPU, fine on the loop
+    parsed = atlas.lease_request(req.json())
+    if parsed is None:
+        return await req.reply({'valid': False, 'message': 'lease and hwid must be strings'}, 400)
+    atlas.watch_revocations()
+    return await req.reply(atlas.verify_lease(*parsed))
+
+async def get_profiles(req, hwid):
+    version, body = await blocking(atlas.STORE.profile_entry, hwid)
+    tag = f'p{version}'
+    if parse_etags(req.headers.get('if-none-match')).contains_weak(tag):
+        return await req.respond(304, headers=[('Cache-Control', 'no-cache')], etag=f'"{tag}"')
+    return await req.respond(200, (body or '{}').encode(), headers=[('Cache-Control', 'no-cache')], etag=f'"{tag}"')
+
+async def save_profiles(req, hwid):
+    data = req.json()
+    return await profile_write(req, hwid, lambda current: data)
+
+async def patch_profiles(req, hwid):
+    patch = req.json()
+    if not isinstance(patch, dict):
+        return await req.reply({'success': False, 'error': 'Expected a JSON object'}, 400)
+    return await profile_write(req, hwid, lambda current: atlas.merge_patch(current, patch))
+
+async def profile_write(req, hwid, change):
+    status_code, body, version = await blocking(atlas.profile_update, hwid, change,
+                                                parse_etags(req.headers.get('if-match')))
+    return await req.reply(body, status_code, etag=None if version is None else f'"p{version}"')
+
+async def admin_events(req):
+    if not req.authorized():
+        return await req.reply({'error': 'Unauthorized'}, 401)
+    payload = await blocking(atlas.admin_stats_payload)
+    return await sse(req, {'stats', 'generated', 'activated', 'deleted', 'expired'}, [('stats', payload)])
+
+# (method, Flask rule, Flask endpoint, handler) - the rule is the metrics label
+ROUTES = [
+    ('GET', '/api/status', 'status', status),
+    ('GET', '/api/events', 'status_events', status_events),
+    ('POST', '/api/validate', 'api_validate', api_validate),
+    ('POST', '/api/validate/batch', 'api_validate_batch', api_validate_batch),
+    ('POST', '/api/lease/verify', 'api_lease_verify', api_lease_verify),
+    ('GET', '/api/profiles/<hwid>', 'get_profiles', get_profiles),
+    ('POST', '/api/profiles/<hwid>', 'save_profiles', save_profiles),
+    ('PATCH', '/api/profiles/<hwid>', 'patch_profiles', patch_profiles),
+    ('GET', '/admin/api/events', 'admin_events', admin_events),
+]
+COMPILED = [(method, re.compile('^' + re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', rule) + '$'), rule, endpoint, handler)
+            for method, rule, endpoint, handler in ROUTES]
+
+def match(method, path):
+    for route_method, pattern, rule, endpoint, handler in COMPILED:
+        if route_method == method:
+            m = pattern.match(path)
+            if m:
+                return rule, endpoint, handler, m.groupdict()
+    return None
+
+# ============================================================================
+# ASGI APPLICATION
+# ============================================================================
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            atlas.start_threads()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # app.emergency_save runs at exit, once the server has stopped
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    started = time.perf_counter()
+    body = await read_body(receive)
+    req = Request(scope, body, receive, send)
+    if body is None:
+        await req.reply({'error': 'Request body too large'}, 413)
+        return
+
+    route = match(scope['method'], scope['path'])
+    if route is None or (atlas.FOLLOWER and route[1] not in atlas.REPLICA_ENDPOINTS):
+        await bridge(req)    # Flask records its own metrics
+        return
+
+    rule, _, handler, params = route
+    try:
+        code = await handler(req, **params)
+    except atlas.storage.CommitFailed as e:
+        print(f"[ERROR] {scope['method']} {scope['path']}: {e}")
+        code = await req.reply(atlas.SAVE_FAILED, 500)
+    except Exception as e:
+        print(f"[ERROR] {scope['method']} {scope['path']}: {e}")
+        code = await req.reply({'error': 'Internal server error'}, 500)
+    metrics.observe('atlas_http_request_duration_seconds', time.perf_counter() - started, route=rule)
+    metrics.inc('atlas_http_requests_total', route=rule, method=scope['method'], status=code)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 10000))
+    print(f"\n🚀 ATLAS Key System (ASGI) starting on port {port}")
+    print(f"💾 Data directory: {atlas.DATA_DIR} ({atlas.STORE.name} storage)")
+    print(f"⚡ {ASGI_THREADS} storage threads, keep-alive {ASGI_KEEP_ALIVE}s\n")
+    uvicorn.run(app, host='0.0.0.0', port=port, log_level='warning',
+                timeout_keep_alive=ASGI_KEEP_ALIVE, backlog=4096)
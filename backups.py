@@ -0,0 +1,216 @@
+"""
+BACKUPS - gzip'd full and incremental snapshots, written off the request path
+
+  backups/<stamp>.full.ndjson.gz   every key, profile and the stats
+  backups/<stamp>.incr.ndjson.gz   only keys / profiles written since the
+                                   previous backup (deleted keys as null)
+
+Line 1 of each file is a header; the rest are {"t": "k"|"p"|"s", "id", "v"}
+records. State at any retained point = the newest full at or before it plus
+every incremental after that full, applied in order (see restore.py).
+"""
+
+import os
+import json
+import gzip
+import time
+import threading
+from datetime import datetime
+
+import metrics
+import storage
+
+try:
+    import fcntl
+except ImportError:    # Windows - single process there anyway
+    fcntl = None
+
+# A new full base after this many incrementals
+BACKUP_FULL_EVERY = int(os.environ.get('BACKUP_FULL_EVERY', 24))
+
+# Full bases (each with its incrementals) kept on disk
+BACKUP_KEEP_FULL = int(os.environ.get('BACKUP_KEEP_FULL', 3))
+
+# Seconds between automatic backups, 0 = only on request / shutdown
+BACKUP_INTERVAL = float(os.environ.get('BACKUP_INTERVAL', 3600))
+
+SUFFIXES = {'.full.ndjson.gz': 'full', '.incr.ndjson.gz': 'incr'}
+
+def list_backups(backup_dir):
+    """[(name, kind)] oldest first - names start with a sortable timestamp"""
+    if not os.path.isdir(backup_dir):
+        return []
+    found = []
+    for name in os.listdir(backup_dir):
+        for suffix, kind in SUFFIXES.items():
+            if name.endswith(suffix):
+                found.append((name, kind))
+    return sorted(found)
+
+def read_backup(path):
+    """Yield the header, then each record"""
+    with gzip.open(path, 'rt') as f:
+        for line in f:
+            yield json.loads(line)
+
+def chain(backup_dir, upto=None):
+    """Files to apply to reach backup `upto` (default: the newest)"""
+    backups = list_backups(backup_dir)
+    if upto is not None:
+        names = [name for name, _ in backups]
+        matches = [name for name in names if name == upto or name.startswith(upto)]
+        if not matches:
+            raise ValueError(f'No backup matching {upto!r}')
+        backups = backups[:names.index(matches[-1]) + 1]
+    starts = [i for i, (_, kind) in enumerate(backups) if kind == 'full']
+    if not starts:
+        raise ValueError('No full backup to start from')
+    return [name for name, _ in backups[starts[-1]:]]
+
+def restore(backup_dir, upto=None):
+    """(keys, profiles, stats) as of backup `upto`, in the keys.json schema"""
+    keys, profiles, stats = {}, {}, {}
+    for name in chain(backup_dir, upto):
+        records = read_backup(os.path.join(backup_dir, name))
+        next(records)
+        for rec in records:
+            kind, value = rec['t'], rec.get('v')
+            if kind == 's':
+                stats = value
+                continue
+            table = keys if kind == 'k' else profiles
+            if value is None:
+                table.pop(rec['id'], None)
+            else:
+                table[rec['id']] = value
+    return keys, profiles, stats
+
+class BackupWriter:
+    """
+    Writes backups of `store` into `backup_dir` on a background thread.
+    request() queues one and returns at once; run() writes one inline
+    (used at shutdown, when a daemon thread would be killed mid-write).
+    """
+
+    def __init__(self, store, backup_dir):
+        self.store = store
+        self.backup_dir = backup_dir
+        self.need_full_file = os.path.join(backup_dir, '.need-full')
+        self.cond = threading.Condition()
+        self.pending = None    # None, 'incr' or 'full'
+        self.pid = None
+
+    def request(self, full=False):
+        storage.start_once(self, self._loop)
+        with self.cond:
+            if full or self.pending is None:
+                self.pending = 'full' if full else 'incr'
+            self.cond.notify_all()
+
+    def start(self):
+        storage.start_once(self, self._loop)
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                if self.pending is None:
+                    self.cond.wait(BACKUP_INTERVAL or None)
+                kind, self.pending = self.pending, None
+            if kind is None and not BACKUP_INTERVAL:
+                continue
+            self.run(full=kind == 'full', timer=kind is None)
+
+    def run(self, full=False, timer=False):
+        """Write one backup now; returns its file name (None if skipped / failed)"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        with open(os.path.join(self.backup_dir, '.lock'), 'w') as lock:
+            if fcntl:
+                try:
+                    # Timer backups give way to one already being written
+                    fcntl.flock(lock, fcntl.LOCK_EX | (fcntl.LOCK_NB if timer else 0))
+                except BlockingIOError:
+                    return None
+            if timer and self.newest_age() < BACKUP_INTERVAL * 0.9:
+                return None    # another worker's timer got there first
+            try:
+                return self._write(full)
+            except Exception as e:
+                # The claimed change set is gone - only a full backup is complete now
+                open(self.need_full_file, 'w').close()
+                print(f"[ERROR] Backup failed: {e}")
+                return None
+
+    def newest_age(self):
+        backups = list_backups(self.backup_dir)
+        if not backups:
+            return float('inf')
+        return time.time() - os.path.getmtime(os.path.join(self.backup_dir, backups[-1][0]))
+
+    def _write(self, full):
+        started = time.perf_counter()
+        backups = list_backups(self.backup_dir)
+        full_at = [i for i, (_, kind) in enumerate(backups) if kind == 'full']
+        fulls = [backups[i][0] for i in full_at]
+        since_full = len(backups) - 1 - full_at[-1] if full_at else 0
+
+        changes = self.store.backup_changes()
+        full = (full or changes is None or not fulls or since_full >= BACKUP_FULL_EVERY
+                or os.path.exists(self.need_full_file))
+        kind = 'full' if full else 'incr'
+
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        name = f'{stamp}.{kind}.ndjson.gz'
+        path = os.path.join(self.backup_dir, name)
+        header = {'type': kind, 'time': datetime.now().isoformat(), 'base': name if full else fulls[-1]}
+
+        count = 0
+        with open(path + '.tmp', 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as gz:
+                def emit(rec):
+                    gz.write((json.dumps(rec, separators=(',', ':')) + '\n').encode())
+
+                emit(header)
+                if full:
+                    for key, rec in self.store.iter_keys():
+                        emit({'t': 'k', 'id': key, 'v': rec.to_json()})
+                        count += 1
+                    for hwid, data in self.store.all_profiles().items():
+                        emit({'t': 'p', 'id': hwid, 'v': data})
+                        count += 1
+                else:
+                    key_ids, hwids = changes
+                    for key in sorted(key_ids):
+                        rec = self.store.get_key(key)
+                        emit({'t': 'k', 'id': key, 'v': rec.to_json() if rec else None})
+                        count += 1
+                    for hwid in sorted(hwids):
+                        emit({'t': 'p', 'id': hwid, 'v': self.store.get_profile(hwid)})
+                        count += 1
+                emit({'t': 's', 'v': self.store.stats()})
+            raw.flush()
+            os.fsync(raw.fileno())
+            size = raw.tell()
+        os.replace(path + '.tmp', path)
+
+        if full and os.path.exists(self.need_full_file):
+            os.remove(self.need_full_file)
+        self.prune()
+
+        elapsed = time.perf_counter() - started
+        metrics.observe('atlas_backup_duration_seconds', elapsed, kind=kind)
+        metrics.inc('atlas_write_bytes_total', size, file=f'backup.{kind}')
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 📁 Backup created: {name} "
+              f"({count} records, {size // 1024} KB, {elapsed:.2f}s)")
+        return name
+
+    def prune(self):
+        """Keep the newest BACKUP_KEEP_FULL full bases and everything after the oldest kept"""
+        backups = list_backups(self.backup_dir)
+        fulls = [i for i, (_, kind) in enumerate(backups) if kind == 'full']
+        if len(fulls) <= BACKUP_KEEP_FULL:
+            return
+        for name, _ in backups[:fulls[-BACKUP_KEEP_FULL]]:
+            try:
+                os.remove(os.path.join(self.backup_dir, name))
+            except OSError:
+                pass
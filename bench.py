@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+"""
+ATLAS KEY SYSTEM - LOAD TEST / BENCHMARK
+Builds a synthetic keys.json / profiles.json dataset, starts the server
+against it (Flask test client in-process, or a local gunicorn / uvicorn /
+app.py) and drives a mixed workload. Prints throughput and p50/p95/p99
+latency per operation as JSON so runs can be diffed.
+
+    python bench.py --dataset 100k --target client --duration 20
+    python bench.py --dataset 1m --target gunicorn --workers 4 --concurrency 32
+    python bench.py --target asgi --connections 10000 --think 2 --mix status=60,validate_hit=40
+    python bench.py --dataset 1k --mix validate_hit=80,status=20 --output run.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from base64 import b64encode
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DATASETS = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+# Every request comes from one IP - measure the server, not admission.py (set these to benchmark it)
+UNTHROTTLED = {'THROTTLE_IP': '0', 'THROTTLE_HWID': '0', 'THROTTLE_PREFIX': '0'}
+
+# Relative weights - override with --mix name=weight,...
+DEFAULT_MIX = {
+    'validate_hit': 30,         # bound key, same HWID (client re-check)
+    'validate_new': 5,          # first activation of an unused key
+    'validate_miss': 10,        # key that doesn't exist
+    'validate_expired': 5,
+    'validate_mismatch': 5,     # bound key, other HWID
+    'status': 15,
+    'profile_get': 10,
+    'profile_put': 5,
+    'admin_stats': 5,
+    'admin_keys': 5,
+    'generate': 1,              # /admin/api/generate/batch, 1000 keys
+}
+
+# Operations that draw from a dataset pool - switched off when it's empty
+NEEDS_POOL = {
+    'validate_hit': 'bound',
+    'validate_mismatch': 'bound',
+    'validate_expired': 'expired',
+    'profile_get': 'profiles',
+    'profile_put': 'profiles',
+}
+
+ADMIN_AUTH = 'Basic ' + b64encode(f"admin:{os.environ.get('ADMIN_PASSWORD', 'atlas2024')}".encode()).decode()
+
+# ============================================================================
+# SYNTHETIC DATASET
+# ============================================================================
+
+def key_id(rng):
+    return '-'.join(f'{rng.getrandbits(16):04X}' for _ in range(6))
+
+def build_dataset(data_dir, count, seed):
+    """
+    Write keys.json / profiles.json with a fixed mix of key states:
+    40% unused, 40% bound to a HWID, 20% expired. A quarter of HWIDs have a profile.
+    Returns the key pools the workload draws from.
+    """
+    rng = random.Random(seed)
+    now = datetime.now()
+    keys, profiles = {}, {}
+    pools = {'unused': [], 'bound': [], 'expired': []}
+
+    for i in range(count):
+        key = key_id(rng)
+        created = now - timedelta(days=rng.randint(1, 60))
+        state = ('unused', 'bound', 'expired')[0 if i % 5 < 2 else 1 if i % 5 < 4 else 2]
+        expiry = now - timedelta(days=1) if state == 'expired' else now + timedelta(days=rng.randint(1, 365))
+        rec = {
+            'created': created.isoformat(),
+            'duration': rng.choice(['1day', '7days', '30days', '365days']),
+            'expiry': expiry.isoformat(),
+            'used': state == 'bound',
+            'hwid': None,
+            'activated': None,
+            'activations': 0
+        }
+        if state == 'bound':
+            hwid = f'HWID-{i:08d}'
+            rec.update(hwid=hwid, activated=(created + timedelta(hours=1)).isoformat(), activations=rng.randint(1, 50))
+            pools['bound'].append((key, hwid))
+            if i % 10 == 2:
+                profiles[hwid] = {
+                    'primary': {'v': rng.randint(0, 100), 'l': rng.randint(0, 100), 'r': rng.randint(0, 100), 'sens': 1.0},
+                    'secondary': {'v': 0, 'l': 0, 'r': 0, 'sens': 1.0}
+                }
+        else:
+            pools[state].append(key)
+        keys[key] = rec
+
+    with open(os.path.join(data_dir, 'keys.json'), 'w') as f:
+        json.dump(keys, f)
+    with open(os.path.join(data_dir, 'profiles.json'), 'w') as f:
+        json.dump(profiles, f)
+    with open(os.path.join(data_dir, 'stats.json'), 'w') as f:
+        json.dump({'validations': 0, 'generations': count, 'last_reset': now.isoformat()}, f)
+
+    pools['profiles'] = list(profiles)
+    return pools
+
+# ============================================================================
+# TARGETS - same request() for the test client and real HTTP
+# ============================================================================
+
+class ClientTarget:
+    """app.py imported in this process; one Flask test client per thread"""
+
+    def __init__(self, data_dir, backend):
+        os.environ['DATA_DIR'] = data_dir
+        os.environ['STORAGE_BACKEND'] = backend
+        os.environ.setdefault('SQLITE_PATH', os.path.join(data_dir, 'atlas.db'))
+        for name, value in UNTHROTTLED.items():
+            os.environ.setdefault(name, value)
+        sys.path.insert(0, BASE_DIR)
+        started = time.perf_counter()
+        import app
+        self.load_seconds = time.perf_counter() - started
+        self.app = app.app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        res = client.open(path, method=method, data=None if body is None else json.dumps(body),
+                          content_type='application/json', headers=headers or {})
+        res.get_data()
+        return res.status_code
+
+    def close(self):
+        pass
+
+class HttpTarget:
+    """Keep-alive HTTP/1.1 connection per thread to a running server"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.local = threading.local()
+        self.load_seconds = None
+
+    def request(self, method, path, body=None, headers=None):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        hdrs = {'Content-Type': 'application/json'}
+        hdrs.update(headers or {})
+        try:
+            conn.request(method, path, body=None if body is None else json.dumps(body), headers=hdrs)
+            res = conn.getresponse()
+            res.read()
+            if res.will_close:
+                conn.close()
+                self.local.conn = None
+            return res.status
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self.local.conn = None
+            raise
+
+    def close(self):
+        pass
+
+def server_command(kind, port, workers, threads):
+    if kind == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(workers), '--worker-class', 'gthread', '--threads', str(threads),
+                '--timeout', '300', '--log-level', 'warning']
+    if kind == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--log-level', 'warning', '--timeout-keep-alive', '300', '--backlog', '16384']
+    # 'flask': app.py's own threaded server, a thread per connection
+    return [sys.executable, 'app.py']
+
+class ServerTarget(HttpTarget):
+    """Launch gunicorn, uvicorn (asgi.py) or app.py on a free port against the dataset directory"""
+
+    def __init__(self, data_dir, backend, kind, workers, threads):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        super().__init__('127.0.0.1', port)
+
+        env = dict(UNTHROTTLED, **os.environ)
+        env.update(DATA_DIR=data_dir, STORAGE_BACKEND=backend, PORT=str(port))
+        env.setdefault('SQLITE_PATH', os.path.join(data_dir, 'atlas.db'))
+        started = time.perf_counter()
+        # Server logs go to stderr so stdout stays a clean JSON report
+        self.proc = subprocess.Popen(server_command(kind, port, workers, threads), cwd=BASE_DIR, env=env,
+                                     stdout=sys.stderr)
+        while True:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f'{kind} server exited with {self.proc.returncode}')
+            try:
+                if self.request('GET', '/api/status') == 200:
+                    break
+            except OSError:
+                time.sleep(0.1)
+        self.load_seconds = time.perf_counter() - started
+
+    def close(self):
+        self.proc.send_signal(signal.SIGTERM)
+        try:
+            self.proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+# ============================================================================
+# WORKLOAD
+# ============================================================================
+
+def make_operations(pools, rng_lock):
+    """name -> function(rng) returning (method, path, body, headers)"""
+    admin = {'Authorization': ADMIN_AUTH}
+    unused = pools['unused']
+
+    def validate_new(rng):
+        with rng_lock:
+            key = unused.pop() if unused else key_id(rng)
+        return 'POST', '/api/validate', {'key': key, 'hwid': f'NEW-{key}'}, None
+
+    def validate_hit(rng):
+        key, hwid = rng.choice(pools['bound'])
+        return 'POST', '/api/validate', {'key': key, 'hwid': hwid}, None
+
+    def validate_mismatch(rng):
+        key, _ = rng.choice(pools['bound'])
+        return 'POST', '/api/validate', {'key': key, 'hwid': 'SOMEONE-ELSE'}, None
+
+    def profile_put(rng):
+        hwid = rng.choice(pools['profiles'])
+        return 'PATCH', f'/api/profiles/{hwid}', {'primary': {'sens': round(rng.uniform(0.1, 3.0), 1)}}, None
+
+    def admin_keys(rng):
+        query = rng.choice(['limit=50', 'limit=50&status=active', 'limit=50&sort=expiry&order=asc',
+                            'limit=50&prefix=A', 'limit=200&status=expired'])
+        return 'GET', f'/admin/api/keys?{query}', None, admin
+
+    return {
+        'validate_hit': validate_hit,
+        'validate_new': validate_new,
+        'validate_miss': lambda rng: ('POST', '/api/validate', {'key': key_id(rng), 'hwid': 'X'}, None),
+        'validate_expired': lambda rng: ('POST', '/api/validate', {'key': rng.choice(pools['expired']), 'hwid': 'X'}, None),
+        'validate_mismatch': validate_mismatch,
+        'status': lambda rng: ('GET', '/api/status', None, None),
+        'profile_get': lambda rng: ('GET', f"/api/profiles/{rng.choice(pools['profiles'])}", None, None),
+        'profile_put': profile_put,
+        'admin_stats': lambda rng: ('GET', '/admin/api/stats', None, admin),
+        'admin_keys': admin_keys,
+        'generate': lambda rng: ('POST', '/admin/api/generate/batch', {'count': 1000, 'duration': '30days'}, admin),
+    }
+
+def run_workload(target, operations, mix, concurrency, duration, warmup, seed):
+    names = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            name = rng.choices(names, weights)[0]
+            method, path, body, headers = operations[name](rng)
+            t0 = time.perf_counter()
+            try:
+                ok = target.request(method, path, body, headers) < 500
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            if t0 >= measure_from:
+                local[name].append(elapsed)
+                if not ok:
+                    local_errors[name] += 1
+        with lock:
+            for name in names:
+                samples[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, errors
+
+# ============================================================================
+# CONNECTION FLOOD - thousands of idle-ish keep-alive clients, one event loop
+# ============================================================================
+
+async def http_exchange(reader, writer, host, method, path, body, headers):
+    """One request on an open HTTP/1.1 connection -> (status, server closes it)"""
+    data = b'' if body is None else json.dumps(body).encode()
+    head = [f'{method} {path} HTTP/1.1', f'Host: {host}', 'Content-Type: application/json',
+            f'Content-Length: {len(data)}'] + [f'{name}: {value}' for name, value in (headers or {}).items()]
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + data)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    length, chunked, close = None, False, status_line.startswith(b'HTTP/1.0')
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding':
+            chunked = 'chunked' in value
+        elif name == 'connection':
+            close = value == 'close'
+
+    if status in (204, 304) or method == 'HEAD':
+        pass
+    elif chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif length is not None:
+        await reader.readexactly(length)
+    else:
+        await reader.read()
+        close = True
+    return status, close
+
+def hold_connections(host, port, operations, mix, connections, duration, warmup, think, seed):
+    """
+    `connections` keep-alive connections, each sending a request every `think`
+    seconds (launchers polling) - returns samples, errors and how many were held.
+    """
+    names = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    held = {'opened': 0, 'connect_errors': 0, 'dropped': 0}
+    start = time.perf_counter()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    async def connect():
+        try:
+            return await asyncio.wait_for(asyncio.open_connection(host, port), 30)
+        except (OSError, asyncio.TimeoutError):
+            held['connect_errors'] += 1
+            return None, None
+
+    async def client(n):
+        rng = random.Random(seed * 1000 + n)
+        # Spread the connects and the first polls over the warmup
+        await asyncio.sleep(rng.uniform(0, warmup))
+        reader, writer = await connect()
+        if writer is None:
+            return
+        held['opened'] += 1
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, body, headers = operations[name](rng)
+            t0 = time.perf_counter()
+            try:
+                status, close = await asyncio.wait_for(
+                    http_exchange(reader, writer, host, method, path, body, headers), 30)
+                ok = status < 500
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                ok, close = False, True
+                held['dropped'] += 1
+            if t0 >= measure_from:
+                samples[name].append(time.perf_counter() - t0)
+                if not ok:
+                    errors[name] += 1
+            if close:
+                writer.close()
+                reader, writer = await connect()
+                if writer is None:
+                    return
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * think)
+        writer.close()
+
+    async def flood():
+        await asyncio.gather(*(client(n) for n in range(connections)))
+
+    asyncio.run(flood())
+    return samples, errors, held
+
+def raise_fd_limit(wanted):
+    """Each connection is a descriptor here and in the server (which inherits the limit)"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"[WARNING] Could not raise the open file limit: {e}")
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(values, error_count, duration):
+    values = sorted(values)
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        'count': len(values),
+        'errors': error_count,
+        'throughput_rps': round(len(values) / duration, 1),
+        'p50_ms': ms(percentile(values, 50)),
+        'p95_ms': ms(percentile(values, 95)),
+        'p99_ms': ms(percentile(values, 99)),
+        'max_ms': ms(values[-1] if values else None)
+    }
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    if text:
+        mix = {name: 0 for name in DEFAULT_MIX}
+        for part in text.split(','):
+            name, _, weight = part.partition('=')
+            if name not in DEFAULT_MIX:
+                raise SystemExit(f'Unknown operation {name!r} - one of {", ".join(DEFAULT_MIX)}')
+            mix[name] = float(weight or 1)
+    return mix
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Atlas key server')
+    parser.add_argument('--dataset', default='1k', help='1k, 100k, 1m or a key count')
+    parser.add_argument('--target', choices=['client', 'gunicorn', 'asgi', 'flask', 'url'], default='client')
+    parser.add_argument('--url', default='127.0.0.1:5000', help='host:port for --target url (dataset not generated)')
+    parser.add_argument('--backend', choices=['json', 'sqlite', 'redis'], default='json')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--connections', type=int, help='hold this many keep-alive connections instead '
+                                                        '(asyncio, HTTP targets only)')
+    parser.add_argument('--think', type=float, default=1.0, help='seconds between requests per connection')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds first')
+    parser.add_argument('--mix', help='e.g. validate_hit=80,status=20 (others off)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', help='dataset directory (default: a temp dir, removed after)')
+    parser.add_argument('--output', help='also write the JSON report here')
+    args = parser.parse_args()
+
+    # The in-process server logs with print() - keep stdout for the report
+    report_out, sys.stdout = sys.stdout, sys.stderr
+    if args.connections:
+        if args.target == 'client':
+            raise SystemExit('--connections needs a real server: --target gunicorn, asgi, flask or url')
+        raise_fd_limit(2 * args.connections + 1024)
+
+    count = DATASETS.get(args.dataset.lower()) or int(args.dataset)
+    mix = parse_mix(args.mix)
+    report = {
+        'time': datetime.now().isoformat(),
+        'config': dict(vars(args), keys=count, mix=mix),
+    }
+
+    data_dir = None
+    if args.target == 'url':
+        host, _, port = args.url.rpartition(':')
+        target = HttpTarget(host or '127.0.0.1', int(port))
+        pools = None
+    else:
+        data_dir = args.data_dir or tempfile.mkdtemp(prefix='atlas-bench-')
+        os.makedirs(data_dir, exist_ok=True)
+        started = time.perf_counter()
+        pools = build_dataset(data_dir, count, args.seed)
+        report['dataset'] = {'dir': data_dir, 'build_seconds': round(time.perf_counter() - started, 3),
+                             'profiles': len(pools['profiles'])}
+        print(f"[INFO] Dataset: {count} keys, {len(pools['profiles'])} profiles in {data_dir}")
+        if args.target == 'client':
+            target = ClientTarget(data_dir, args.backend)
+        else:
+            target = ServerTarget(data_dir, args.backend, args.target, args.workers, args.threads)
+        report['dataset']['load_seconds'] = round(target.load_seconds, 3)
+
+    if pools is None:
+        # Existing server: we don't know its keys, so no pool-based operations
+        pools = {'unused': [], 'bound': [], 'expired': [], 'profiles': []}
+    for name, pool in NEEDS_POOL.items():
+        if not pools[pool]:
+            mix[name] = 0
+
+    operations = make_operations(pools, threading.Lock())
+    if args.connections:
+        print(f"[INFO] Running {args.duration}s (+{args.warmup}s warmup) with {args.connections} connections, "
+              f"a request every ~{args.think:g}s each")
+        samples, errors, report['connections'] = hold_connections(
+            target.host, target.port, operations, mix, args.connections, args.duration, args.warmup,
+            args.think, args.seed)
+    else:
+        print(f"[INFO] Running {args.duration}s (+{args.warmup}s warmup) with {args.concurrency} threads")
+        samples, errors = run_workload(target, operations, mix, args.concurrency, args.duration, args.warmup,
+                                       args.seed)
+
+    report['operations'] = {name: summarize(samples[name], errors[name], args.duration) for name in samples}
+    report['total'] = summarize([v for values in samples.values() for v in values],
+                                sum(errors.values()), args.duration)
+
+    text = json.dumps(report, indent=2)
+    report_out.write(text + '\n')
+    report_out.flush()
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    target.close()
+    if data_dir and not args.data_dir:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    if args.target == 'client':
+        # app.py's atexit hook would save (and back up) the benchmark dataset
+        os._exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+"""
+GUNICORN CONFIG - picked up automatically: gunicorn app:app
+
+preload_app loads the data once in the master (keys.snap is mmap'd, so
+that's quick at any size); workers fork with it already in place and
+share the pages instead of each loading their own copy.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# json keeps its state in-process - one worker; redis / sqlite can run several,
+# and so can a json read replica (each worker follows the primary itself)
+single = os.environ.get('STORAGE_BACKEND', 'json') == 'json' and not os.environ.get('REPLICA_OF')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1 if single else 4))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = True
+
+def post_fork(server, worker):
+    import app
+    app.after_fork()
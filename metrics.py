@@ -0,0 +1,235 @@
+"""
+METRICS - Prometheus text format without the client library
+Each process keeps its own counters and histograms in memory and snapshots
+them to <dir>/<pid>.json every few seconds; /metrics sums the snapshots of
+every worker, so gunicorn -w N reports one set of numbers.
+"""
+
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+
+# Seconds - from sub-ms lock waits up to slow backups
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Snapshots of workers that died longer ago than this are dropped
+STALE_AFTER = float(os.environ.get('METRICS_STALE_AFTER', 86400))
+
+HELP = {
+    'atlas_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'atlas_http_request_duration_seconds': ('histogram', 'Time to produce a response, by route'),
+    'atlas_validations_total': ('counter', 'Key validations by outcome'),
+    'atlas_lock_wait_seconds': ('histogram', 'Time spent waiting to acquire a lock'),
+    'atlas_lock_hold_seconds': ('histogram', 'Time a lock was held'),
+    'atlas_write_duration_seconds': ('histogram', 'Whole-file / journal write time including fsync'),
+    'atlas_write_bytes_total': ('counter', 'Bytes written per file'),
+    'atlas_fsync_duration_seconds': ('histogram', 'fsync (or sqlite commit) time per file'),
+    'atlas_compaction_duration_seconds': ('histogram', 'Journal compaction into snapshots'),
+    'atlas_backup_duration_seconds': ('histogram', 'Backup write time by kind (full / incr)'),
+    'atlas_archived_keys_total': ('counter', 'Keys moved into the archive by the reaper'),
+    'atlas_throttled_total': ('counter', 'Validations refused with 429, by empty bucket (ip / hwid / prefix) or busy'),
+}
+
+_lock = threading.Lock()
+_counters = {}      # (name, labels) -> value
+_histograms = {}    # (name, labels) -> [bucket counts..., +Inf count, sum]
+_dir = None
+_pid = None                 # process running the flush thread
+_owner = os.getpid()        # process the numbers above belong to
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        h[bisect_left(BUCKETS, seconds)] += 1
+        h[-1] += seconds
+
+class timer:
+    """with metrics.timer('atlas_backup_duration_seconds'): ..."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+class TimedLock:
+    """threading.Lock that records wait and hold time under lock=<name>"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.acquired = 0.0
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        self.acquired = time.perf_counter()
+        observe('atlas_lock_wait_seconds', self.acquired - started, lock=self.name)
+        return self
+
+    def __exit__(self, *exc):
+        observe('atlas_lock_hold_seconds', time.perf_counter() - self.acquired, lock=self.name)
+        self.lock.release()
+        return False
+
+# ============================================================================
+# CROSS-WORKER SNAPSHOTS
+# ============================================================================
+
+def snapshot():
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'time': time.time(),
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, labels, h] for (name, labels), h in _histograms.items()],
+        }
+
+def flush():
+    """Write this process's snapshot - temp + rename, readers never see half a file"""
+    if _dir is None:
+        return
+    path = os.path.join(_dir, f'{os.getpid()}.json')
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot(), f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"[WARNING] Metrics flush failed: {e}")
+
+def start(directory):
+    """Begin periodic snapshots for this process (again after fork)"""
+    global _dir, _pid, _owner
+    _dir = directory
+    if _pid == os.getpid():
+        return
+    _pid = os.getpid()
+    if _owner != _pid:
+        # A forked child inherits the parent's numbers - the parent reports those
+        _owner = _pid
+        with _lock:
+            _counters.clear()
+            _histograms.clear()
+    os.makedirs(directory, exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            flush()
+
+    threading.Thread(target=run, daemon=True).start()
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def collect():
+    """Every worker's snapshot, this process's taken fresh"""
+    own = snapshot()
+    snapshots = [own]
+    if _dir and os.path.isdir(_dir):
+        for name in os.listdir(_dir):
+            if not name.endswith('.json') or name == f'{own["pid"]}.json':
+                continue
+            path = os.path.join(_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    snap = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not pid_alive(snap['pid']) and time.time() - snap['time'] > STALE_AFTER:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            snapshots.append(snap)
+    return snapshots
+
+# ============================================================================
+# EXPOSITION
+# ============================================================================
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    pairs = [f'{k}="{_escape(v)}"' for k, v in list(labels) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(gauges=()):
+    """
+    Prometheus text format 0.0.4. `gauges` is [(name, help, labels dict, value)]
+    for point-in-time values the caller reads from storage.
+    """
+    snapshots = collect()
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, h in snap['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            histograms[key] = h[:] if merged is None else [a + b for a, b in zip(merged, h)]
+
+    lines = []
+    described = set()
+
+    def describe(name, kind, text):
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in sorted(counters.items()):
+        describe(name, *HELP.get(name, ('counter', name)))
+        lines.append(f'{name}{_format_labels(labels)} {_number(value)}')
+
+    for (name, labels), h in sorted(histograms.items()):
+        describe(name, *HELP.get(name, ('histogram', name)))
+        cumulative = 0
+        for bound, count in zip(BUCKETS, h):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", repr(bound))])} {cumulative}')
+        cumulative += h[len(BUCKETS)]
+        lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {_number(h[-1])}')
+        lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+    describe('atlas_workers', 'gauge', 'Processes (live or recently exited) whose metrics are included')
+    lines.append(f'atlas_workers {len(snapshots)}')
+    for name, text, labels, value in gauges:
+        describe(name, 'gauge', text)
+        lines.append(f'{name}{_format_labels(_labels(labels))} {_number(value)}')
+
+    return '\n'.join(lines) + '\n'
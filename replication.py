@@ -0,0 +1,259 @@
+"""
+REPLICATION - read replicas of a json-backend primary
+
+The primary's journal is the mutation stream: every batch it appends (key,
+profile and stats records - see storage.journal_record) also goes to each
+follower connected to REPLICATION_LISTEN. A follower that is new, or further
+behind than the primary's backlog, first gets a snapshot - the primary's
+keys.snap, every profile and the stats - tagged with the stream offset it
+covers, then the stream from that offset on. Records are full-value sets,
+so applying one twice is harmless.
+
+    python app.py                                              # primary
+    REPLICA_OF=/tmp/atlas-repl.sock PORT=10001 python app.py   # replica
+
+with REPLICATION_LISTEN=/tmp/atlas-repl.sock on the primary. Replicas serve
+/api/status, profile reads and re-validations of already-bound keys from
+their copy, and forward everything else to PRIMARY_URL. Leases they issue
+must verify everywhere: give replicas the primary's DATA_DIR or LEASE_SECRET.
+
+Wire format, newline-delimited JSON:
+    follower -> {"epoch": ..., "offset": ...}        (nulls when it has nothing)
+    primary  -> {"snapshot": <bytes>, "profiles": <n>, "epoch", "offset", "stats"}
+                + keys.snap bytes + n journal lines         (or {"resume": offset})
+    primary  -> {"batch": <offset after>, "count": <n>} + n journal lines ...
+                {"ping": offset} when idle
+Offsets count journal records since the primary started; `epoch` names
+that run, so a restarted primary always sends a fresh snapshot.
+"""
+
+import os
+import json
+import time
+import shutil
+import socket
+import secrets
+import tempfile
+import threading
+from collections import deque
+from datetime import datetime
+
+import storage
+
+# Primary: unix socket path (or host:port) replicas connect to - unset = no replication
+REPLICATION_LISTEN = os.environ.get('REPLICATION_LISTEN')
+
+# Replica: the primary's REPLICATION_LISTEN address
+REPLICA_OF = os.environ.get('REPLICA_OF')
+
+# Replica: where writes and first activations are forwarded
+PRIMARY_URL = os.environ.get('PRIMARY_URL', 'http://127.0.0.1:10000')
+
+# Replica: seconds to wait at startup for the first snapshot
+REPLICA_WAIT = float(os.environ.get('REPLICA_WAIT', 60))
+
+# Journal batches kept for followers that reconnect (older = full snapshot)
+REPLICATION_BACKLOG = int(os.environ.get('REPLICATION_BACKLOG', 10000))
+
+# Seconds between pings on an idle stream; a follower gives up after 3 missed
+REPLICATION_PING = float(os.environ.get('REPLICATION_PING', 5))
+
+def parse_address(address):
+    """'host:port' -> TCP, anything else is a unix socket path"""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and '/' not in address:
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+def send(f, msg, lines=()):
+    f.write((json.dumps(msg, separators=(',', ':')) + '\n').encode())
+    for line in lines:
+        f.write(line.encode() + b'\n')
+    f.flush()
+
+def receive(f):
+    line = f.readline()
+    if not line:
+        raise ConnectionError('stream closed')
+    return json.loads(line)
+
+class Primary:
+    """Streams a JsonStorage's journal to followers on REPLICATION_LISTEN"""
+
+    def __init__(self, store, address=REPLICATION_LISTEN):
+        self.store = store
+        self.address = address
+        self.epoch = secrets.token_hex(8)
+        self.cond = threading.Condition()
+        self.offset = 0
+        self.backlog = deque(maxlen=REPLICATION_BACKLOG)    # (offset after, lines)
+        self.followers = 0
+        self.pid = None
+        store.on_commit(self.publish)
+
+    def publish(self, lines):
+        # Called under the store's file_lock, so batches arrive in journal order
+        with self.cond:
+            self.offset += len(lines)
+            self.backlog.append((self.offset, lines))
+            self.cond.notify_all()
+
+    def current(self):
+        with self.cond:
+            return self.offset
+
+    def start(self):
+        # The socket belongs to the process that writes the journal (the worker, after fork)
+        with self.cond:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        family, addr = parse_address(self.address)
+        server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            if os.path.exists(addr):
+                os.remove(addr)
+        else:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(addr)
+        server.listen(16)
+        threading.Thread(target=self._accept, args=(server,), daemon=True).start()
+        print(f"[INFO] Replication: primary listening on {self.address}")
+
+    def _accept(self, server):
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with self.cond:
+            self.followers += 1
+        try:
+            with conn, conn.makefile('rwb') as f:
+                hello = receive(f)
+                offset = self.resume_point(hello)
+                if offset is None:
+                    offset = self.send_snapshot(f)
+                else:
+                    send(f, {'resume': offset})
+                self.stream(f, offset)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Replication: follower dropped: {e}")
+        finally:
+            with self.cond:
+                self.followers -= 1
+
+    def resume_point(self, hello):
+        """The follower's offset if the backlog still covers it, else None"""
+        offset = hello.get('offset')
+        if hello.get('epoch') != self.epoch or not isinstance(offset, int):
+            return None
+        with self.cond:
+            oldest = self.backlog[0][0] - len(self.backlog[0][1]) if self.backlog else self.offset
+            return offset if oldest <= offset <= self.offset else None
+
+    def send_snapshot(self, f):
+        offset, snap, stats = self.store.replication_snapshot(self.current)
+        profiles = [storage.journal_record('P', hwid, record)
+                    for hwid, record in self.store.profiles.items(self.store.profiles_dir)]
+        # keys.snap is replaced by rename, so this handle keeps the compacted one
+        size = os.fstat(snap.fileno()).st_size if snap else 0
+        send(f, {'snapshot': size, 'profiles': len(profiles), 'epoch': self.epoch,
+                 'offset': offset, 'stats': stats})
+        if snap:
+            with snap:
+                shutil.copyfileobj(snap, f)
+        send(f, {'snapshot_end': offset}, profiles)
+        return offset
+
+    def stream(self, f, offset):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.offset > offset, timeout=REPLICATION_PING)
+                batches = []
+                for end, lines in reversed(self.backlog):
+                    if end <= offset:
+                        break
+                    batches.append((end, lines))
+                if batches and batches[-1][0] - len(batches[-1][1]) > offset:
+                    raise ValueError('fell behind the backlog')
+            if not batches:
+                send(f, {'ping': offset})
+                continue
+            for end, lines in reversed(batches):
+                send(f, {'batch': end, 'count': len(lines)}, lines)
+                offset = end
+
+class Follower:
+    """Keeps a storage.ReplicaStorage in step with the primary at REPLICA_OF"""
+
+    def __init__(self, store, address=REPLICA_OF):
+        self.store = store
+        self.address = address
+        self.epoch = None
+        self.offset = None
+        self.ready = threading.Event()
+        self.pid = None
+
+    def start(self):
+        # Each worker resumes from the copy it inherited
+        storage.start_once(self, self._loop)
+
+    def _loop(self):
+        while True:
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] Replication: lost primary {self.address}: {e} - reconnecting")
+            time.sleep(1)
+
+    def sync(self):
+        family, addr = parse_address(self.address)
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.connect(addr)
+            sock.settimeout(REPLICATION_PING * 3)
+            with sock.makefile('rwb') as f:
+                send(f, {'epoch': self.epoch, 'offset': self.offset})
+                msg = receive(f)
+                if 'snapshot' in msg:
+                    self.install(f, msg)
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] 🔁 Replica in sync with "
+                      f"{self.address} at offset {self.offset}")
+                self.ready.set()
+                while True:
+                    msg = receive(f)
+                    if 'batch' in msg:
+                        lines = [f.readline().decode() for _ in range(msg['count'])]
+                        deleted = self.store.apply(lines)
+                        self.offset = msg['batch']
+                        if deleted:
+                            # Local listeners (lease revocation) hear about it as if deleted here
+                            self.store.publish({'event': 'deleted', 'keys': deleted})
+
+    def install(self, f, msg):
+        """Read a snapshot off the stream; keys.snap goes through a temp file to be mapped"""
+        started = time.perf_counter()
+        path = None
+        if msg['snapshot']:
+            fd, path = tempfile.mkstemp(prefix='atlas-replica-', suffix='.snap')
+            with os.fdopen(fd, 'wb') as out:
+                remaining = msg['snapshot']
+                while remaining:
+                    chunk = f.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        raise ConnectionError('snapshot truncated')
+                    out.write(chunk)
+                    remaining -= len(chunk)
+        try:
+            receive(f)    # snapshot_end
+            profiles = []
+            for _ in range(msg['profiles']):
+                rec = json.loads(f.readline())
+                profiles.append((rec['id'], storage.ProfileRecord(rec['v']['version'], rec['v']['data'])))
+            self.store.install(path, profiles, msg['stats'])
+        finally:
+            if path:
+                os.remove(path)    # stays mapped until the next snapshot replaces it
+        self.epoch, self.offset = msg['epoch'], msg['offset']
+        print(f"[INFO] Replication: snapshot of {self.store.key_count()} keys, {len(profiles)} profiles "
+              f"in {time.perf_counter() - started:.2f}s")
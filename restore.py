@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+ATLAS KEY SYSTEM - RESTORE FROM BACKUP
+Rebuilds keys.json / profiles.json / stats.json as of any retained backup
+(newest full at or before it + the incrementals in between). Writes into a
+separate directory. To put them live, stop the server, move keys.snap,
+journal.log and profiles/ out of DATA_DIR and copy the files in (a newer
+keys.json is loaded over keys.snap; redis / sqlite import them into an
+empty store on start).
+
+    python restore.py --list
+    python restore.py                          # newest backup
+    python restore.py --at 20240501_1300 --out /tmp/restored
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import backups
+import storage
+
+def main():
+    parser = argparse.ArgumentParser(description='Restore Atlas data from backups')
+    parser.add_argument('--dir', default=os.path.join(storage.DATA_DIR, 'backups'), help='backup directory')
+    parser.add_argument('--list', action='store_true', help='show backups and exit')
+    parser.add_argument('--at', help='backup name or timestamp prefix (default: newest)')
+    parser.add_argument('--out', help='output directory (default: DATA_DIR/restored-<backup>)')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, kind in backups.list_backups(args.dir):
+            size = os.path.getsize(os.path.join(args.dir, name))
+            print(f"{'' if kind == 'full' else '  '}{name}  {size // 1024} KB")
+        return
+
+    try:
+        files = backups.chain(args.dir, args.at)
+        keys, profiles, stats = backups.restore(args.dir, args.at)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+    point = files[-1].split('.')[0]
+    out = args.out or os.path.join(storage.DATA_DIR, f'restored-{point}')
+    os.makedirs(out, exist_ok=True)
+    for filename, data in [('keys.json', keys), ('profiles.json', profiles), ('stats.json', stats)]:
+        with open(os.path.join(out, filename), 'w') as f:
+            json.dump(data, f, indent=2)
+
+    print(f"[INFO] Applied {len(files)} backup(s): {', '.join(files)}")
+    print(f"[INFO] {len(keys)} keys, {len(profiles)} profiles -> {out}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+ROLLUPS - validations, activations and generations over time, in fixed memory
+
+Counters per minute (last 24 h), hour (30 days) and day (400 days), one
+column per series:
+
+    validation:ok / invalid / expired / hwid_mismatch
+    activation:<duration>     first activation of a key, by duration tier
+    generation:<duration>     keys generated, by duration tier
+
+Each resolution is a ring buffer: a slot remembers which period it holds
+and is zeroed when a newer period lands on it, so counting is O(1) and
+memory is the same at ten validations a day or ten million.
+
+Every process counts into its own rings and every ROLLUP_FLUSH_INTERVAL
+adds them into DATA_DIR/rollups.bin under a file lock, so gunicorn workers
+(and replicas sharing DATA_DIR) end up in one file. The file is a JSON
+header line plus the zlib'd slot arrays - mostly zeros, so a few KB.
+"""
+
+import os
+import json
+import zlib
+import time
+import threading
+from array import array
+from datetime import datetime
+
+import storage
+
+try:
+    import fcntl
+except ImportError:    # Windows - single process there anyway
+    fcntl = None
+
+ROLLUP_FILE = os.environ.get('ROLLUP_FILE', os.path.join(storage.DATA_DIR, 'rollups.bin'))
+
+# Seconds between folding this process's counts into ROLLUP_FILE, 0 = only at exit
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get('ROLLUP_FLUSH_INTERVAL', 10))
+
+# name -> (seconds per slot, slots kept)
+RESOLUTIONS = {
+    'minute': (60, 1440),
+    'hour': (3600, 720),
+    'day': (86400, 400),
+}
+
+# activate() result -> validation series
+OUTCOMES = {'ok': 'ok', 'invalid': 'invalid', 'expired': 'expired', 'in_use': 'hwid_mismatch'}
+
+class Ring:
+    """`slots` periods of `width` seconds, `columns` counters each"""
+
+    def __init__(self, width, slots, columns):
+        self.width = width
+        self.slots = slots
+        self.columns = columns
+        self.periods = array('q', [-1]) * slots
+        self.counts = array('Q', [0]) * (slots * columns)
+
+    def add(self, t, column, n):
+        period = int(t // self.width)
+        slot = period % self.slots
+        base = slot * self.columns
+        if self.periods[slot] != period:
+            self.periods[slot] = period
+            self.counts[base:base + self.columns] = array('Q', [0]) * self.columns
+        self.counts[base + column] += n
+
+    def merge(self, other):
+        """Add `other` (same shape) in - per slot the newer period wins, an older one is dropped"""
+        width = self.columns
+        for slot, period in enumerate(other.periods):
+            if period < 0 or period < self.periods[slot]:
+                continue
+            base = slot * width
+            if period > self.periods[slot]:
+                self.periods[slot] = period
+                self.counts[base:base + width] = other.counts[base:base + width]
+            else:
+                for i in range(base, base + width):
+                    self.counts[i] += other.counts[i]
+
+    def row(self, period):
+        slot = period % self.slots
+        if self.periods[slot] != period:
+            return None
+        return self.counts[slot * self.columns:(slot + 1) * self.columns]
+
+class Rollups:
+    """This process's unflushed counts + reads that combine them with ROLLUP_FILE"""
+
+    def __init__(self, tiers, path=ROLLUP_FILE):
+        self.path = path
+        self.series = ([f'validation:{name}' for name in OUTCOMES.values()] +
+                       [f'activation:{tier}' for tier in list(tiers) + ['other']] +
+                       [f'generation:{tier}' for tier in list(tiers) + ['other']])
+        self.column = {name: i for i, name in enumerate(self.series)}
+        self.lock = threading.Lock()
+        self.pending = self.empty()
+        self.dirty = False
+        self.pid = None
+
+    def empty(self):
+        return {name: Ring(width, slots, len(self.series)) for name, (width, slots) in RESOLUTIONS.items()}
+
+    def count(self, series, n=1, now=None):
+        if n <= 0:
+            return    # the rings are unsigned - nothing to add
+        column = self.column.get(series)
+        if column is None:
+            column = self.column.get(series.split(':')[0] + ':other')
+            if column is None:
+                return
+        t = time.time() if now is None else now
+        with self.lock:
+            for ring in self.pending.values():
+                ring.add(t, column, n)
+            self.dirty = True
+
+    def validation(self, result, now=None):
+        if result in OUTCOMES:
+            self.count('validation:' + OUTCOMES[result], now=now)
+
+    # ------------------------------------------------------------------
+    # ROLLUP_FILE
+    # ------------------------------------------------------------------
+
+    def start(self):
+        # Each worker flushes its own counts
+        if ROLLUP_FLUSH_INTERVAL:
+            storage.start_once(self, self._loop)
+
+    def _loop(self):
+        while True:
+            time.sleep(ROLLUP_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """Add the counts since the last flush into ROLLUP_FILE"""
+        with self.lock:
+            if not self.dirty:
+                return
+            pending, self.pending, self.dirty = self.pending, self.empty(), False
+        try:
+            with open(self.path + '.lock', 'w') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                rings = self.load()
+                for name, ring in rings.items():
+                    ring.merge(pending[name])
+                self.save(rings)
+        except OSError as e:
+            print(f"[WARNING] Rollup flush failed, keeping the counts for next time: {e}")
+            with self.lock:
+                for name, ring in self.pending.items():
+                    pending[name].merge(ring)
+                self.pending, self.dirty = pending, True
+
+    def load(self):
+        """ROLLUP_FILE as rings in this process's column order (series it doesn't know are dropped)"""
+        rings = self.empty()
+        try:
+            with open(self.path, 'rb') as f:
+                header = json.loads(f.readline())
+                data = zlib.decompress(f.read())
+        except FileNotFoundError:
+            return rings
+        except (OSError, ValueError, zlib.error) as e:
+            print(f"[WARNING] {os.path.basename(self.path)} unreadable, starting rollups over: {e}")
+            return rings
+
+        mapping = [(i, self.column[name]) for i, name in enumerate(header['series']) if name in self.column]
+        width = len(header['series'])
+        offset = 0
+        for name, period_width, slots in header['rings']:
+            periods = array('q', data[offset:offset + slots * 8])
+            offset += slots * 8
+            counts = array('Q', data[offset:offset + slots * width * 8])
+            offset += slots * width * 8
+            ring = rings.get(name)
+            if ring is None or (ring.width, ring.slots) != (period_width, slots):
+                continue    # resolution changed - that history is dropped
+            ring.periods = periods
+            for slot in range(slots):
+                if periods[slot] >= 0:
+                    for src, dst in mapping:
+                        ring.counts[slot * ring.columns + dst] = counts[slot * width + src]
+        return rings
+
+    def save(self, rings):
+        header = {'series': self.series,
+                  'rings': [[name, ring.width, ring.slots] for name, ring in rings.items()]}
+        body = zlib.compress(b''.join(ring.periods.tobytes() + ring.counts.tobytes() for ring in rings.values()))
+        temp_file = self.path + '.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            f.write(body)
+            f.flush()
+            storage.fsync(f, 'rollups.bin')
+        os.replace(temp_file, self.path)
+
+    # ------------------------------------------------------------------
+    # READS
+    # ------------------------------------------------------------------
+
+    def query(self, resolution, groups=None, limit=None, now=None):
+        """
+        The last `limit` periods (default: all kept) at `resolution`, oldest
+        first, for the series in `groups` (e.g. {'activation'}; None = all).
+        Includes this process's unflushed counts - other workers' show up
+        within ROLLUP_FLUSH_INTERVAL.
+        """
+        ring = self.load()[resolution]
+        with self.lock:
+            ring.merge(self.pending[resolution])
+
+        columns = [i for i, name in enumerate(self.series) if not groups or name.split(':')[0] in groups]
+        names = [self.series[i] for i in columns]
+        current = int((time.time() if now is None else now) // ring.width)
+        count = min(limit or ring.slots, ring.slots)
+        points, totals = [], dict.fromkeys(names, 0)
+        for period in range(current - count + 1, current + 1):
+            row = ring.row(period)
+            values = [row[i] if row else 0 for i in columns]
+            for name, value in zip(names, values):
+                totals[name] += value
+            points.append(dict(zip(names, values), time=datetime.fromtimestamp(period * ring.width).isoformat()))
+        return {'resolution': resolution, 'seconds': ring.width, 'series': names,
+                'totals': totals, 'points': points}
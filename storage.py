@@ -0,0 +1,2807 @@
+"""
+ATLAS KEY SYSTEM - STORAGE BACKENDS
+JSON files (single process), Redis (shared by every gunicorn worker / host)
+or SQLite (indexed, shared by workers on one host)
+
+Keys travel between app.py and the backends as KeyRecord objects; the
+keys.json schema {created, duration, expiry, used, hwid, activated,
+activations} only exists on disk / in Redis / over HTTP.
+"""
+
+import os
+import json
+import threading
+import time
+import shutil
+import struct
+import mmap
+import sqlite3
+import heapq
+import sys
+import hashlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('DATA_DIR', BASE_DIR)
+
+# Fold the journal into the snapshot files after this many records / seconds
+JOURNAL_COMPACT_RECORDS = int(os.environ.get('JOURNAL_COMPACT_RECORDS', 5000))
+JOURNAL_COMPACT_INTERVAL = int(os.environ.get('JOURNAL_COMPACT_INTERVAL', 600))
+JOURNAL_TABLES = {'k': 'keys', 'p': 'profiles', 'P': 'profiles', 's': 'stats'}
+
+# Group commit: mutations arriving within this window share one fsync
+COMMIT_WINDOW_MS = float(os.environ.get('COMMIT_WINDOW_MS', 10))
+
+# Per-key / per-HWID lock stripes for the json backend
+LOCK_STRIPES = int(os.environ.get('LOCK_STRIPES', 64))
+
+# Key changes kept for admin delta sync (?since=<version>)
+CHANGE_LOG_SIZE = int(os.environ.get('CHANGE_LOG_SIZE', 10000))
+
+# How often SQLite workers poll the shared events table
+EVENT_POLL_INTERVAL = float(os.environ.get('EVENT_POLL_INTERVAL', 0.25))
+
+
+def default_stats():
+    return {'validations': 0, 'generations': 0, 'last_reset': datetime.now().isoformat()}
+
+def epoch(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+def iso(ts):
+    return datetime.fromtimestamp(ts).isoformat() if ts is not None else None
+
+# ============================================================================
+# KEY RECORDS - compact, pre-parsed
+# ============================================================================
+
+class KeyRecord:
+    """
+    One license key. Timestamps are epoch seconds and `duration` is an
+    interned string, so the hot path compares floats instead of parsing
+    ISO dates and each record costs a handful of slots instead of a dict.
+    """
+
+    __slots__ = ('created', 'duration', 'expiry', 'used', 'hwid', 'activated', 'activations')
+
+    def __init__(self, created, duration, expiry, used=False, hwid=None, activated=None, activations=0):
+        self.created = created
+        self.duration = sys.intern(duration)
+        self.expiry = expiry
+        self.used = used
+        self.hwid = hwid
+        self.activated = activated
+        self.activations = activations
+
+    @classmethod
+    def from_json(cls, d):
+        # Older keys.json files used activated_date / activation_count
+        return cls(
+            epoch(d.get('created')),
+            d.get('duration') or '7days',
+            epoch(d['expiry']),
+            bool(d.get('used')),
+            d.get('hwid') or None,
+            epoch(d.get('activated') or d.get('activated_date')),
+            int(d.get('activations', d.get('activation_count', 0)) or 0),
+        )
+
+    def copy(self):
+        return KeyRecord(self.created, self.duration, self.expiry, self.used,
+                         self.hwid, self.activated, self.activations)
+
+    def to_json(self):
+        return {
+            'created': iso(self.created),
+            'duration': self.duration,
+            'expiry': iso(self.expiry),
+            'used': self.used,
+            'hwid': self.hwid,
+            'activated': iso(self.activated),
+            'activations': self.activations
+        }
+
+class ProfileRecord:
+    """
+    One HWID's profile document. `version` goes up by one per write and is
+    the ETag; `body` is the serialized JSON, built once per write.
+    """
+
+    __slots__ = ('version', 'data', 'body')
+
+    def __init__(self, version, data):
+        self.version = version
+        self.data = data
+        self.body = profile_body(data)
+
+    def to_json(self):
+        return {'version': self.version, 'data': self.data}
+
+def profile_body(data):
+    return json.dumps(data, separators=(',', ':'))
+
+KEY_STATUSES = ('unused', 'active', 'expired')
+KEY_SORTS = ('created', 'expiry')
+
+def key_status(rec, now):
+    if rec.expiry < now:
+        return 'expired'
+    return 'active' if rec.used else 'unused'
+
+def key_matches(key, rec, now, status=None, duration=None, hwid_prefix=None, key_prefix=None):
+    """Admin list filters - shared by every backend that filters in Python"""
+    if status and key_status(rec, now) != status:
+        return False
+    if duration and rec.duration != duration:
+        return False
+    if hwid_prefix and not (rec.hwid or '').startswith(hwid_prefix):
+        return False
+    if key_prefix and not key.startswith(key_prefix):
+        return False
+    return True
+
+def key_selected(key, rec, now, keys=None, created=None, expiry=None, hwid=None, **filters):
+    """Bulk-operation filter: key_matches() plus [from, to) created / expiry ranges, exact HWID, key list"""
+    if keys is not None and key not in keys:
+        return False
+    for value, (low, high) in ((rec.created, created or (None, None)), (rec.expiry, expiry or (None, None))):
+        if (low is not None and (value is None or value < low)) or (high is not None and (value is None or value >= high)):
+            return False
+    if hwid is not None and rec.hwid != hwid:
+        return False
+    return key_matches(key, rec, now, **filters)
+
+def record_json(obj):
+    """json.dump default= hook for KeyRecord / ProfileRecord values"""
+    if isinstance(obj, (KeyRecord, ProfileRecord)):
+        return obj.to_json()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+# ============================================================================
+# BACKGROUND THREADS
+# ============================================================================
+
+thread_start_lock = threading.Lock()
+
+def start_once(owner, target):
+    """
+    Run `target` on a daemon thread, once per process per `owner`; returns
+    whether this call started it. Threads don't survive fork, so every
+    gunicorn worker starts its own - owner.pid records which process did.
+    """
+    with thread_start_lock:
+        if owner.pid == os.getpid():
+            return False
+        owner.pid = os.getpid()
+    threading.Thread(target=target, daemon=True).start()
+    return True
+
+# ============================================================================
+# FILE HELPERS - BULLETPROOF
+# ============================================================================
+
+def atomic_write(filepath, data):
+    """
+    ATOMIC FILE WRITE - Prevents corruption even if PC crashes mid-write
+    1. Write to temp file
+    2. Force sync to disk
+    3. Rename (atomic operation)
+    """
+    temp_file = filepath + '.tmp'
+    label = os.path.basename(filepath)
+    try:
+        started = time.perf_counter()
+        with open(temp_file, 'w') as f:
+            json.dump(data, f, indent=2, default=record_json)
+            f.flush()
+            size = f.tell()
+            fsync(f, label)
+
+        if os.path.exists(filepath):
+            keep_previous(filepath, filepath + '.bak')
+
+        os.replace(temp_file, filepath)
+        metrics.observe('atlas_write_duration_seconds', time.perf_counter() - started, file=label)
+        metrics.inc('atlas_write_bytes_total', size, file=label)
+        return True
+    except Exception as e:
+        print(f"[ERROR] Write failed {filepath}: {e}")
+        if os.path.exists(temp_file):
+            try:
+                os.remove(temp_file)
+            except:
+                pass
+        return False
+
+def keep_previous(filepath, backup_path):
+    """Hard-link the current file as .bak - the rename that follows leaves it the old inode"""
+    try:
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        os.link(filepath, backup_path)
+    except OSError:
+        # Filesystem without hard links
+        shutil.copy2(filepath, backup_path)
+
+def write_file(filepath, text, label=None):
+    """temp + fsync + rename, no .bak - for small per-record files"""
+    label = label or os.path.basename(filepath)
+    started = time.perf_counter()
+    temp_file = filepath + '.tmp'
+    with open(temp_file, 'w') as f:
+        f.write(text)
+        f.flush()
+        fsync(f, label)
+    os.replace(temp_file, filepath)
+    metrics.observe('atlas_write_duration_seconds', time.perf_counter() - started, file=label)
+    metrics.inc('atlas_write_bytes_total', len(text), file=label)
+
+def fsync(f, label):
+    """os.fsync, timed under file=<label>"""
+    started = time.perf_counter()
+    os.fsync(f.fileno())
+    metrics.observe('atlas_fsync_duration_seconds', time.perf_counter() - started, file=label)
+
+def load_json_file(filepath, default):
+    """Load a JSON file, falling back to its .bak on corruption"""
+    if os.path.exists(filepath):
+        try:
+            with open(filepath, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"[WARNING] {os.path.basename(filepath)} corrupted: {e}")
+            bak_path = filepath + '.bak'
+            if os.path.exists(bak_path):
+                try:
+                    with open(bak_path, 'r') as f:
+                        data = json.load(f)
+                    print(f"[RECOVERED] Loaded from backup: {os.path.basename(filepath)}")
+                    return data
+                except Exception as e2:
+                    print(f"[ERROR] Backup also corrupted: {e2}")
+            return default
+    return default
+
+def journal_record(kind, ident, value):
+    """
+    One compact journal line per change:
+      k = key record, P = versioned profile, s = stats (value None = deleted)
+      (p = unversioned profile, written by older versions)
+    Records are full-value sets, so replaying twice is harmless.
+    """
+    rec = {'t': kind, 'v': value}
+    if ident is not None:
+        rec['id'] = ident
+    return json.dumps(rec, separators=(',', ':'), default=record_json)
+
+class CommitFailed(RuntimeError):
+    """The journal batch holding a change failed to write / fsync - it isn't durable"""
+
+class CommitScheduler:
+    """
+    GROUP COMMIT - changes arriving within `window_ms` of each other are
+    written with a single fsync. submit() returns only once the batch holding
+    the caller's changes is on disk, so every save is still immediate.
+    """
+
+    def __init__(self, flush, window_ms=10):
+        self.flush = flush
+        self.window = window_ms / 1000.0
+        self.cond = threading.Condition()
+        self.pending = []
+        self.next_batch = 1
+        self.flushed = 0
+        self.failed = set()
+        self.pid = None
+
+    def submit(self, changes):
+        """Queue (kind, ident, value) changes and block until durable"""
+        return self.wait(self.enqueue(changes))
+
+    def enqueue(self, changes):
+        """
+        Serialize and queue changes without waiting. Callers holding a record
+        lock enqueue inside it, so journal order matches memory order.
+        """
+        if not changes:
+            return None
+
+        start_once(self, self._run)
+        with self.cond:
+            # Serialize in queue order so the journal replays to the latest value
+            self.pending.extend((kind, journal_record(kind, ident, value))
+                                for kind, ident, value in changes)
+            self.cond.notify_all()
+            return self.next_batch
+
+    def wait(self, ticket):
+        """Block until the batch holding `ticket` is on disk"""
+        if ticket is None:
+            return True
+
+        with self.cond:
+            while self.flushed < ticket:
+                self.cond.wait()
+            return ticket not in self.failed
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+
+            # Let concurrent requests join this batch
+            if self.window:
+                time.sleep(self.window)
+
+            with self.cond:
+                batch, self.pending = self.pending, []
+                batch_id = self.next_batch
+                self.next_batch += 1
+
+            ok = self.flush(batch)
+
+            with self.cond:
+                if not ok:
+                    self.failed.add(batch_id)
+                    self.failed = {b for b in self.failed if b > batch_id - 1000}
+                self.flushed = batch_id
+                self.cond.notify_all()
+
+class LockStripes:
+    """
+    A fixed pool of locks picked by hash(ident). The same key always maps to
+    the same lock; unrelated keys rarely share one, so they run in parallel.
+    """
+
+    def __init__(self, size=LOCK_STRIPES):
+        self.locks = [threading.Lock() for _ in range(size)]
+
+    def lock(self, ident):
+        return self.locks[hash(ident) % len(self.locks)]
+
+    @contextmanager
+    def hold(self, idents):
+        """Lock several idents at once - in stripe order, so batches can't deadlock"""
+        locks = [self.locks[i] for i in sorted({hash(ident) % len(self.locks) for ident in idents})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+# ============================================================================
+# IN-MEMORY INDEXES
+# ============================================================================
+
+class ExpiryIndex:
+    """
+    Min-heap of (expiry_ts, key). The `expired` count advances as the clock
+    passes heap entries - each key is popped once in its lifetime, so status
+    queries never rescan the key table. Deletes are lazy.
+
+    Keys loaded from keys.snap are not pushed at all: seed() walks the
+    snapshot's own expiry-sorted array instead, so startup is a bisect.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heap = []
+        self.pending = {}    # key -> expiry_ts, not yet expired
+        self.expired = 0
+        self.cursor = 0.0    # everything with expiry_ts < cursor is counted
+        self.recent = deque(maxlen=10000)    # (expiry_ts, key) popped lately
+        self.unreaped = deque()    # (expiry_ts, key) expired since load, for the reaper
+        self.base = ()          # sorted expiries of the snapshot keys
+        self.base_key = None    # position in base -> key
+        self.base_pos = 0
+        self.reap_pos = 0       # snapshot keys already expired at load: base[reap_pos:seed_pos]
+        self.seed_pos = 0
+        self.dropped = set()    # snapshot keys deleted before they expired
+
+    def seed(self, expiries, key_at, now_ts):
+        with self.lock:
+            self.base = expiries
+            self.base_key = key_at
+            self.base_pos = self.seed_pos = bisect_left(expiries, now_ts)
+            self.expired += self.base_pos
+            self.cursor = max(self.cursor, now_ts)
+
+    def add(self, key, expiry_ts):
+        with self.lock:
+            if expiry_ts < self.cursor:
+                self.expired += 1
+                return
+            self.pending[key] = expiry_ts
+            heapq.heappush(self.heap, (expiry_ts, key))
+
+    def remove(self, key, expiry_ts):
+        with self.lock:
+            if self.pending.pop(key, None) is None:
+                if expiry_ts < self.cursor:
+                    self.expired -= 1
+                elif self.base_key is not None:
+                    self.dropped.add(key)
+            # Stale heap entries are skipped on pop; rebuild if they pile up
+            if len(self.heap) > 2 * len(self.pending) + 1024:
+                self.heap = [(ts, k) for k, ts in self.pending.items()]
+                heapq.heapify(self.heap)
+
+    def advance(self, now_ts):
+        """Count everything that expired before now_ts; returns the newly expired keys"""
+        newly = []
+        with self.lock:
+            if now_ts <= self.cursor:
+                return newly
+            self.cursor = now_ts
+            while self.heap and self.heap[0][0] < now_ts:
+                ts, key = heapq.heappop(self.heap)
+                if self.pending.get(key) == ts:
+                    del self.pending[key]
+                    newly.append((ts, key))
+            while self.base_pos < len(self.base) and self.base[self.base_pos] < now_ts:
+                ts, key = self.base[self.base_pos], self.base_key(self.base_pos)
+                self.base_pos += 1
+                if key in self.dropped:
+                    self.dropped.discard(key)
+                    continue
+                newly.append((ts, key))
+            newly.sort()
+            self.expired += len(newly)
+            self.recent.extend(newly)
+            self.unreaped.extend(newly)
+        return [key for _, key in newly]
+
+    def take_expired(self, cutoff, limit):
+        """
+        Pop up to `limit` (expiry_ts, key) that expired before cutoff, oldest
+        first. Deleted keys may still be among them - the caller checks.
+        """
+        self.advance(cutoff)
+        taken = []
+        with self.lock:
+            while len(taken) < limit and self.reap_pos < self.seed_pos and self.base[self.reap_pos] < cutoff:
+                taken.append((self.base[self.reap_pos], self.base_key(self.reap_pos)))
+                self.reap_pos += 1
+            while len(taken) < limit and self.unreaped and self.unreaped[0][0] < cutoff:
+                taken.append(self.unreaped.popleft())
+        return taken
+
+    def requeue(self, taken):
+        """Give back what take_expired() returned when archiving failed"""
+        with self.lock:
+            self.unreaped.extendleft(reversed(taken))
+
+    def count(self, now_ts):
+        self.advance(now_ts)
+        return self.expired
+
+class SortedIndex:
+    """
+    (value, key) pairs kept in order for keyset pagination. scan() reads in
+    chunks and re-seeks by the last pair, so concurrent inserts/deletes
+    never invalidate an iterator.
+    """
+
+    def __init__(self, pairs=()):
+        self.lock = threading.Lock()
+        self.items = sorted(pairs)
+
+    def add_many(self, pairs):
+        with self.lock:
+            if len(pairs) > 32:
+                # Timsort merges the two sorted runs in linear time
+                self.items.extend(pairs)
+                self.items.sort()
+            else:
+                for pair in pairs:
+                    self.items.insert(bisect_left(self.items, pair), pair)
+
+    def remove(self, pair):
+        with self.lock:
+            i = bisect_left(self.items, pair)
+            if i < len(self.items) and self.items[i] == pair:
+                del self.items[i]
+
+    def remove_many(self, pairs):
+        if len(pairs) <= 32:
+            for pair in pairs:
+                self.remove(pair)
+            return
+        # One filtering pass instead of a list shift per pair
+        gone = set(pairs)
+        with self.lock:
+            self.items = [pair for pair in self.items if pair not in gone]
+
+    def scan(self, after=None, descending=False, chunk=256):
+        """Yield (value, key) in order, strictly after `after`"""
+        pos = after
+        while True:
+            with self.lock:
+                if descending:
+                    hi = bisect_left(self.items, pos) if pos is not None else len(self.items)
+                    batch = self.items[max(0, hi - chunk):hi][::-1]
+                else:
+                    lo = bisect_right(self.items, pos) if pos is not None else 0
+                    batch = self.items[lo:lo + chunk]
+            if not batch:
+                return
+            yield from batch
+            pos = batch[-1]
+
+class ChangeLog:
+    """
+    Bounded (version, op, key) feed for one process. Versions start at the
+    load time in microseconds, so they keep increasing across restarts.
+    """
+
+    def __init__(self, size=CHANGE_LOG_SIZE):
+        self.lock = threading.Lock()
+        self.entries = deque(maxlen=size)
+        self.version = time.time_ns() // 1000
+
+    def record(self, op, keys):
+        with self.lock:
+            for key in keys:
+                self.version += 1
+                self.entries.append((self.version, op, key))
+            return self.version
+
+    def since(self, version):
+        with self.lock:
+            if version > self.version:
+                return None
+            oldest = self.entries[0][0] if self.entries else self.version + 1
+            if version < oldest - 1:
+                return None
+            newer = []
+            for entry in reversed(self.entries):
+                if entry[0] <= version:
+                    break
+                newer.append(entry)
+            return newer[::-1]
+
+# ============================================================================
+# KEY SNAPSHOT - binary keys.snap, mmap'd and decoded one record at a time
+# ============================================================================
+
+# keys.snap, native byte order (it never leaves this machine - backups do):
+#   header    magic, key count, used count, offsets of the three arrays below
+#   records   SNAP_RECORD + key, duration and hwid bytes, sorted by key
+#   offsets   uint64 file offset of each record, in key order (binary search)
+#   expiries  float64, ascending - the expired count is a bisect
+#   order     uint32 record number for each entry of expiries
+SNAP_MAGIC = b'ATLSNAP1'
+SNAP_HEADER = struct.Struct('=8sQQQQQ')
+# created, expiry, activated (NaN = None), activations, used, key / duration / hwid lengths
+SNAP_RECORD = struct.Struct('=dddIBHHH')
+SNAP_EXPIRY = struct.Struct('=d')
+SNAP_LENGTHS = struct.Struct('=HHH')
+SNAP_EXPIRY_AT, SNAP_USED_AT, SNAP_LENGTHS_AT = 8, 28, 29
+NO_TIME = float('nan')
+
+def encode_key(key, rec):
+    k, d, h = key.encode(), rec.duration.encode(), (rec.hwid or '').encode()
+    return SNAP_RECORD.pack(
+        NO_TIME if rec.created is None else rec.created, rec.expiry,
+        NO_TIME if rec.activated is None else rec.activated,
+        rec.activations, rec.used, len(k), len(d), len(h)) + k + d + h
+
+def decode_key(buf, off):
+    created, expiry, activated, activations, used, klen, dlen, hlen = SNAP_RECORD.unpack_from(buf, off)
+    pos = off + SNAP_RECORD.size + klen
+    return KeyRecord(
+        created if created == created else None,
+        buf[pos:pos + dlen].decode(),
+        expiry,
+        bool(used),
+        buf[pos + dlen:pos + dlen + hlen].decode() or None,
+        activated if activated == activated else None,
+        activations,
+    )
+
+def write_snapshot(filepath, entries):
+    """
+    Same temp + fsync + rename (+ .bak) dance as atomic_write.
+    `entries` is (key, encode_key() bytes) in key order.
+    """
+    temp_file = filepath + '.tmp'
+    label = os.path.basename(filepath)
+    try:
+        started = time.perf_counter()
+        offsets, expiries, used = array('Q'), array('d'), 0
+        with open(temp_file, 'wb') as f:
+            f.write(bytes(SNAP_HEADER.size))
+            pos = SNAP_HEADER.size
+            for _, raw in entries:
+                offsets.append(pos)
+                expiries.append(SNAP_EXPIRY.unpack_from(raw, SNAP_EXPIRY_AT)[0])
+                used += raw[SNAP_USED_AT]
+                f.write(raw)
+                pos += len(raw)
+
+            order = array('I', sorted(range(len(expiries)), key=expiries.__getitem__))
+            pad = -pos % 8
+            f.write(bytes(pad))
+            offsets_at = pos + pad
+            expiries_at = offsets_at + len(offsets) * 8
+            order_at = expiries_at + len(expiries) * 8
+            f.write(offsets.tobytes())
+            f.write(array('d', (expiries[i] for i in order)).tobytes())
+            f.write(order.tobytes())
+            size = f.tell()
+            f.seek(0)
+            f.write(SNAP_HEADER.pack(SNAP_MAGIC, len(offsets), used, offsets_at, expiries_at, order_at))
+            f.flush()
+            fsync(f, label)
+
+        if os.path.exists(filepath):
+            keep_previous(filepath, filepath + '.bak')
+
+        os.replace(temp_file, filepath)
+        metrics.observe('atlas_write_duration_seconds', time.perf_counter() - started, file=label)
+        metrics.inc('atlas_write_bytes_total', size, file=label)
+        return True
+    except Exception as e:
+        print(f"[ERROR] Write failed {filepath}: {e}")
+        if os.path.exists(temp_file):
+            try:
+                os.remove(temp_file)
+            except:
+                pass
+        return False
+
+class KeySnapshot:
+    """
+    Read-only keys.snap. Opening it maps the file and reads the header -
+    nothing is parsed until a record is asked for, so startup time doesn't
+    grow with the key count, and forked workers share the pages.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < SNAP_HEADER.size:
+                raise ValueError('truncated header')
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.used, offsets_at, expiries_at, order_at = SNAP_HEADER.unpack_from(self.mm)
+        if magic != SNAP_MAGIC or order_at + 4 * self.count != size:
+            raise ValueError('bad header')
+        view = memoryview(self.mm)
+        self.offsets = view[offsets_at:expiries_at].cast('Q')
+        self.expiries = view[expiries_at:order_at].cast('d')
+        self.order = view[order_at:].cast('I')
+
+    def key_bytes(self, i):
+        off = self.offsets[i]
+        klen = SNAP_LENGTHS.unpack_from(self.mm, off + SNAP_LENGTHS_AT)[0]
+        start = off + SNAP_RECORD.size
+        return self.mm[start:start + klen]
+
+    def key(self, i):
+        return self.key_bytes(i).decode()
+
+    def key_by_expiry(self, pos):
+        return self.key(self.order[pos])
+
+    def find(self, key):
+        """Record number of `key`, or -1"""
+        target = key.encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key_bytes(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self.key_bytes(lo) == target else -1
+
+    def record(self, i):
+        return decode_key(self.mm, self.offsets[i])
+
+    def raw(self, i):
+        off = self.offsets[i]
+        klen, dlen, hlen = SNAP_LENGTHS.unpack_from(self.mm, off + SNAP_LENGTHS_AT)
+        return self.mm[off:off + SNAP_RECORD.size + klen + dlen + hlen]
+
+    def expiry(self, i):
+        return SNAP_EXPIRY.unpack_from(self.mm, self.offsets[i] + SNAP_EXPIRY_AT)[0]
+
+    def is_used(self, i):
+        return self.mm[self.offsets[i] + SNAP_USED_AT] == 1
+
+class KeyTable:
+    """
+    key -> KeyRecord on top of a KeySnapshot, with just enough of the dict
+    interface for JsonStorage. A snapshot record is decoded on first get()
+    and kept in `records`, since callers update records in place under the
+    key's stripe. Writes go to `records`, deletes of snapshot keys to
+    `deleted`; write_snapshot(entries()) folds both into a new file.
+    """
+
+    def __init__(self, base=None):
+        self.base = base
+        self.lock = threading.Lock()
+        self.records = {}       # decoded or written since load
+        self.deleted = set()    # snapshot keys removed since load
+        self.count = base.count if base else 0
+
+    def base_index(self, key):
+        """Record number of `key` in the snapshot, -1 if absent or deleted since"""
+        if self.base is None or key in self.deleted:
+            return -1
+        return self.base.find(key)
+
+    def get(self, key, default=None):
+        rec = self.records.get(key)
+        if rec is not None:
+            return rec
+        with self.lock:
+            rec = self.records.get(key)
+            if rec is None:
+                i = self.base_index(key)
+                if i < 0:
+                    return default
+                rec = self.records[key] = self.base.record(i)
+            return rec
+
+    def __contains__(self, key):
+        return key in self.records or self.base_index(key) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def __setitem__(self, key, rec):
+        with self.lock:
+            if key not in self.records and self.base_index(key) < 0:
+                self.count += 1
+            self.records[key] = rec
+
+    def pop(self, key, default=None):
+        with self.lock:
+            i = self.base_index(key)
+            rec = self.records.pop(key, None)
+            if rec is None:
+                if i < 0:
+                    return default
+                rec = self.base.record(i)
+            if i >= 0:
+                self.deleted.add(key)
+            self.count -= 1
+            return rec
+
+    def items(self):
+        with self.lock:
+            changed = list(self.records.items())
+            deleted = set(self.deleted)
+        yield from changed
+        if self.base is None:
+            return
+        seen = {key for key, _ in changed}
+        for i in range(self.base.count):
+            key = self.base.key(i)
+            if key not in seen and key not in deleted:
+                yield key, self.base.record(i)
+
+    def used_count(self):
+        """Used keys, from the snapshot header plus whatever changed since"""
+        with self.lock:
+            used = self.base.used if self.base else 0
+            for key in self.deleted:
+                used -= self.base.is_used(self.base.find(key))
+            for key, rec in self.records.items():
+                i = self.base_index(key)
+                used += rec.used - (self.base.is_used(i) if i >= 0 else 0)
+            return used
+
+    def entries(self):
+        """(key, encoded record) for every live key, in key order - for write_snapshot()"""
+        with self.lock:
+            changed = sorted(self.records.items())
+            deleted = set(self.deleted)
+        base = self.base
+        n, i = (base.count if base else 0), 0
+        # str order is code point order is UTF-8 byte order, so this merge
+        # and find()'s byte comparisons agree
+        for key, rec in changed:
+            while i < n:
+                old = base.key(i)
+                if old > key:
+                    break
+                if old < key and old not in deleted:
+                    yield old, base.raw(i)
+                i += 1
+            yield key, encode_key(key, rec)
+        for i in range(i, n):
+            old = base.key(i)
+            if old not in deleted:
+                yield old, base.raw(i)
+
+class ProfileTable:
+    """
+    HWID -> ProfileRecord, read from its profiles/xx/<sha1>.json the first
+    time it's asked for. Nothing is read at startup.
+    """
+
+    def __init__(self, path_for):
+        self.path_for = path_for
+        self.lock = threading.Lock()
+        self.records = {}
+
+    def read(self, hwid):
+        try:
+            with open(self.path_for(hwid), 'r') as f:
+                doc = json.load(f)
+            return ProfileRecord(doc['version'], doc['data'])
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, IOError) as e:
+            print(f"[WARNING] Skipping profile {hwid}: {e}")
+            return None
+
+    def get(self, hwid, default=None):
+        record = self.records.get(hwid)
+        if record is not None:
+            return record
+        record = self.read(hwid)
+        if record is None:
+            return default
+        with self.lock:
+            # A write that raced the read wins
+            return self.records.setdefault(hwid, record)
+
+    def cached(self, hwid):
+        return self.records.get(hwid)
+
+    def __setitem__(self, hwid, record):
+        with self.lock:
+            self.records[hwid] = record
+
+    def pop(self, hwid, default=None):
+        with self.lock:
+            return self.records.pop(hwid, default)
+
+    def items(self, profiles_dir):
+        """Every profile - the loaded ones, then the rest straight from disk"""
+        with self.lock:
+            loaded = list(self.records.items())
+        yield from loaded
+        seen = {hwid for hwid, _ in loaded}
+        for path in profile_files(profiles_dir):
+            try:
+                with open(path, 'r') as f:
+                    doc = json.load(f)
+            except (ValueError, IOError):
+                continue
+            if doc.get('hwid') not in seen:
+                yield doc['hwid'], ProfileRecord(doc['version'], doc['data'])
+
+def profile_files(profiles_dir):
+    if not os.path.isdir(profiles_dir):
+        return
+    for shard in os.scandir(profiles_dir):
+        if shard.is_dir():
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.json'):
+                    yield entry.path
+
+# ============================================================================
+# STORAGE INTERFACE
+# ============================================================================
+
+class Storage:
+    """
+    Everything app.py needs from persistence. activate() and delete_key()
+    must be atomic with respect to other workers sharing the same store.
+    A write that didn't reach disk raises (CommitFailed for json) rather
+    than returning as if it had.
+    """
+
+    name = 'base'
+
+    def __init__(self):
+        self.listeners = []
+
+    def load(self):
+        """Load / connect. Called once per process before serving."""
+        raise NotImplementedError
+
+    def start(self):
+        """Start background maintenance threads (if any) - idempotent per process"""
+
+    def after_fork(self):
+        """Called in each gunicorn worker when the app was preloaded in the master"""
+
+    def save(self, force=False):
+        """Flush everything to durable storage"""
+        return True
+
+    def backup_changes(self):
+        """
+        (key ids, HWIDs) written since the previous call, for incremental
+        backups. None when that isn't known - take a full backup instead.
+        """
+        return None
+
+    def export(self):
+        """(keys, profiles, stats) in the keys.json schema"""
+        keys = {key: rec.to_json() for key, rec in self.iter_keys()}
+        return keys, self.all_profiles(), self.stats()
+
+    # --- keys ---------------------------------------------------------------
+
+    def get_key(self, key):
+        raise NotImplementedError
+
+    def iter_keys(self):
+        """Yield (key, KeyRecord) for every key"""
+        raise NotImplementedError
+
+    def key_count(self):
+        raise NotImplementedError
+
+    def used_count(self):
+        raise NotImplementedError
+
+    def expired_count(self, now):
+        """Keys with expiry < now (epoch seconds)"""
+        raise NotImplementedError
+
+    def missing(self, candidates):
+        """Subset of candidate key ids that don't exist yet"""
+        raise NotImplementedError
+
+    def query_keys(self, sort='created', descending=True, after=None, limit=100, now=None, **filters):
+        """
+        One page of (key, KeyRecord) ordered by (sort field, key). `after` is
+        the (value, key) of the previous page's last row. Filters: status
+        (unused | active | expired), duration, hwid_prefix, key_prefix.
+        """
+        raise NotImplementedError
+
+    def add_keys(self, records):
+        """Insert {key: KeyRecord} and bump the generation counter - ONE durable write"""
+        raise NotImplementedError
+
+    def activate(self, key, hwid, now):
+        """
+        Atomic check-and-bind. Returns (status, KeyRecord) where status is
+        'ok', 'invalid', 'expired' or 'in_use'. `now` is epoch seconds.
+        """
+        raise NotImplementedError
+
+    def activate_many(self, pairs, now):
+        """activate() for each (key, hwid) pair, committed as ONE durable write"""
+        return [self.activate(key, hwid, now) for key, hwid in pairs]
+
+    def delete_key(self, key):
+        raise NotImplementedError
+
+    def remove_keys(self, keys, predicate=None):
+        """
+        Delete many keys at once - returns how many were deleted. With a
+        predicate(key, KeyRecord), only keys it still holds for at delete time.
+        """
+        if predicate is not None:
+            keys = [key for key, rec in ((key, self.get_key(key)) for key in keys)
+                    if rec is not None and predicate(key, rec)]
+        return sum(1 for key in keys if self.delete_key(key))
+
+    def update_keys(self, keys, change):
+        """
+        Atomically replace each existing key's record with change(key, copy
+        of it); change returns None to leave a key alone. ONE durable write.
+        Returns [(key, old KeyRecord, new KeyRecord)] for the keys changed.
+        """
+        raise NotImplementedError
+
+    def select_keys(self, now, keys=None, created=None, expiry=None, hwid=None, **filters):
+        """
+        Every (key, KeyRecord) passing key_selected(), in one walk: a key list
+        is looked up directly, otherwise the expiry (or created) index is
+        scanned from the range start and stops at its end.
+        """
+        if keys is not None:
+            for key in keys:
+                rec = self.get_key(key)
+                if rec is not None and key_selected(key, rec, now, None, created, expiry, hwid, **filters):
+                    yield key, rec
+            return
+
+        sort, (low, high) = ('expiry', expiry) if expiry else ('created', created or (None, None))
+        if hwid is not None:
+            filters.setdefault('hwid_prefix', hwid)    # lets the backend narrow it down
+        after = (low, '') if low is not None else None
+        while True:
+            page = self.query_keys(sort, False, after, 1000, now=now, **filters)
+            for key, rec in page:
+                if high is not None and (getattr(rec, sort) or 0.0) >= high:
+                    return
+                if key_selected(key, rec, now, None, created, expiry, hwid):
+                    yield key, rec
+            if len(page) < 1000:
+                return
+            last_key, last_rec = page[-1]
+            after = (getattr(last_rec, sort) or 0.0, last_key)
+
+    def expired_before(self, cutoff, limit):
+        """Up to `limit` (key, KeyRecord) that expired before `cutoff`, oldest first"""
+        raise NotImplementedError
+
+    def reap(self, cutoff, limit, archive):
+        """
+        Move up to `limit` keys that expired before `cutoff` out of the store.
+        archive([(key, KeyRecord)]) must have them durable before they're
+        removed - a crash in between leaves a key in both, never in neither.
+        """
+        found = self.expired_before(cutoff, limit)
+        if found:
+            archive(found)
+            self.remove_keys([key for key, _ in found])
+        return len(found)
+
+    # --- change feed --------------------------------------------------------
+
+    def version(self):
+        """Monotonic version of the key table; bumps on create / activate / update / delete"""
+        raise NotImplementedError
+
+    def changes_since(self, version):
+        """
+        [(version, op, key)] newer than `version`, op in created | activated |
+        updated | deleted. None when the feed no longer reaches back that far.
+        """
+        raise NotImplementedError
+
+    def expired_between(self, start, end, limit=1000):
+        """Key ids whose expiry falls in [start, end) - feeds 'expired' events"""
+        raise NotImplementedError
+
+    # --- events -------------------------------------------------------------
+
+    def publish(self, event):
+        """Deliver a JSON-able event dict to listen() callbacks in every worker"""
+        for callback in list(self.listeners):
+            callback(event)
+
+    def listen(self, callback):
+        """Register a callback for published events (this process only has one store)"""
+        if callback not in self.listeners:    # inherited across fork
+            self.listeners.append(callback)
+
+    # --- profiles / stats ---------------------------------------------------
+
+    def get_profile(self, hwid):
+        raise NotImplementedError
+
+    def set_profile(self, hwid, data):
+        return self.update_profile(hwid, lambda current: data)[0] == 'ok'
+
+    def profile_entry(self, hwid):
+        """(version, serialized JSON) - (0, None) when the HWID has no profile"""
+        raise NotImplementedError
+
+    def update_profile(self, hwid, change, expect=None):
+        """
+        Atomically replace a profile with change(current data or None).
+        With `expect`, only if the stored version still equals it.
+        Returns (status, version, body) - status 'ok', 'conflict' or 'failed'.
+        """
+        raise NotImplementedError
+
+    def all_profiles(self):
+        raise NotImplementedError
+
+    def profile_count(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+# ============================================================================
+# JSON FILE BACKEND - journal + snapshots, ONE PROCESS ONLY
+# ============================================================================
+
+class JsonStorage(Storage):
+    """
+    keys.snap / stats.json snapshots, one profiles/xx/<sha1>.json file per
+    HWID, plus an append-only journal. State lives in this process, so run
+    a single worker with it. keys.json is only read - on the first start,
+    or when it is newer than keys.snap (restored from a backup).
+    """
+
+    name = 'json'
+
+    def __init__(self, data_dir=DATA_DIR, commit_window_ms=COMMIT_WINDOW_MS):
+        super().__init__()
+        self.keys_file = os.path.join(data_dir, 'keys.json')    # pre-snapshot / restores
+        self.snap_file = os.path.join(data_dir, 'keys.snap')
+        self.profiles_file = os.path.join(data_dir, 'profiles.json')    # pre-versioning
+        self.profiles_dir = os.path.join(data_dir, 'profiles')
+        self.stats_file = os.path.join(data_dir, 'stats.json')
+        self.journal_file = os.path.join(data_dir, 'journal.log')
+
+        self.keys = KeyTable()
+        self.profiles = ProfileTable(self.profile_path)
+        self.stats_data = default_stats()
+        self.loaded_state = None
+
+        # Maintained counters - /api/status and admin stats never scan keys
+        self.counter_lock = threading.Lock()
+        self.used = 0
+        self.expiry_index = ExpiryIndex()
+        self.new_profiles = set()    # HWIDs with no file yet
+        self.profile_total = None    # counted on first use
+
+        # created / expiry order for the admin list, built on first use
+        self.index_lock = threading.Lock()
+        self.sort_indexes = {}
+        self.change_log = ChangeLog()
+
+        # Read-check-write on one key / one profile happens under its stripe;
+        # the fsync happens after the stripe is released
+        self.key_locks = LockStripes()
+        self.profile_locks = LockStripes()
+
+        # Thread lock for file operations (writer thread and compaction only)
+        self.file_lock = metrics.TimedLock('file_lock')
+        self.data_modified = False
+        self.journal_records = 0
+        self.dirty = set()
+        self.dirty_profiles = set()
+        # Changed since the last backup; None until the first backup_changes()
+        # call, since a fresh process can't know what the last backup missed
+        self.backup_lock = threading.Lock()
+        self.backup_keys = None
+        self.backup_profiles = None
+        self.last_compaction = time.time()
+        self.committer = CommitScheduler(self.write_journal, commit_window_ms)
+        self.commit_listeners = []
+        self.pid = None    # process running auto_save_worker
+
+    # --- persistence --------------------------------------------------------
+
+    def persist(self, *changes):
+        """Journal (kind, ident, value) changes - SAVES IMMEDIATELY (group commit)"""
+        self.track_backup(changes)
+        return self.committer.submit(changes)
+
+    def enqueue(self, *changes):
+        """persist() minus the wait - call inside the record lock, wait() outside"""
+        self.track_backup(changes)
+        return self.committer.enqueue(changes)
+
+    @staticmethod
+    def durable(ok):
+        """Raise CommitFailed unless persist() / committer.wait() reported the batch on disk"""
+        if not ok:
+            raise CommitFailed('Journal write failed - change not saved')
+
+    def track_backup(self, changes):
+        with self.backup_lock:
+            if self.backup_keys is None:
+                return
+            for kind, ident, _ in changes:
+                if kind == 'k':
+                    self.backup_keys.add(ident)
+                elif kind in ('p', 'P'):
+                    self.backup_profiles.add(ident)
+
+    def backup_changes(self):
+        with self.backup_lock:
+            changes = None if self.backup_keys is None else (self.backup_keys, self.backup_profiles)
+            self.backup_keys, self.backup_profiles = set(), set()
+            return changes
+
+    def write_journal(self, entries):
+        """
+        APPEND-ONLY WRITE - one write + one fsync for a whole batch of
+        (kind, line) entries. Turns a per-request full rewrite into a small append.
+        """
+        if not entries:
+            return True
+
+        with self.file_lock:
+            try:
+                started = time.perf_counter()
+                text = '\n'.join(line for _, line in entries) + '\n'
+                with open(self.journal_file, 'a') as f:
+                    f.write(text)
+                    f.flush()
+                    fsync(f, 'journal.log')
+                metrics.observe('atlas_write_duration_seconds', time.perf_counter() - started, file='journal.log')
+                metrics.inc('atlas_write_bytes_total', len(text), file='journal.log')
+                self.journal_records += len(entries)
+                for kind, _ in entries:
+                    self.dirty.add(JOURNAL_TABLES[kind])
+                self.data_modified = True
+                for callback in self.commit_listeners:
+                    callback([line for _, line in entries])
+
+                if self.journal_records >= JOURNAL_COMPACT_RECORDS:
+                    self.compact_journal()
+                return True
+            except Exception as e:
+                print(f"[ERROR] Journal append failed: {e}")
+                return False
+
+    def on_commit(self, callback):
+        """
+        callback(journal lines) after every durable append - under file_lock,
+        so callbacks see batches in journal order (replication.Primary)
+        """
+        self.commit_listeners.append(callback)
+
+    def replication_snapshot(self, offset):
+        """
+        (offset(), open keys.snap or None, stats) for a new replica. Compacted
+        under file_lock, so the files hold every record the offset counts -
+        and maybe a few later ones, which the stream then re-applies harmlessly.
+        """
+        with self.file_lock:
+            if not self.compact_journal():
+                raise OSError('compaction failed')
+            snap = open(self.snap_file, 'rb') if os.path.exists(self.snap_file) else None
+            return offset(), snap, dict(self.stats_data)
+
+    def compact_journal(self, tables=None):
+        """
+        Fold the journal into snapshot files, then truncate it.
+        Snapshots are written first: if we crash in between, the journal is
+        simply replayed over the newer snapshot. Caller must hold file_lock.
+        """
+        with metrics.timer('atlas_compaction_duration_seconds'):
+            return self._compact(tables)
+
+    def _compact(self, tables):
+        success = True
+        for table in (tables or self.dirty):
+            if table == 'profiles':
+                success &= self.write_profiles()
+            elif table == 'keys':
+                success &= write_snapshot(self.snap_file, self.keys.entries())
+            else:
+                # Shallow copy so concurrent updates can't break serialization
+                success &= atomic_write(self.stats_file, dict(self.stats_data))
+
+        if not success:
+            return False
+
+        with open(self.journal_file, 'w') as f:
+            f.flush()
+            fsync(f, 'journal.log')
+
+        self.journal_records = 0
+        self.dirty.clear()
+        self.data_modified = False
+        self.last_compaction = time.time()
+        return True
+
+    def profile_path(self, hwid):
+        digest = hashlib.sha1(hwid.encode()).hexdigest()
+        return os.path.join(self.profiles_dir, digest[:2], digest + '.json')
+
+    def write_profiles(self):
+        """Rewrite only the HWIDs changed since the last compaction"""
+        success = True
+        for hwid in list(self.dirty_profiles):
+            record = self.profiles.cached(hwid)
+            path = self.profile_path(hwid)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_file(path, json.dumps(dict(record.to_json(), hwid=hwid)), label='profile')
+                with self.counter_lock:
+                    self.new_profiles.discard(hwid)
+                with self.profile_locks.lock(hwid):
+                    if self.profiles.cached(hwid) is record:    # not rewritten meanwhile
+                        self.dirty_profiles.discard(hwid)
+            except Exception as e:
+                print(f"[ERROR] Write failed {path}: {e}")
+                success = False
+        return success
+
+    def load_keys(self):
+        """keys.snap (mapped, not parsed) - or keys.json when that is newer"""
+        snap_time = os.path.getmtime(self.snap_file) if os.path.exists(self.snap_file) else None
+        if os.path.exists(self.keys_file) and (snap_time is None or os.path.getmtime(self.keys_file) > snap_time):
+            table = KeyTable()
+            for key, value in load_json_file(self.keys_file, {}).items():
+                table[key] = KeyRecord.from_json(value)
+            if snap_time is not None:
+                print(f"[INFO] keys.json is newer than keys.snap - loading it")
+            return table, True
+
+        for path in (self.snap_file, self.snap_file + '.bak'):
+            if not os.path.exists(path):
+                continue
+            try:
+                table = KeyTable(KeySnapshot(path))
+            except (ValueError, OSError) as e:
+                print(f"[WARNING] {os.path.basename(path)} corrupted: {e}")
+                continue
+            if path != self.snap_file:
+                print(f"[RECOVERED] Loaded from backup: {os.path.basename(path)}")
+            return table, path != self.snap_file
+        return KeyTable(), False
+
+    def load_profiles(self):
+        """Profile files are read on demand; only a pre-versioning profiles.json is loaded here"""
+        profiles = ProfileTable(self.profile_path)
+        legacy = load_json_file(self.profiles_file, {}) if os.path.exists(self.profiles_file) else {}
+        for hwid, data in legacy.items():
+            if profiles.get(hwid) is None:
+                profiles[hwid] = ProfileRecord(1, data)
+                self.dirty_profiles.add(hwid)
+                self.new_profiles.add(hwid)
+        return profiles, bool(legacy)
+
+    def replay_journal(self):
+        """Re-apply journal records written since the last compaction"""
+        if not os.path.exists(self.journal_file):
+            return 0
+
+        tables = {'k': self.keys, 'p': self.profiles, 'P': self.profiles}
+        decode = {
+            'k': KeyRecord.from_json,
+            'P': lambda v: ProfileRecord(v['version'], v['data']),
+        }
+        applied = 0
+        with open(self.journal_file, 'r') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn tail from a crash mid-append - everything before it is intact
+                    print(f"[WARNING] Journal truncated after {applied} records")
+                    break
+
+                kind, value = rec['t'], rec['v']
+                if kind in ('p', 'P') and value is not None and self.profiles.get(rec['id']) is None:
+                    self.new_profiles.add(rec['id'])
+                if kind == 's':
+                    self.stats_data.update(value)
+                elif value is None:
+                    tables[kind].pop(rec['id'], None)
+                elif kind == 'p':
+                    old = self.profiles.get(rec['id'])
+                    self.profiles[rec['id']] = ProfileRecord(old.version + 1 if old else 1, value)
+                else:
+                    tables[kind][rec['id']] = decode[kind](value)
+                if kind in ('p', 'P'):
+                    self.dirty_profiles.add(rec['id'])
+                self.dirty.add(JOURNAL_TABLES[kind])
+                applied += 1
+
+        return applied
+
+    def load(self):
+        """Load data with automatic corruption recovery - O(journal), not O(keys)"""
+        started = time.perf_counter()
+        self.new_profiles = set()
+        self.profile_total = None
+        self.keys, migrate_keys = self.load_keys()
+        self.profiles, migrate = self.load_profiles()
+        self.stats_data = load_json_file(self.stats_file, default_stats())
+
+        replayed = self.replay_journal()
+        if replayed:
+            print(f"[RECOVERED] Replayed {replayed} journal records")
+        if replayed or migrate or migrate_keys:
+            with self.file_lock:
+                self.dirty.add('profiles')
+                if migrate_keys:
+                    self.dirty.add('keys')
+                if self.compact_journal() and migrate:
+                    # Split into per-HWID files - keep the old file for reference
+                    os.replace(self.profiles_file, self.profiles_file + '.migrated')
+                    print(f"[INFO] Split profiles.json into {self.profiles_dir}")
+
+        self.rebuild_counters()
+        self.loaded_state = self.disk_state()
+        print(f"[INFO] Loaded {len(self.keys)} keys in {time.perf_counter() - started:.2f}s "
+              f"(profiles load on first use)")
+        return True
+
+    def rebuild_counters(self):
+        """Counts come from the snapshot header + the few records changed since"""
+        self.used = self.keys.used_count()
+        self.sort_indexes = {}
+        self.expiry_index = ExpiryIndex()
+        base = self.keys.base
+        if base:
+            self.expiry_index.seed(base.expiries, base.key_by_expiry, time.time())
+            for key in list(self.keys.deleted):
+                self.expiry_index.remove(key, base.expiry(base.find(key)))
+        for key, rec in list(self.keys.records.items()):
+            if self.keys.base_index(key) < 0:
+                self.expiry_index.add(key, rec.expiry)
+
+    def disk_state(self):
+        def stat(path):
+            try:
+                st = os.stat(path)
+                return st.st_ino, st.st_mtime_ns, st.st_size
+            except OSError:
+                return None
+        return stat(self.snap_file), stat(self.keys_file), stat(self.journal_file), stat(self.stats_file)
+
+    def after_fork(self):
+        """
+        gunicorn preload_app: the master loaded once and its state is shared
+        with the workers it forks. A worker forked later (restart after a
+        crash / max_requests) reloads if the files changed since.
+        """
+        if self.disk_state() != self.loaded_state:
+            print(f"[INFO] Data changed since the master loaded it - reloading in worker {os.getpid()}")
+            self.load()
+
+    def save(self, force=False):
+        """Write full snapshots of all data and reset the journal - THREAD SAFE"""
+        with self.file_lock:
+            try:
+                success = self.compact_journal(tables=('keys', 'profiles', 'stats'))
+                if success and force:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 💾 Data saved to disk")
+                return success
+            except Exception as e:
+                print(f"[ERROR] Save failed: {e}")
+                return False
+
+    def start(self):
+        start_once(self, self.auto_save_worker)
+
+    def auto_save_worker(self):
+        """Every change is already journaled - this only compacts old journals"""
+        while True:
+            time.sleep(30)
+            if self.data_modified and time.time() - self.last_compaction >= JOURNAL_COMPACT_INTERVAL:
+                with self.file_lock:
+                    self.compact_journal()
+                print(f"[{datetime.now().strftime('%H:%M')}] Journal compacted")
+
+    # --- keys ---------------------------------------------------------------
+
+    def get_key(self, key):
+        return self.keys.get(key)
+
+    def iter_keys(self):
+        return iter(list(self.keys.items()))
+
+    def key_count(self):
+        return len(self.keys)
+
+    def used_count(self):
+        return self.used
+
+    def expired_count(self, now):
+        return self.expiry_index.count(now)
+
+    def missing(self, candidates):
+        return {key for key in candidates if key not in self.keys}
+
+    def sort_index(self, field):
+        with self.index_lock:
+            idx = self.sort_indexes.get(field)
+            if idx is None:
+                idx = SortedIndex((getattr(rec, field) or 0.0, key) for key, rec in list(self.keys.items()))
+                self.sort_indexes[field] = idx
+            return idx
+
+    def query_keys(self, sort='created', descending=True, after=None, limit=100, now=None, **filters):
+        now = time.time() if now is None else now
+        page = []
+        for _, key in self.sort_index(sort).scan(after, descending):
+            rec = self.keys.get(key)
+            if rec is not None and key_matches(key, rec, now, **filters):
+                page.append((key, rec))
+                if len(page) >= limit:
+                    break
+        return page
+
+    def add_keys(self, records):
+        changes = []
+        with self.index_lock:
+            for key, record in records.items():
+                self.keys[key] = record
+                self.expiry_index.add(key, record.expiry)
+                changes.append(('k', key, record))
+            for field, idx in self.sort_indexes.items():
+                idx.add_many([(getattr(rec, field) or 0.0, key) for key, rec in records.items()])
+            self.change_log.record('created', records)
+
+        with self.counter_lock:
+            self.stats_data['generations'] += len(records)
+        changes.append(('s', None, self.stats_data))
+        self.durable(self.persist(*changes))
+        return True
+
+    def activate(self, key, hwid, now):
+        with self.key_locks.lock(key):
+            status, data = self.bind(key, hwid, now)
+            ticket = self.enqueue(('k', key, data), ('s', None, self.stats_data)) if status == 'ok' else None
+        self.durable(self.committer.wait(ticket))
+        return status, data
+
+    def activate_many(self, pairs, now):
+        results, bound = [], {}
+        with self.key_locks.hold([key for key, _ in pairs]):
+            for key, hwid in pairs:
+                status, data = self.bind(key, hwid, now)
+                if status == 'ok':
+                    bound[key] = data
+                    data = data.copy()    # as of this item, like the other backends
+                results.append((status, data))
+            ticket = None
+            if bound:
+                ticket = self.enqueue(*[('k', key, data) for key, data in bound.items()],
+                                      ('s', None, self.stats_data))
+        self.durable(self.committer.wait(ticket))
+        return results
+
+    def bind(self, key, hwid, now):
+        """In-memory part of activate() - caller holds the key's stripe and persists"""
+        data = self.keys.get(key)
+        if data is None:
+            return 'invalid', None
+
+        if data.expiry < now:
+            return 'expired', data
+
+        if data.used and data.hwid and data.hwid != hwid:
+            return 'in_use', data
+
+        if not data.used or data.hwid != hwid:
+            self.change_log.record('activated', [key])
+
+        if not data.used:
+            data.used = True
+            data.activated = now
+            with self.counter_lock:
+                self.used += 1
+
+        data.hwid = hwid
+        data.activations += 1
+
+        with self.counter_lock:
+            self.stats_data['validations'] += 1
+        return 'ok', data
+
+    def delete_key(self, key):
+        return self.remove_keys([key]) == 1
+
+    def remove_keys(self, keys, predicate=None):
+        removed = []
+        with self.key_locks.hold(keys):
+            with self.index_lock:
+                for key in keys:
+                    data = self.keys.get(key)
+                    if data is not None and (predicate is None or predicate(key, data.copy())):
+                        removed.append((key, data))
+                for key, _ in removed:
+                    self.keys.pop(key, None)
+                for field, idx in self.sort_indexes.items():
+                    idx.remove_many([(getattr(data, field) or 0.0, key) for key, data in removed])
+                self.change_log.record('deleted', [key for key, _ in removed])
+            used = sum(1 for _, data in removed if data.used)
+            if used:
+                with self.counter_lock:
+                    self.used -= used
+            for key, data in removed:
+                self.expiry_index.remove(key, data.expiry)
+            ticket = self.enqueue(*[('k', key, None) for key, _ in removed]) if removed else None
+        self.durable(self.committer.wait(ticket))
+        return len(removed)
+
+    def update_keys(self, keys, change):
+        updated = []
+        with self.key_locks.hold(keys):
+            with self.index_lock:
+                # Every change is made and serialized before anything moves - a bad
+                # record (NaN / out-of-range expiry) raises with the store untouched
+                for key in keys:
+                    old = self.keys.get(key)
+                    new = change(key, old.copy()) if old is not None else None
+                    if new is not None:
+                        updated.append((key, old, new))
+                records = [('k', key, new) for key, _, new in updated]
+                for _, key, new in records:
+                    journal_record('k', key, new)
+                for key, _, new in updated:
+                    self.keys[key] = new
+                for field, idx in self.sort_indexes.items():
+                    moved = [(key, old, new) for key, old, new in updated if getattr(old, field) != getattr(new, field)]
+                    idx.remove_many([(getattr(old, field) or 0.0, key) for key, old, _ in moved])
+                    idx.add_many([(getattr(new, field) or 0.0, key) for key, _, new in moved])
+                self.change_log.record('updated', [key for key, _, _ in updated])
+            used = sum(new.used - old.used for _, old, new in updated)
+            if used:
+                with self.counter_lock:
+                    self.used += used
+            for key, old, new in updated:
+                if old.expiry != new.expiry:
+                    self.expiry_index.remove(key, old.expiry)
+                    self.expiry_index.add(key, new.expiry)
+            ticket = self.enqueue(*records) if records else None
+        self.durable(self.committer.wait(ticket))
+        return updated
+
+    def version(self):
+        return self.change_log.version
+
+    def changes_since(self, version):
+        return self.change_log.since(version)
+
+    def expired_between(self, start, end, limit=1000):
+        self.expiry_index.advance(end)
+        return [key for ts, key in list(self.expiry_index.recent) if start <= ts < end][:limit]
+
+    def reap(self, cutoff, limit, archive):
+        # Driven by the expiry index rather than a query - nothing is scanned
+        taken = self.expiry_index.take_expired(cutoff, limit)
+        found = []
+        for ts, key in taken:
+            rec = self.keys.get(key)
+            if rec is not None and rec.expiry == ts:    # not deleted / re-created since
+                found.append((key, rec.copy()))
+        if not found:
+            return 0
+        try:
+            archive(found)
+        except Exception:
+            self.expiry_index.requeue(taken)
+            raise
+        self.remove_keys([key for key, _ in found])
+        return len(found)
+
+    # --- profiles / stats ---------------------------------------------------
+
+    def get_profile(self, hwid):
+        record = self.profiles.get(hwid)
+        return record.data if record else None
+
+    def profile_entry(self, hwid):
+        record = self.profiles.get(hwid)
+        return (record.version, record.body) if record else (0, None)
+
+    def update_profile(self, hwid, change, expect=None):
+        with self.profile_locks.lock(hwid):
+            current = self.profiles.get(hwid)
+            version = current.version if current else 0
+            if expect is not None and expect != version:
+                return 'conflict', version, current.body if current else None
+            record = ProfileRecord(version + 1, change(current.data if current else None))
+            if current is None:
+                with self.counter_lock:
+                    self.new_profiles.add(hwid)
+                    if self.profile_total is not None:
+                        self.profile_total += 1
+            self.profiles[hwid] = record
+            self.dirty_profiles.add(hwid)
+            ticket = self.enqueue(('P', hwid, record))
+        ok = self.committer.wait(ticket)
+        return 'ok' if ok else 'failed', record.version, record.body
+
+    def all_profiles(self):
+        return {hwid: record.data for hwid, record in self.profiles.items(self.profiles_dir)}
+
+    def profile_count(self):
+        if self.profile_total is None:
+            # One directory listing, then kept up to date by update_profile()
+            with self.file_lock:
+                on_disk = sum(1 for _ in profile_files(self.profiles_dir))
+                with self.counter_lock:
+                    if self.profile_total is None:
+                        self.profile_total = on_disk + len(self.new_profiles)
+        return self.profile_total
+
+    def stats(self):
+        return dict(self.stats_data)
+
+def read_json_store(data_dir):
+    """(keys, profiles, stats) of a json-backend DATA_DIR - snapshot + journal"""
+    store = JsonStorage(data_dir)
+    store.load()
+    return store.export()
+
+# ============================================================================
+# JSON READ REPLICA - a copy of a json primary, fed by replication.Follower
+# ============================================================================
+
+class MemoryProfileTable(ProfileTable):
+    """ProfileTable with no files behind it - a replica is sent every profile"""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def read(self, hwid):
+        return None
+
+class ReplicaStorage(JsonStorage):
+    """
+    Read-only JsonStorage. install() swaps in a snapshot from the primary,
+    apply() the journal lines streamed after it, keeping counters and
+    indexes current the way the write paths do. Nothing touches disk -
+    app.py forwards every write to the primary.
+    """
+
+    name = 'replica'
+
+    def __init__(self):
+        super().__init__()
+        self.profiles = MemoryProfileTable()
+        self.profile_total = 0
+
+    def load(self):
+        return True    # state arrives from the primary
+
+    def save(self, force=False):
+        return True
+
+    def start(self):
+        pass
+
+    def after_fork(self):
+        pass
+
+    def persist(self, *changes):
+        raise RuntimeError('Read replica - writes go to the primary')
+
+    enqueue = persist
+
+    def install(self, snap_path, profiles, stats):
+        """Replace everything with a primary's snapshot; `profiles` is [(hwid, ProfileRecord)]"""
+        keys = KeyTable(KeySnapshot(snap_path)) if snap_path else KeyTable()
+        table = MemoryProfileTable()
+        for hwid, record in profiles:
+            table[hwid] = record
+        with self.index_lock:
+            self.keys, self.profiles = keys, table
+            self.stats_data = stats
+            self.profile_total = len(table.records)
+            self.rebuild_counters()
+
+    def apply(self, lines):
+        """Apply journal lines from the primary; returns the keys deleted"""
+        deleted = []
+        for line in lines:
+            rec = json.loads(line)
+            kind, ident, value = rec['t'], rec.get('id'), rec['v']
+            if kind == 's':
+                self.stats_data.update(value)
+            elif kind == 'k':
+                new = None if value is None else KeyRecord.from_json(value)
+                if self.apply_key(ident, new) is not None and new is None:
+                    deleted.append(ident)
+            else:
+                self.apply_profile(ident, kind, value)
+        return deleted
+
+    def apply_key(self, key, new):
+        with self.key_locks.lock(key):
+            with self.index_lock:
+                old = self.keys.get(key)
+                if new is None:
+                    self.keys.pop(key, None)
+                else:
+                    self.keys[key] = new
+                for field, idx in self.sort_indexes.items():
+                    if old is not None:
+                        idx.remove((getattr(old, field) or 0.0, key))
+                    if new is not None:
+                        idx.add_many([(getattr(new, field) or 0.0, key)])
+                if old is None and new is not None:
+                    self.change_log.record('created', [key])
+                elif new is None and old is not None:
+                    self.change_log.record('deleted', [key])
+                elif new is not None and new.used and (not old.used or old.hwid != new.hwid):
+                    self.change_log.record('activated', [key])
+            with self.counter_lock:
+                self.used += (new is not None and new.used) - (old is not None and old.used)
+            if old is not None:
+                self.expiry_index.remove(key, old.expiry)
+            if new is not None:
+                self.expiry_index.add(key, new.expiry)
+        return old
+
+    def apply_profile(self, hwid, kind, value):
+        with self.profile_locks.lock(hwid):
+            old = self.profiles.get(hwid)
+            if value is None:
+                self.profiles.pop(hwid)
+            elif kind == 'P':
+                self.profiles[hwid] = ProfileRecord(value['version'], value['data'])
+            else:
+                self.profiles[hwid] = ProfileRecord(old.version + 1 if old else 1, value)
+            with self.counter_lock:
+                self.profile_total += (value is not None) - (old is not None)
+
+    def all_profiles(self):
+        return {hwid: record.data for hwid, record in list(self.profiles.records.items())}
+
+    def profile_count(self):
+        return self.profile_total
+
+# ============================================================================
+# REDIS BACKEND - shared state for gunicorn -w N and multiple hosts
+# ============================================================================
+
+# Appended to scripts that change keys: bump the version, log, trim
+# KEYS[n]: version counter, KEYS[n+1]: changes zset
+CHANGE_LUA = """
+local function log_change(vkey, zkey, op, id, keep)
+    local v = redis.call('INCR', vkey)
+    redis.call('ZADD', zkey, v, v .. ':' .. op .. ':' .. id)
+    if v % 100 == 0 then
+        redis.call('ZREMRANGEBYRANK', zkey, 0, -(tonumber(keep) + 1))
+    end
+end
+"""
+
+# KEYS: version counter, changes zset   ARGV: op, keep, key ids...
+CHANGES_SCRIPT = CHANGE_LUA + """
+for i = 3, #ARGV do
+    log_change(KEYS[1], KEYS[2], ARGV[1], ARGV[i], ARGV[2])
+end
+return redis.call('GET', KEYS[1])
+"""
+
+# KEYS: key hash, stats hash, counters hash, version, changes, backup:keys
+# ARGV: hwid, now (epoch), now (iso), key id, keep
+ACTIVATE_SCRIPT = CHANGE_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {'invalid'}
+end
+local f = redis.call('HMGET', KEYS[1], 'expiry_ts', 'used', 'hwid')
+if tonumber(f[1]) < tonumber(ARGV[2]) then
+    return {'expired', unpack(redis.call('HGETALL', KEYS[1]))}
+end
+if f[2] == '1' and f[3] ~= '' and f[3] ~= ARGV[1] then
+    return {'in_use', unpack(redis.call('HGETALL', KEYS[1]))}
+end
+if f[2] ~= '1' or f[3] ~= ARGV[1] then
+    log_change(KEYS[4], KEYS[5], 'activated', ARGV[4], ARGV[5])
+end
+if f[2] ~= '1' then
+    redis.call('HSET', KEYS[1], 'used', '1', 'activated', ARGV[3])
+    redis.call('HINCRBY', KEYS[3], 'used', 1)
+end
+redis.call('HSET', KEYS[1], 'hwid', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'activations', 1)
+redis.call('HINCRBY', KEYS[2], 'validations', 1)
+redis.call('SADD', KEYS[6], ARGV[4])
+return {'ok', unpack(redis.call('HGETALL', KEYS[1]))}
+"""
+
+# KEYS: key hash, key id set, expiry zset, counters hash, created zset, version, changes, backup:keys
+# ARGV: key id, keep
+DELETE_SCRIPT = CHANGE_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if redis.call('HGET', KEYS[1], 'used') == '1' then
+    redis.call('HINCRBY', KEYS[4], 'used', -1)
+end
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[5], ARGV[1])
+log_change(KEYS[6], KEYS[7], 'deleted', ARGV[1], ARGV[2])
+redis.call('SADD', KEYS[8], ARGV[1])
+return 1
+"""
+
+class RedisStorage(Storage):
+    """
+    One hash per key plus a few shared structures:
+      {prefix}key:<KEY>     hash, keys.json fields + expiry_ts
+      {prefix}keys          set of all key ids
+      {prefix}expiry        zset key id -> expiry epoch
+      {prefix}created       zset key id -> created epoch
+      {prefix}version       change counter; {prefix}changes zset "v:op:key" by v
+      {prefix}counters      hash: used
+      {prefix}stats         hash: validations, generations, last_reset
+      {prefix}profile:<id>  JSON string; {prefix}profiles set of HWIDs
+      {prefix}profile_version:<id>  write counter for the profile's ETag
+      {prefix}backup:keys / backup:profiles  sets written since the last backup
+    Pass `client` to run against fakeredis or an existing connection.
+    """
+
+    name = 'redis'
+
+    def __init__(self, url=None, client=None, prefix='atlas:', data_dir=DATA_DIR):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or 'redis://localhost:6379/0', decode_responses=True)
+        super().__init__()
+        self.r = client
+        self.prefix = prefix
+        self.listener_pid = None
+        self.data_dir = data_dir
+        self._activate = self.r.register_script(ACTIVATE_SCRIPT)
+        self._delete = self.r.register_script(DELETE_SCRIPT)
+        self._changes = self.r.register_script(CHANGES_SCRIPT)
+
+    def k(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    @staticmethod
+    def to_hash(rec):
+        return {
+            'created': iso(rec.created) or '',
+            'duration': rec.duration,
+            'expiry': iso(rec.expiry),
+            'expiry_ts': rec.expiry,
+            'used': '1' if rec.used else '0',
+            'hwid': rec.hwid or '',
+            'activated': iso(rec.activated) or '',
+            'activations': rec.activations,
+        }
+
+    @staticmethod
+    def from_hash(h):
+        if not h:
+            return None
+        return KeyRecord(
+            epoch(h.get('created')),
+            h.get('duration') or '7days',
+            float(h['expiry_ts']),
+            h.get('used') == '1',
+            h.get('hwid') or None,
+            epoch(h.get('activated')),
+            int(h.get('activations') or 0),
+        )
+
+    def load(self):
+        self.r.ping()
+        if not self.r.exists(self.k('stats')):
+            self.import_json()
+        elif self.r.zcard(self.k('created')) < self.key_count():
+            self.backfill_created()
+        print(f"[INFO] Redis: {self.key_count()} keys, {self.profile_count()} profiles")
+        return True
+
+    def import_json(self):
+        """One-shot seed from the json backend's files"""
+        keys, profiles, stats = read_json_store(self.data_dir)
+
+        pipe = self.r.pipeline()
+        used = 0
+        for key, record in keys.items():
+            h = self.to_hash(KeyRecord.from_json(record))
+            used += h['used'] == '1'
+            pipe.hset(self.k('key', key), mapping=h)
+            pipe.sadd(self.k('keys'), key)
+            pipe.zadd(self.k('expiry'), {key: h['expiry_ts']})
+            pipe.zadd(self.k('created'), {key: epoch(h['created']) or 0.0})
+        for hwid, data in profiles.items():
+            pipe.set(self.k('profile', hwid), json.dumps(data))
+            pipe.sadd(self.k('profiles'), hwid)
+        pipe.hset(self.k('counters'), 'used', used)
+        pipe.hset(self.k('stats'), mapping={
+            'validations': int(stats.get('validations', 0)),
+            'generations': int(stats.get('generations', 0)),
+            'last_reset': stats.get('last_reset') or datetime.now().isoformat(),
+        })
+        pipe.execute()
+        if keys or profiles:
+            print(f"[INFO] Imported {len(keys)} keys, {len(profiles)} profiles into Redis")
+
+    def backfill_created(self):
+        """Stores written before the admin list was paginated lack the created zset"""
+        pipe = self.r.pipeline(transaction=False)
+        for key, rec in self.iter_keys():
+            pipe.zadd(self.k('created'), {key: rec.created or 0.0})
+        pipe.execute()
+
+    # --- keys ---------------------------------------------------------------
+
+    def get_key(self, key):
+        return self.from_hash(self.r.hgetall(self.k('key', key)))
+
+    def iter_keys(self):
+        batch = []
+        for key in self.r.sscan_iter(self.k('keys'), count=1000):
+            batch.append(key)
+            if len(batch) >= 1000:
+                yield from self._fetch(batch)
+                batch = []
+        if batch:
+            yield from self._fetch(batch)
+
+    def _fetch(self, ids):
+        pipe = self.r.pipeline(transaction=False)
+        for key in ids:
+            pipe.hgetall(self.k('key', key))
+        for key, h in zip(ids, pipe.execute()):
+            if h:
+                yield key, self.from_hash(h)
+
+    def key_count(self):
+        return self.r.scard(self.k('keys'))
+
+    def used_count(self):
+        return int(self.r.hget(self.k('counters'), 'used') or 0)
+
+    def expired_count(self, now):
+        return self.r.zcount(self.k('expiry'), '-inf', f'({now}')
+
+    def missing(self, candidates):
+        candidates = list(candidates)
+        flags = self.r.smismember(self.k('keys'), candidates)
+        return {key for key, exists in zip(candidates, flags) if not exists}
+
+    def query_keys(self, sort='created', descending=True, after=None, limit=100, now=None, **filters):
+        now = time.time() if now is None else now
+        zset = self.k(sort)
+        page = []
+        offset = 0
+        while len(page) < limit:
+            # Ties share a score; zsets order them by member, same as (value, key)
+            if descending:
+                top = after[0] if after else '+inf'
+                chunk = self.r.zrevrangebyscore(zset, top, '-inf', start=offset, num=500, withscores=True)
+            else:
+                bottom = after[0] if after else '-inf'
+                chunk = self.r.zrangebyscore(zset, bottom, '+inf', start=offset, num=500, withscores=True)
+            if not chunk:
+                break
+            offset += len(chunk)
+
+            ids = [key for key, score in chunk
+                   if after is None or ((score, key) < tuple(after) if descending else (score, key) > tuple(after))]
+            for key, rec in self._fetch(ids):
+                if key_matches(key, rec, now, **filters):
+                    page.append((key, rec))
+                    if len(page) >= limit:
+                        break
+        return page
+
+    def add_keys(self, records):
+        pipe = self.r.pipeline()
+        for key, record in records.items():
+            h = self.to_hash(record)
+            pipe.hset(self.k('key', key), mapping=h)
+            pipe.sadd(self.k('keys'), key)
+            pipe.zadd(self.k('expiry'), {key: h['expiry_ts']})
+            # Score from the stored ISO string so cursors built from read-back records match
+            pipe.zadd(self.k('created'), {key: epoch(h['created']) or 0.0})
+        pipe.hincrby(self.k('stats'), 'generations', len(records))
+        ids = list(records)
+        for i in range(0, len(ids), 1000):
+            self._changes(keys=[self.k('version'), self.k('changes')],
+                          args=['created', CHANGE_LOG_SIZE] + ids[i:i + 1000], client=pipe)
+            pipe.sadd(self.k('backup', 'keys'), *ids[i:i + 1000])
+        pipe.execute()
+        return True
+
+    def activate(self, key, hwid, now):
+        return self.activate_result(self.run_activate(key, hwid, now, self.r))
+
+    def activate_many(self, pairs, now):
+        # MULTI/EXEC pipeline: one round trip, applied (and AOF-logged) as a unit
+        pipe = self.r.pipeline(transaction=True)
+        for key, hwid in pairs:
+            self.run_activate(key, hwid, now, pipe)
+        return [self.activate_result(res) for res in pipe.execute()]
+
+    def run_activate(self, key, hwid, now, client):
+        return self._activate(
+            keys=[self.k('key', key), self.k('stats'), self.k('counters'),
+                  self.k('version'), self.k('changes'), self.k('backup', 'keys')],
+            args=[hwid, now, iso(now), key, CHANGE_LOG_SIZE],
+            client=client)
+
+    def activate_result(self, res):
+        status = res[0]
+        record = self.from_hash(dict(zip(res[1::2], res[2::2]))) if len(res) > 1 else None
+        return status, record
+
+    def delete_key(self, key):
+        return self.remove_keys([key]) == 1
+
+    def remove_keys(self, keys, predicate=None):
+        from redis.exceptions import WatchError
+
+        keys = list(keys)
+        with self.r.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    if predicate is not None:
+                        # Checked on the records as they are at EXEC - a write in between retries
+                        pipe.watch(*[self.k('key', key) for key in keys])
+                        doomed = [key for key, rec in self._fetch(keys) if predicate(key, rec)]
+                    else:
+                        doomed = keys
+                    # MULTI/EXEC - a bulk delete lands (and is AOF-logged) as one unit
+                    pipe.multi()
+                    for key in doomed:
+                        self._delete(
+                            keys=[self.k('key', key), self.k('keys'), self.k('expiry'), self.k('counters'),
+                                  self.k('created'), self.k('version'), self.k('changes'),
+                                  self.k('backup', 'keys')],
+                            args=[key, CHANGE_LOG_SIZE], client=pipe)
+                    return sum(pipe.execute()) if doomed else 0
+                except WatchError:
+                    continue
+
+    def update_keys(self, keys, change):
+        from redis.exceptions import WatchError
+
+        keys = list(keys)
+        if not keys:
+            return []
+        with self.r.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Optimistic: a validation touching one of these keys meanwhile makes EXEC fail
+                    pipe.watch(*[self.k('key', key) for key in keys])
+                    updated = []
+                    for key, old in self._fetch(keys):
+                        new = change(key, old.copy())
+                        if new is not None:
+                            updated.append((key, old, new))
+                    pipe.multi()
+                    for key, old, new in updated:
+                        h = self.to_hash(new)
+                        pipe.hset(self.k('key', key), mapping=h)
+                        if old.expiry != new.expiry:
+                            pipe.zadd(self.k('expiry'), {key: h['expiry_ts']})
+                    used = sum(new.used - old.used for _, old, new in updated)
+                    if used:
+                        pipe.hincrby(self.k('counters'), 'used', used)
+                    ids = [key for key, _, _ in updated]
+                    for i in range(0, len(ids), 1000):
+                        self._changes(keys=[self.k('version'), self.k('changes')],
+                                      args=['updated', CHANGE_LOG_SIZE] + ids[i:i + 1000], client=pipe)
+                        pipe.sadd(self.k('backup', 'keys'), *ids[i:i + 1000])
+                    pipe.execute()
+                    return updated
+                except WatchError:
+                    continue
+
+    def version(self):
+        return int(self.r.get(self.k('version')) or 0)
+
+    def expired_between(self, start, end, limit=1000):
+        return self.r.zrangebyscore(self.k('expiry'), start, f'({end}', start=0, num=limit)
+
+    def expired_before(self, cutoff, limit):
+        return list(self._fetch(self.r.zrangebyscore(self.k('expiry'), '-inf', f'({cutoff}', start=0, num=limit)))
+
+    def publish(self, event):
+        self.r.publish(self.k('events'), json.dumps(event))
+
+    def listen(self, callback):
+        if callback not in self.listeners:    # inherited across fork
+            self.listeners.append(callback)
+        if self.listener_pid != os.getpid():
+            self.listener_pid = os.getpid()
+            threading.Thread(target=self._pump_events, daemon=True).start()
+
+    def _pump_events(self):
+        """One pub/sub connection per worker, fanned out to local listeners"""
+        while True:
+            try:
+                pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.k('events'))
+                for msg in pubsub.listen():
+                    if msg.get('type') == 'message':
+                        event = json.loads(msg['data'])
+                        for callback in list(self.listeners):
+                            callback(event)
+            except Exception as e:
+                print(f"[WARNING] Redis event listener: {e}")
+                time.sleep(1)
+
+    def changes_since(self, version):
+        current = self.version()
+        if version > current:
+            return None
+        oldest = self.r.zrange(self.k('changes'), 0, 0, withscores=True)
+        if oldest and version < oldest[0][1] - 1:
+            return None
+        changes = []
+        for member in self.r.zrangebyscore(self.k('changes'), f'({version}', '+inf'):
+            v, op, key = member.split(':', 2)
+            changes.append((int(v), op, key))
+        return changes
+
+    # --- profiles / stats ---------------------------------------------------
+
+    def get_profile(self, hwid):
+        raw = self.r.get(self.k('profile', hwid))
+        return json.loads(raw) if raw else None
+
+    def backup_changes(self):
+        import redis
+        # RENAME is atomic: writes after it land in a fresh set for the next backup
+        taken = {}
+        for name in ('keys', 'profiles'):
+            pending = self.k('backup', name)
+            claimed = self.k('backup', name, 'taken')
+            try:
+                self.r.rename(pending, claimed)
+            except redis.ResponseError:
+                taken[name] = set()    # no such key - nothing written since
+                continue
+            taken[name] = set(self.r.smembers(claimed))
+            self.r.delete(claimed)
+        return taken['keys'], taken['profiles']
+
+    def profile_entry(self, hwid):
+        body, version = self.r.mget(self.k('profile', hwid), self.k('profile_version', hwid))
+        # Profiles written before versioning count as version 1
+        return (int(version or 1), body) if body else (0, None)
+
+    def update_profile(self, hwid, change, expect=None):
+        import redis
+        pkey, vkey = self.k('profile', hwid), self.k('profile_version', hwid)
+        with self.r.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic: EXEC fails if another worker wrote this HWID meanwhile
+                    pipe.watch(pkey, vkey)
+                    body, version = pipe.mget(pkey, vkey)
+                    version = int(version or 1) if body else 0
+                    if expect is not None and expect != version:
+                        pipe.unwatch()
+                        return 'conflict', version, body
+                    body = profile_body(change(json.loads(body) if body else None))
+                    pipe.multi()
+                    pipe.set(pkey, body)
+                    pipe.set(vkey, version + 1)
+                    pipe.sadd(self.k('profiles'), hwid)
+                    pipe.sadd(self.k('backup', 'profiles'), hwid)
+                    pipe.execute()
+                    return 'ok', version + 1, body
+                except redis.WatchError:
+                    continue
+
+    def all_profiles(self):
+        return {hwid: self.get_profile(hwid) for hwid in self.r.sscan_iter(self.k('profiles'))}
+
+    def profile_count(self):
+        return self.r.scard(self.k('profiles'))
+
+    def stats(self):
+        h = self.r.hgetall(self.k('stats'))
+        return {
+            'validations': int(h.get('validations') or 0),
+            'generations': int(h.get('generations') or 0),
+            'last_reset': h.get('last_reset'),
+        }
+
+# ============================================================================
+# SQLITE BACKEND - WAL mode, indexed columns, safe for several workers
+# ============================================================================
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    key         TEXT PRIMARY KEY,
+    created     TEXT,
+    duration    TEXT NOT NULL,
+    expiry      TEXT NOT NULL,
+    used        INTEGER NOT NULL DEFAULT 0,
+    hwid        TEXT,
+    activated   TEXT,
+    activations INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS keys_expiry ON keys(expiry);
+CREATE INDEX IF NOT EXISTS keys_used ON keys(used, expiry);
+CREATE INDEX IF NOT EXISTS keys_hwid ON keys(hwid);
+CREATE INDEX IF NOT EXISTS keys_duration ON keys(duration);
+CREATE INDEX IF NOT EXISTS keys_created ON keys(created);
+
+CREATE TABLE IF NOT EXISTS profiles (
+    hwid    TEXT PRIMARY KEY,
+    data    TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS stats (
+    name  TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    name  TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+
+-- total / used / expired maintained by triggers; expired counts keys with
+-- expiry < expired_through, which expired_count() walks forward in time
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS keys_count_insert AFTER INSERT ON keys BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'total';
+    UPDATE counters SET value = value + NEW.used WHERE name = 'used';
+    UPDATE counters SET value = value + 1 WHERE name = 'expired'
+        AND NEW.expiry < (SELECT value FROM counters WHERE name = 'expired_through');
+END;
+
+CREATE TRIGGER IF NOT EXISTS keys_count_delete AFTER DELETE ON keys BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'total';
+    UPDATE counters SET value = value - OLD.used WHERE name = 'used';
+    UPDATE counters SET value = value - 1 WHERE name = 'expired'
+        AND OLD.expiry < (SELECT value FROM counters WHERE name = 'expired_through');
+END;
+
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    op      TEXT NOT NULL,
+    key     TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS keys_change_insert AFTER INSERT ON keys BEGIN
+    INSERT INTO changes (op, key) VALUES ('created', NEW.key);
+END;
+
+CREATE TRIGGER IF NOT EXISTS keys_change_delete AFTER DELETE ON keys BEGIN
+    INSERT INTO changes (op, key) VALUES ('deleted', OLD.key);
+END;
+
+CREATE TRIGGER IF NOT EXISTS keys_change_activate AFTER UPDATE OF used, hwid ON keys
+WHEN OLD.used != NEW.used OR OLD.hwid IS NOT NEW.hwid BEGIN
+    INSERT INTO changes (op, key) VALUES ('activated', NEW.key);
+END;
+
+CREATE TRIGGER IF NOT EXISTS keys_change_trim AFTER INSERT ON changes
+WHEN NEW.version % 100 = 0 BEGIN
+    DELETE FROM changes WHERE version <= NEW.version - {change_log_size};
+END;
+
+-- Published events, tailed by every worker
+CREATE TABLE IF NOT EXISTS events (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS events_trim AFTER INSERT ON events
+WHEN NEW.id % 100 = 0 BEGIN
+    DELETE FROM events WHERE id <= NEW.id - 1000;
+END;
+
+-- Keys / profiles written since the last backup; backup_changes() drains it.
+-- NOT EXISTS rather than OR IGNORE: inside a trigger the outer statement's
+-- conflict policy wins, so an upsert on profiles would abort on a repeat.
+CREATE TABLE IF NOT EXISTS backup_dirty (
+    kind TEXT NOT NULL,
+    id   TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS keys_backup_insert AFTER INSERT ON keys BEGIN
+    INSERT INTO backup_dirty (kind, id) SELECT 'k', NEW.key
+        WHERE NOT EXISTS (SELECT 1 FROM backup_dirty WHERE kind = 'k' AND id = NEW.key);
+END;
+
+CREATE TRIGGER IF NOT EXISTS keys_backup_update AFTER UPDATE ON keys BEGIN
+    INSERT INTO backup_dirty (kind, id) SELECT 'k', NEW.key
+        WHERE NOT EXISTS (SELECT 1 FROM backup_dirty WHERE kind = 'k' AND id = NEW.key);
+END;
+
+CREATE TRIGGER IF NOT EXISTS keys_backup_delete AFTER DELETE ON keys BEGIN
+    INSERT INTO backup_dirty (kind, id) SELECT 'k', OLD.key
+        WHERE NOT EXISTS (SELECT 1 FROM backup_dirty WHERE kind = 'k' AND id = OLD.key);
+END;
+
+CREATE TRIGGER IF NOT EXISTS profiles_backup_insert AFTER INSERT ON profiles BEGIN
+    INSERT INTO backup_dirty (kind, id) SELECT 'p', NEW.hwid
+        WHERE NOT EXISTS (SELECT 1 FROM backup_dirty WHERE kind = 'p' AND id = NEW.hwid);
+END;
+
+CREATE TRIGGER IF NOT EXISTS profiles_backup_update AFTER UPDATE ON profiles BEGIN
+    INSERT INTO backup_dirty (kind, id) SELECT 'p', NEW.hwid
+        WHERE NOT EXISTS (SELECT 1 FROM backup_dirty WHERE kind = 'p' AND id = NEW.hwid);
+END;
+
+CREATE TRIGGER IF NOT EXISTS keys_count_update AFTER UPDATE OF used, expiry ON keys BEGIN
+    UPDATE counters SET value = value + NEW.used - OLD.used WHERE name = 'used';
+    UPDATE counters SET value = value
+        + (NEW.expiry < (SELECT value FROM counters WHERE name = 'expired_through'))
+        - (OLD.expiry < (SELECT value FROM counters WHERE name = 'expired_through'))
+        WHERE name = 'expired';
+END;
+"""
+
+KEY_COLUMNS = 'created, duration, expiry, used, hwid, activated, activations'
+
+# Bind on first use, re-validate on the same HWID, refuse anyone else - one statement
+SQLITE_ACTIVATE = f"""
+UPDATE keys SET
+    activated = CASE WHEN used = 0 THEN :now ELSE activated END,
+    used = 1,
+    hwid = :hwid,
+    activations = activations + 1
+WHERE key = :key
+  AND expiry >= :now
+  AND NOT (used = 1 AND hwid IS NOT NULL AND hwid != '' AND hwid != :hwid)
+RETURNING {KEY_COLUMNS}
+"""
+
+class SqliteStorage(Storage):
+    """
+    Single SQLite file in WAL mode. ISO timestamps sort correctly as TEXT,
+    so expiry/created comparisons use the indexes directly. Every process
+    and thread gets its own connection; SQLite does the locking.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=None, data_dir=DATA_DIR):
+        super().__init__()
+        self.path = path or os.path.join(data_dir, 'atlas.db')
+        self.data_dir = data_dir
+        self.local = threading.local()
+        self.listener_pid = None
+
+    @property
+    def db(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def transaction(self):
+        return SqliteTransaction(self.db)
+
+    @staticmethod
+    def from_row(row):
+        created, duration, expiry, used, hwid, activated, activations = row
+        return KeyRecord(epoch(created), duration, epoch(expiry), bool(used), hwid,
+                         epoch(activated), activations)
+
+    @staticmethod
+    def to_row(key, rec):
+        return (key, iso(rec.created), rec.duration, iso(rec.expiry), 1 if rec.used else 0,
+                rec.hwid, iso(rec.activated), rec.activations)
+
+    def load(self):
+        self.db.executescript(SQLITE_SCHEMA.replace('{change_log_size}', str(CHANGE_LOG_SIZE)))
+        with self.transaction() as db:
+            columns = [row[1] for row in db.execute('PRAGMA table_info(profiles)')]
+            if 'version' not in columns:
+                db.execute('ALTER TABLE profiles ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+            if not db.execute('SELECT 1 FROM counters').fetchone():
+                self.seed_counters(db)
+            migrated = db.execute("SELECT value FROM meta WHERE name = 'migrated'").fetchone()
+            if not migrated:
+                self.import_json(db)
+                db.execute("INSERT INTO meta (name, value) VALUES ('migrated', ?)",
+                           (datetime.now().isoformat(),))
+        print(f"[INFO] SQLite: {self.key_count()} keys, {self.profile_count()} profiles")
+        return True
+
+    def seed_counters(self, db):
+        """One scan to initialise the trigger-maintained counters"""
+        now = datetime.now().isoformat()
+        total, used = db.execute('SELECT COUNT(*), COALESCE(SUM(used), 0) FROM keys').fetchone()
+        expired = db.execute('SELECT COUNT(*) FROM keys WHERE expiry < ?', (now,)).fetchone()[0]
+        db.executemany('INSERT INTO counters (name, value) VALUES (?, ?)',
+                       [('total', total), ('used', used), ('expired', expired), ('expired_through', now)])
+
+    def counter(self, name):
+        return self.db.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()[0]
+
+    def import_json(self, db):
+        """One-shot migration from the json backend's files"""
+        keys, profiles, stats = read_json_store(self.data_dir)
+
+        db.executemany('INSERT OR REPLACE INTO keys (key, ' + KEY_COLUMNS + ') VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (self.to_row(k, KeyRecord.from_json(v)) for k, v in keys.items()))
+        db.executemany('INSERT OR REPLACE INTO profiles (hwid, data) VALUES (?, ?)',
+                       ((h, json.dumps(d)) for h, d in profiles.items()))
+        db.executemany('INSERT OR REPLACE INTO stats (name, value) VALUES (?, ?)',
+                       [('validations', int(stats.get('validations', 0))),
+                        ('generations', int(stats.get('generations', 0))),
+                        ('last_reset', stats.get('last_reset') or datetime.now().isoformat())])
+        if keys or profiles:
+            print(f"[INFO] Migrated {len(keys)} keys, {len(profiles)} profiles into SQLite")
+
+    def save(self, force=False):
+        # Every transaction is already durable; just fold the WAL back
+        self.db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        if force:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] 💾 Data saved to disk")
+        return True
+
+    # --- keys ---------------------------------------------------------------
+
+    def get_key(self, key):
+        row = self.db.execute(f'SELECT {KEY_COLUMNS} FROM keys WHERE key = ?', (key,)).fetchone()
+        return self.from_row(row) if row else None
+
+    def iter_keys(self):
+        cur = self.db.execute(f'SELECT key, {KEY_COLUMNS} FROM keys')
+        for row in cur:
+            yield row[0], self.from_row(row[1:])
+
+    def key_count(self):
+        return self.counter('total')
+
+    def used_count(self):
+        return self.counter('used')
+
+    def expired_count(self, now):
+        """Only keys that aged out since the last call are counted (indexed range)"""
+        now = iso(now)
+        if now <= self.counter('expired_through'):
+            return self.counter('expired')
+        with self.transaction() as db:
+            through = db.execute("SELECT value FROM counters WHERE name = 'expired_through'").fetchone()[0]
+            if now > through:
+                aged = db.execute('SELECT COUNT(*) FROM keys WHERE expiry >= ? AND expiry < ?',
+                                  (through, now)).fetchone()[0]
+                db.execute("UPDATE counters SET value = value + ? WHERE name = 'expired'", (aged,))
+                db.execute("UPDATE counters SET value = ? WHERE name = 'expired_through'", (now,))
+            return db.execute("SELECT value FROM counters WHERE name = 'expired'").fetchone()[0]
+
+    def missing(self, candidates):
+        candidates = list(candidates)
+        found = set()
+        for i in range(0, len(candidates), 500):
+            chunk = candidates[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            found.update(r[0] for r in self.db.execute(
+                f'SELECT key FROM keys WHERE key IN ({marks})', chunk))
+        return set(candidates) - found
+
+    @staticmethod
+    def key_filters(now, status=None, duration=None, hwid_prefix=None, key_prefix=None):
+        """key_matches() as WHERE terms + their arguments"""
+        now = iso(time.time() if now is None else now)
+        where, args = [], []
+        if status == 'expired':
+            where.append('expiry < ?')
+            args.append(now)
+        elif status in ('active', 'unused'):
+            where.append('used = ? AND expiry >= ?')
+            args += [1 if status == 'active' else 0, now]
+        if duration:
+            where.append('duration = ?')
+            args.append(duration)
+        # Prefix as a range so the hwid / primary key indexes apply
+        if hwid_prefix:
+            where.append('hwid >= ? AND hwid < ?')
+            args += [hwid_prefix, hwid_prefix + '\U0010ffff']
+        if key_prefix:
+            where.append('key >= ? AND key < ?')
+            args += [key_prefix, key_prefix + '\U0010ffff']
+        return where, args
+
+    def query_keys(self, sort='created', descending=True, after=None, limit=100, now=None, **filters):
+        col = {'created': 'created', 'expiry': 'expiry'}[sort]
+        where, args = self.key_filters(now, **filters)
+        if after:
+            where.append(f'({col}, key) {"<" if descending else ">"} (?, ?)')
+            args += [iso(after[0]), after[1]]
+
+        order = 'DESC' if descending else 'ASC'
+        sql = (f'SELECT key, {KEY_COLUMNS} FROM keys'
+               + (' WHERE ' + ' AND '.join(where) if where else '')
+               + f' ORDER BY {col} {order}, key {order} LIMIT ?')
+        return [(row[0], self.from_row(row[1:])) for row in self.db.execute(sql, args + [limit])]
+
+    def select_keys(self, now, keys=None, created=None, expiry=None, hwid=None, **filters):
+        if keys is not None:
+            yield from super().select_keys(now, keys, created, expiry, hwid, **filters)
+            return
+        # One statement - paging query_keys() would re-sort the filter index's matches per page
+        where, args = self.key_filters(now, **filters)
+        for col, (low, high) in (('created', created or (None, None)), ('expiry', expiry or (None, None))):
+            if low is not None:
+                where.append(f'{col} >= ?')
+                args.append(iso(low))
+            if high is not None:
+                where.append(f'{col} < ?')
+                args.append(iso(high))
+        if hwid is not None:
+            where.append('hwid = ?')
+            args.append(hwid)
+        # Streamed off the cursor; the ranges are re-checked as floats, the rest is all SQL
+        for row in self.db.execute(f'SELECT key, {KEY_COLUMNS} FROM keys'
+                                   + (' WHERE ' + ' AND '.join(where) if where else ''), args):
+            rec = self.from_row(row[1:])
+            if key_selected(row[0], rec, now, None, created, expiry):
+                yield row[0], rec
+
+    def add_keys(self, records):
+        with self.transaction() as db:
+            db.executemany('INSERT INTO keys (key, ' + KEY_COLUMNS + ') VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (self.to_row(k, v) for k, v in records.items()))
+            db.execute("UPDATE stats SET value = value + ? WHERE name = 'generations'", (len(records),))
+        return True
+
+    def activate(self, key, hwid, now):
+        with self.transaction() as db:
+            return self.bind(db, key, hwid, now)
+
+    def activate_many(self, pairs, now):
+        with self.transaction() as db:
+            return [self.bind(db, key, hwid, now) for key, hwid in pairs]
+
+    def bind(self, db, key, hwid, now):
+        row = db.execute(SQLITE_ACTIVATE, {'key': key, 'hwid': hwid, 'now': iso(now)}).fetchone()
+        if row:
+            db.execute("UPDATE stats SET value = value + 1 WHERE name = 'validations'")
+            return 'ok', self.from_row(row)
+
+        row = db.execute(f'SELECT {KEY_COLUMNS} FROM keys WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return 'invalid', None
+        record = self.from_row(row)
+        if record.expiry < now:
+            return 'expired', record
+        return 'in_use', record
+
+    def delete_key(self, key):
+        return self.remove_keys([key]) == 1
+
+    def remove_keys(self, keys, predicate=None):
+        keys = list(keys)
+        with self.transaction() as db:
+            if predicate is not None:
+                doomed = []
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    rows = db.execute(f"SELECT key, {KEY_COLUMNS} FROM keys WHERE key IN ({','.join('?' * len(chunk))})",
+                                      chunk)
+                    doomed += [row[0] for row in rows if predicate(row[0], self.from_row(row[1:]))]
+                keys = doomed
+            return sum(db.execute('DELETE FROM keys WHERE key = ?', (key,)).rowcount for key in keys)
+
+    def update_keys(self, keys, change):
+        keys = list(keys)
+        updated = []
+        with self.transaction() as db:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = db.execute(f"SELECT key, {KEY_COLUMNS} FROM keys WHERE key IN ({','.join('?' * len(chunk))})",
+                                  chunk)
+                for row in rows.fetchall():
+                    old = self.from_row(row[1:])
+                    new = change(row[0], old.copy())
+                    if new is not None:
+                        updated.append((row[0], old, new))
+            db.executemany('UPDATE keys SET created = ?, duration = ?, expiry = ?, used = ?, hwid = ?, '
+                           'activated = ?, activations = ? WHERE key = ?',
+                           [self.to_row(key, new)[1:] + (key,) for key, _, new in updated])
+            db.executemany("INSERT INTO changes (op, key) VALUES ('updated', ?)", [(key,) for key, _, _ in updated])
+        return updated
+
+    def version(self):
+        return self.db.execute('SELECT COALESCE(MAX(version), 0) FROM changes').fetchone()[0]
+
+    def expired_between(self, start, end, limit=1000):
+        return [row[0] for row in self.db.execute(
+            'SELECT key FROM keys WHERE expiry >= ? AND expiry < ? LIMIT ?', (iso(start), iso(end), limit))]
+
+    def expired_before(self, cutoff, limit):
+        rows = self.db.execute('SELECT key, ' + KEY_COLUMNS + ' FROM keys WHERE expiry < ? ORDER BY expiry LIMIT ?',
+                               (iso(cutoff), limit))
+        return [(row[0], self.from_row(row[1:])) for row in rows]
+
+    def publish(self, event):
+        with self.transaction() as db:
+            db.execute('INSERT INTO events (payload) VALUES (?)', (json.dumps(event),))
+
+    def listen(self, callback):
+        if callback not in self.listeners:    # inherited across fork
+            self.listeners.append(callback)
+        if self.listener_pid != os.getpid():
+            self.listener_pid = os.getpid()
+            threading.Thread(target=self._pump_events, daemon=True).start()
+
+    def _pump_events(self):
+        """Tail the events table - every worker sees every other worker's events"""
+        last = self.db.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        while True:
+            time.sleep(EVENT_POLL_INTERVAL)
+            try:
+                rows = self.db.execute('SELECT id, payload FROM events WHERE id > ? ORDER BY id', (last,)).fetchall()
+            except sqlite3.Error as e:
+                print(f"[WARNING] SQLite event listener: {e}")
+                continue
+            for last, payload in rows:
+                event = json.loads(payload)
+                for callback in list(self.listeners):
+                    callback(event)
+
+    def changes_since(self, version):
+        oldest, current = self.db.execute('SELECT MIN(version), COALESCE(MAX(version), 0) FROM changes').fetchone()
+        if version > current or (oldest is not None and version < oldest - 1):
+            return None
+        return self.db.execute('SELECT version, op, key FROM changes WHERE version > ? ORDER BY version',
+                               (version,)).fetchall()
+
+    # --- profiles / stats ---------------------------------------------------
+
+    def get_profile(self, hwid):
+        row = self.db.execute('SELECT data FROM profiles WHERE hwid = ?', (hwid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def backup_changes(self):
+        with self.transaction() as db:
+            rows = db.execute('SELECT kind, id FROM backup_dirty').fetchall()
+            db.execute('DELETE FROM backup_dirty')
+        return {i for kind, i in rows if kind == 'k'}, {i for kind, i in rows if kind == 'p'}
+
+    def profile_entry(self, hwid):
+        row = self.db.execute('SELECT version, data FROM profiles WHERE hwid = ?', (hwid,)).fetchone()
+        return tuple(row) if row else (0, None)
+
+    def update_profile(self, hwid, change, expect=None):
+        with self.transaction() as db:
+            row = db.execute('SELECT version, data FROM profiles WHERE hwid = ?', (hwid,)).fetchone()
+            version, body = row if row else (0, None)
+            if expect is not None and expect != version:
+                return 'conflict', version, body
+            body = profile_body(change(json.loads(body) if body else None))
+            db.execute('INSERT INTO profiles (hwid, data, version) VALUES (?, ?, ?) '
+                       'ON CONFLICT(hwid) DO UPDATE SET data = excluded.data, version = excluded.version',
+                       (hwid, body, version + 1))
+            return 'ok', version + 1, body
+
+    def all_profiles(self):
+        return {hwid: json.loads(data) for hwid, data in self.db.execute('SELECT hwid, data FROM profiles')}
+
+    def profile_count(self):
+        return self.db.execute('SELECT COUNT(*) FROM profiles').fetchone()[0]
+
+    def stats(self):
+        stats = default_stats()
+        stats.update(dict(self.db.execute('SELECT name, value FROM stats')))
+        return stats
+
+class SqliteTransaction:
+    """BEGIN IMMEDIATE ... COMMIT - takes the write lock up front, no upgrade deadlocks"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.db.execute('BEGIN IMMEDIATE')
+        self.acquired = time.perf_counter()
+        metrics.observe('atlas_lock_wait_seconds', self.acquired - started, lock='sqlite')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        committing = time.perf_counter()
+        self.db.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        done = time.perf_counter()
+        metrics.observe('atlas_lock_hold_seconds', done - self.acquired, lock='sqlite')
+        if exc_type is None:
+            metrics.observe('atlas_fsync_duration_seconds', done - committing, file='atlas.db')
+        return False
+
+# ============================================================================
+# FACTORY
+# ============================================================================
+
+def create_storage():
+    """Pick the backend from STORAGE_BACKEND (json | redis | sqlite)"""
+    backend = os.environ.get('STORAGE_BACKEND', 'json').lower()
+    if backend == 'redis':
+        return RedisStorage(url=os.environ.get('REDIS_URL'))
+    if backend == 'sqlite':
+        return SqliteStorage(path=os.environ.get('SQLITE_PATH'))
+    if backend == 'json':
+        return JsonStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,104 @@
+"""
+SHARED FIXTURES
+
+app.py builds its store from the environment when it's imported, so the
+environment is pinned here first: a scratch DATA_DIR and the json backend,
+never a replica. The backend fixtures open the same data in json, sqlite
+and redis for the storage and backup tests.
+
+Redis runs against REDIS_URL when it's set (a throwaway redis-server - the
+test prefix is cleared afterwards), otherwise against fakeredis + lupa for
+the Lua scripts; without either the redis cases are skipped.
+"""
+
+import os
+import time
+import uuid
+import atexit
+import base64
+import shutil
+import tempfile
+
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='atlas-test-')
+# Registered before app.py's own exit hook, so it runs after the shutdown backup
+atexit.register(shutil.rmtree, os.environ['DATA_DIR'], ignore_errors=True)
+os.environ['STORAGE_BACKEND'] = 'json'
+for name in ('REPLICA_OF', 'REPLICATION_LISTEN', 'LEASE_SECRET'):
+    os.environ.pop(name, None)
+
+import pytest
+
+import storage
+from storage import KeyRecord
+
+BACKENDS = ['json', 'sqlite', 'redis']
+
+DAY = 86400
+
+# ============================================================================
+# STORAGE BACKENDS
+# ============================================================================
+
+def redis_client():
+    if os.environ.get('REDIS_URL'):
+        import redis
+        return redis.Redis.from_url(os.environ['REDIS_URL'], decode_responses=True)
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+def open_store(backend, data_dir, client=None, prefix=None):
+    if backend == 'json':
+        store = storage.JsonStorage(data_dir=data_dir)
+    elif backend == 'sqlite':
+        store = storage.SqliteStorage(data_dir=data_dir)
+    else:
+        store = storage.RedisStorage(client=client, prefix=prefix, data_dir=data_dir)
+    store.load()
+    return store
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+@pytest.fixture
+def reopen(backend, tmp_path):
+    """reopen() -> a fresh store over the same data (a restart)"""
+    client = redis_client() if backend == 'redis' else None
+    prefix = f'atlas-test-{uuid.uuid4().hex[:8]}:'
+    yield lambda: open_store(backend, str(tmp_path), client, prefix)
+    if client is not None:
+        for name in client.scan_iter(prefix + '*'):
+            client.delete(name)
+
+@pytest.fixture
+def store(reopen):
+    return reopen()
+
+def add(store, count=3, now=None, duration='7days', days=7):
+    now = time.time() if now is None else now
+    keys = {f'TEST-{i:04d}': KeyRecord(now - count + i, duration, now + days * DAY) for i in range(count)}
+    store.add_keys(keys)
+    return sorted(keys)
+
+# ============================================================================
+# APP
+# ============================================================================
+
+@pytest.fixture(scope='session')
+def atlas():
+    """The app module, imported once over the scratch DATA_DIR"""
+    import app
+    return app
+
+@pytest.fixture
+def client(atlas):
+    with atlas.revoked_lock:
+        atlas.revoked_keys.clear()
+    return atlas.app.test_client()
+
+@pytest.fixture
+def admin(atlas):
+    """Headers for the /admin/api routes"""
+    token = base64.b64encode(f'{atlas.ADMIN_USER}:{atlas.ADMIN_PASS}'.encode()).decode()
+    return {'Authorization': f'Basic {token}'}
@@ -0,0 +1,83 @@
+"""
+BACKUPS + RESTORE - full and incremental backups replay to the live state
+"""
+
+import os
+import sys
+import json
+import time
+
+import pytest
+
+import backups
+import restore
+from conftest import add
+
+def live(store):
+    """(keys, profiles) in the keys.json / profiles.json schema a restore produces"""
+    return {key: rec.to_json() for key, rec in store.iter_keys()}, store.all_profiles()
+
+def test_full_and_incrementals_restore(store, tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    writer = backups.BackupWriter(store, backup_dir)
+    now = time.time()
+
+    keys = add(store, 4, now=now)
+    store.update_profile('HW-A', lambda current: {'theme': 'dark'})
+    full = writer.run(full=True)
+    at_full = live(store)
+
+    store.activate(keys[0], 'HW-A', now)
+    store.update_profile('HW-B', lambda current: {'font': 12})
+    first = writer.run()
+    at_first = live(store)
+
+    store.remove_keys([keys[1]])
+    store.update_keys([keys[2]], lambda key, rec: setattr(rec, 'duration', '30days') or rec)
+    store.update_profile('HW-A', lambda current: dict(current, theme='light'))
+    second = writer.run()
+
+    assert [name for name, _ in backups.list_backups(backup_dir)] == [full, first, second]
+    assert [kind for _, kind in backups.list_backups(backup_dir)] == ['full', 'incr', 'incr']
+
+    restored_keys, restored_profiles, stats = backups.restore(backup_dir)
+    assert (restored_keys, restored_profiles) == live(store)
+    assert keys[1] not in restored_keys
+    assert stats['generations'] == store.stats()['generations']
+
+    # An intermediate point: the full plus the first incremental only
+    assert backups.chain(backup_dir, first) == [full, first]
+    assert backups.restore(backup_dir, first)[:2] == at_first
+    assert backups.restore(backup_dir, full)[:2] == at_full
+
+def test_restore_cli_at(store, tmp_path, monkeypatch, capsys):
+    backup_dir = str(tmp_path / 'backups')
+    writer = backups.BackupWriter(store, backup_dir)
+    now = time.time()
+
+    keys = add(store, 3, now=now)
+    full = writer.run(full=True)
+    at_full = live(store)
+
+    store.remove_keys([keys[0]])
+    store.update_profile('HW-A', lambda current: {'theme': 'dark'})
+    writer.run()
+
+    def run_cli(*args):
+        out = str(tmp_path / 'out')
+        monkeypatch.setattr(sys, 'argv', ['restore.py', '--dir', backup_dir, '--out', out, *args])
+        restore.main()
+        with open(os.path.join(out, 'keys.json')) as f:
+            restored_keys = json.load(f)
+        with open(os.path.join(out, 'profiles.json')) as f:
+            return restored_keys, json.load(f)
+
+    assert run_cli() == live(store)
+    # --at takes a timestamp prefix as well as a full name
+    assert run_cli('--at', full.split('.')[0]) == at_full
+    assert 'Applied 1 backup(s)' in capsys.readouterr().out
+
+    monkeypatch.setattr(sys, 'argv', ['restore.py', '--dir', backup_dir, '--at', '19990101'])
+    with pytest.raises(SystemExit) as failed:
+        restore.main()
+    assert failed.value.code == 1
@@ -0,0 +1,109 @@
+"""
+BULK KEY OPERATIONS - POST /admin/api/keys/bulk end to end
+"""
+
+import pytest
+
+DAY = 86400
+
+def bulk(client, admin, **body):
+    response = client.post('/admin/api/keys/bulk', json=body, headers=admin)
+    return response.status_code, response.get_json()
+
+def validate(client, key, hwid='HW-BULK'):
+    return client.post('/api/validate', json={'key': key, 'hwid': hwid}).get_json()
+
+def verify(client, lease, hwid='HW-BULK'):
+    return client.post('/api/lease/verify', json={'lease': lease, 'hwid': hwid}).get_json()
+
+def test_dry_run_changes_nothing(atlas, client, admin):
+    keys = atlas.generate_keys(3, '7days')
+    before = {key: atlas.STORE.get_key(key).expiry for key in keys}
+
+    status, result = bulk(client, admin, operation='extend', filter={'keys': keys}, days=2, dry_run=True)
+    assert status == 200 and result['dry_run']
+    assert result['matched'] == result['affected'] == 3 and sorted(result['keys']) == sorted(keys)
+    assert {key: atlas.STORE.get_key(key).expiry for key in keys} == before
+
+    status, result = bulk(client, admin, operation='extend', filter={'keys': keys}, days=2)
+    assert status == 200 and not result['dry_run'] and result['affected'] == 3
+    assert {key: atlas.STORE.get_key(key).expiry for key in keys} == {key: before[key] + 2 * DAY for key in keys}
+
+def test_dry_run_delete(atlas, client, admin):
+    keys = atlas.generate_keys(2, '1day')
+    status, result = bulk(client, admin, operation='delete', filter={'keys': keys}, dry_run=True)
+    assert status == 200 and result['affected'] == 2
+    assert atlas.STORE.missing(keys) == set()
+
+    status, result = bulk(client, admin, operation='delete', filter={'keys': keys})
+    assert status == 200 and result['affected'] == 2
+    assert atlas.STORE.missing(keys) == set(keys)
+
+@pytest.mark.parametrize('body, error', [
+    ({'operation': 'delete'}, 'filter must be an object'),
+    ({'operation': 'delete', 'filter': {}}, 'filter must not be empty'),
+    ({'operation': 'delete', 'filter': {'status': '', 'keys': None}}, 'filter must not be empty'),
+    ({'operation': 'delete', 'filter': {'colour': 'red'}}, 'Unknown filter field: colour'),
+    ({'operation': 'extend', 'filter': {'status': 'unused'}, 'days': 'x'},
+     'days must be a non-zero number up to 36500 either way'),
+    ({'operation': 'extend', 'filter': {'status': 'unused'}, 'days': 'nan'},
+     'days must be a non-zero number up to 36500 either way'),
+    ({'operation': 'extend', 'filter': {'created_from': 'yesterday'}, 'days': 1},
+     'created_from / created_to must be ISO dates'),
+    ({'operation': 'rename', 'filter': {'status': 'unused'}},
+     'operation must be one of delete, extend, reset_hwid, set_duration'),
+])
+def test_rejected(atlas, client, admin, body, error):
+    count = atlas.STORE.key_count()
+    status, result = bulk(client, admin, **body)
+    assert status == 400 and result['error'] == error
+    assert atlas.STORE.key_count() == count
+
+def test_rejects_non_object_body(client, admin):
+    response = client.post('/admin/api/keys/bulk', json=['delete'], headers=admin)
+    assert response.status_code == 400
+
+def test_requires_admin(client):
+    response = client.post('/admin/api/keys/bulk', json={'operation': 'delete', 'filter': {'status': 'unused'}})
+    assert response.status_code == 401
+
+@pytest.mark.parametrize('operation', ['delete', 'extend'])
+def test_rechecks_keys_changed_after_the_scan(atlas, client, admin, monkeypatch, operation):
+    """A key activated between the scan and the write no longer matches status=unused"""
+    keys = sorted(atlas.generate_keys(3, '7days'))
+    before = atlas.STORE.get_key(keys[0]).expiry
+    scan = atlas.STORE.select_keys
+
+    def scan_then_activate(now, **filters):
+        matched = list(scan(now, **filters))
+        atlas.STORE.activate(keys[0], 'HW-RACE', now)
+        return matched
+    monkeypatch.setattr(atlas.STORE, 'select_keys', scan_then_activate)
+
+    status, result = bulk(client, admin, operation=operation, filter={'keys': keys, 'status': 'unused'}, days=1)
+    assert status == 200 and result['matched'] == 3 and result['affected'] == 2
+    assert keys[0] not in result['keys']
+    rec = atlas.STORE.get_key(keys[0])
+    assert rec.hwid == 'HW-RACE' and rec.expiry == before
+
+@pytest.mark.parametrize('operation, extra', [
+    ('reset_hwid', {}),
+    ('set_duration', {'duration': '30days'}),
+    ('extend', {'days': -1}),
+    ('delete', {}),
+])
+def test_revokes_leases(atlas, client, admin, operation, extra):
+    key = atlas.generate_key('7days')
+    lease = validate(client, key)['lease']
+    assert verify(client, lease)['valid']
+
+    status, result = bulk(client, admin, operation=operation, filter={'keys': [key]}, **extra)
+    assert status == 200 and result['affected'] == 1
+    assert verify(client, lease) == {'valid': False, 'message': 'Invalid key'}
+
+def test_positive_extend_keeps_leases(atlas, client, admin):
+    key = atlas.generate_key('7days')
+    lease = validate(client, key)['lease']
+    status, result = bulk(client, admin, operation='extend', filter={'keys': [key]}, days=3)
+    assert status == 200 and result['affected'] == 1
+    assert verify(client, lease)['valid']
@@ -0,0 +1,82 @@
+"""
+VALIDATION LEASES - issue, verify and revoke
+"""
+
+import time
+
+from storage import KeyRecord
+
+DAY = 86400
+
+def validate(client, key, hwid='HW-LEASE'):
+    return client.post('/api/validate', json={'key': key, 'hwid': hwid}).get_json()
+
+def verify(client, lease, hwid='HW-LEASE'):
+    return client.post('/api/lease/verify', json={'lease': lease, 'hwid': hwid}).get_json()
+
+def test_valid_lease(atlas, client):
+    key = atlas.generate_key('7days')
+    result = validate(client, key)
+    assert result['valid'] and result['lease']
+    checked = verify(client, result['lease'])
+    assert checked['valid'] and checked['message'] == 'Lease valid'
+    assert checked['duration'] == '7days' and checked['expiry'] == result['expiry']
+
+def test_tampered_lease(atlas, client):
+    key = atlas.generate_key('7days')
+    lease = validate(client, key)['lease']
+    body, signature = lease.split('.')
+
+    # Same signature over another key's body, a flipped signature, and junk
+    other = validate(client, atlas.generate_key('30days'))['lease'].split('.')[0]
+    flipped = signature[:-2] + ('AA' if signature[-2:] != 'AA' else 'BB')
+    for forged in (f'{other}.{signature}', f'{body}.{flipped}', f'{body}.', 'not-a-lease', f'{lease}.x'):
+        assert verify(client, forged) == {'valid': False, 'message': 'Invalid lease'}
+
+def test_hwid_mismatch(atlas, client):
+    lease = validate(client, atlas.generate_key('7days'))['lease']
+    assert verify(client, lease, 'HW-OTHER') == {'valid': False, 'message': 'Key in use on another device'}
+
+def test_expired_lease(atlas, client):
+    now = time.time()
+    lease, lease_expires = atlas.issue_lease('OLD-LEASE', 'HW-LEASE', KeyRecord(now - DAY, '7days', now + DAY),
+                                             now - atlas.LEASE_TTL - 1)
+    assert lease_expires < now
+    assert verify(client, lease) == {'valid': False, 'message': 'Lease expired'}
+
+    # A lease never outlives the key it was issued for
+    lease, lease_expires = atlas.issue_lease('OLD-KEY', 'HW-LEASE', KeyRecord(now - DAY, '1day', now - 1), now - 60)
+    assert verify(client, lease) == {'valid': False, 'message': 'Key expired'}
+
+def test_revoked_after_admin_delete(atlas, client, admin):
+    key = atlas.generate_key('7days')
+    lease = validate(client, key)['lease']
+    assert client.delete(f'/admin/api/delete/{key}', headers=admin).status_code == 200
+    assert verify(client, lease) == {'valid': False, 'message': 'Invalid key'}
+
+def test_lease_issued_after_revocation_stays_valid(atlas, client):
+    key = atlas.generate_key('7days')
+    now = time.time()
+    old, _ = atlas.issue_lease(key, 'HW-LEASE', atlas.STORE.get_key(key), now - 20)
+    atlas.revoke_keys([key], now - 10)
+    new, _ = atlas.issue_lease(key, 'HW-LEASE', atlas.STORE.get_key(key), now - 5)
+
+    assert verify(client, old) == {'valid': False, 'message': 'Invalid key'}
+    assert verify(client, new)['valid']
+
+def test_is_revoked(atlas, client):
+    now = time.time()
+    atlas.revoke_keys(['REVOKED'], now - 10)
+    assert atlas.is_revoked('REVOKED', now, now - 10)
+    assert not atlas.is_revoked('REVOKED', now, now - 9)
+    assert not atlas.is_revoked('NEVER', now, now)
+
+    # Once every lease from before it has expired, the entry is dropped
+    later = now - 10 + atlas.LEASE_TTL
+    assert not atlas.is_revoked('REVOKED', later, now - 20)
+    assert 'REVOKED' not in atlas.revoked_keys
+
+def test_rejects_malformed_body(client):
+    for body in (['lease'], {'lease': 5, 'hwid': 'HW'}, {'lease': 'x', 'hwid': ['HW']}):
+        response = client.post('/api/lease/verify', json=body)
+        assert response.status_code == 400 and not response.get_json()['valid']
@@ -0,0 +1,229 @@
+"""
+STORAGE BACKENDS - the same behaviour from json, sqlite and redis
+(fixtures in conftest.py)
+"""
+
+import time
+import threading
+
+import pytest
+
+import storage
+from storage import KeyRecord
+from conftest import DAY, add, open_store
+
+# ============================================================================
+# KEYS
+# ============================================================================
+
+def test_add_and_get(store):
+    keys = add(store)
+    assert store.key_count() == 3
+    rec = store.get_key(keys[0])
+    assert rec.duration == '7days' and not rec.used and rec.hwid is None
+    assert store.get_key('NOPE') is None
+    assert store.missing(keys + ['NOPE']) == {'NOPE'}
+    assert sorted(key for key, _ in store.iter_keys()) == keys
+    assert store.stats()['generations'] == 3
+
+def test_activate(store):
+    now = time.time()
+    keys = add(store, now=now)
+    store.add_keys({'OLD': KeyRecord(now - 10 * DAY, '1day', now - 9 * DAY)})
+
+    assert store.activate('NOPE', 'HW-A', now)[0] == 'invalid'
+    assert store.activate('OLD', 'HW-A', now)[0] == 'expired'
+
+    status, rec = store.activate(keys[0], 'HW-A', now)
+    assert status == 'ok' and rec.used and rec.hwid == 'HW-A' and rec.activations == 1
+    status, rec = store.activate(keys[0], 'HW-A', now + 1)
+    assert status == 'ok' and rec.activations == 2
+    assert store.activate(keys[0], 'HW-B', now)[0] == 'in_use'
+    assert store.used_count() == 1
+    assert store.stats()['validations'] >= 2
+
+def test_activate_is_atomic(store):
+    """Many HWIDs racing for one unused key - exactly one binds it"""
+    key = add(store, 1)[0]
+    now = time.time()
+    results = []
+    barrier = threading.Barrier(8)
+
+    def race(hwid):
+        barrier.wait()
+        results.append(store.activate(key, hwid, now)[0])
+
+    threads = [threading.Thread(target=race, args=(f'HW-{i}',)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == ['in_use'] * 7 + ['ok']
+    assert store.used_count() == 1
+
+def test_activate_many(store):
+    now = time.time()
+    keys = add(store, now=now)
+    results = store.activate_many([(keys[0], 'HW-A'), (keys[0], 'HW-B'), (keys[1], 'HW-B'), ('NOPE', 'HW-C')], now)
+    assert [status for status, _ in results] == ['ok', 'in_use', 'ok', 'invalid']
+    assert store.used_count() == 2
+
+def test_query_keys(store):
+    now = time.time()
+    keys = add(store, 5, now=now)
+    store.activate(keys[1], 'HW-ABC', now)
+
+    page = store.query_keys('created', True, None, 2, now=now)
+    assert [key for key, _ in page] == [keys[4], keys[3]]
+    after = (page[-1][1].created, page[-1][0])
+    assert [key for key, _ in store.query_keys('created', True, after, 10, now=now)] == keys[2::-1]
+
+    assert [key for key, _ in store.query_keys(now=now, status='active')] == [keys[1]]
+    assert [key for key, _ in store.query_keys(now=now, hwid_prefix='HW-A')] == [keys[1]]
+    assert len(store.query_keys(now=now, status='unused', key_prefix='TEST-')) == 4
+
+def test_changes_since(store):
+    now = time.time()
+    start = store.version()
+    keys = add(store, 2, now=now)
+    store.activate(keys[0], 'HW-A', now)
+    store.delete_key(keys[1])
+    changes = store.changes_since(start)
+    assert [(op, key) for _, op, key in changes] == [
+        ('created', keys[0]), ('created', keys[1]), ('activated', keys[0]), ('deleted', keys[1])
+    ]
+    assert store.version() == max(v for v, _, _ in changes)
+    assert store.changes_since(store.version()) == []
+
+# ============================================================================
+# BULK OPERATIONS
+# ============================================================================
+
+def test_select_keys(store):
+    now = time.time()
+    keys = add(store, 4, now=now)
+    store.add_keys({'LONG': KeyRecord(now, '30days', now + 30 * DAY)})
+    store.activate(keys[0], 'HW-A', now)
+
+    def select(**filters):
+        return sorted(key for key, _ in store.select_keys(now, **filters))
+
+    assert select(duration='30days') == ['LONG']
+    assert select(status='unused', duration='7days') == keys[1:]
+    assert select(hwid='HW-A') == [keys[0]]
+    assert select(keys={keys[2], 'NOPE'}) == [keys[2]]
+    assert select(expiry=(now + 10 * DAY, None)) == ['LONG']
+    assert select(created=(now - 4.5, now - 2.5)) == keys[:2]
+
+def test_update_keys(store):
+    now = time.time()
+    keys = add(store, 3, now=now)
+    store.activate(keys[0], 'HW-A', now)
+    start = store.version()
+
+    def reset(key, rec):
+        if not rec.used:
+            return None
+        rec.used, rec.hwid = False, None
+        return rec
+
+    updated = store.update_keys(keys, reset)
+    assert [key for key, _, _ in updated] == [keys[0]]
+    assert store.used_count() == 0 and store.get_key(keys[0]).hwid is None
+    assert keys[0] in {key for _, _, key in store.changes_since(start)}
+
+    def extend(key, rec):
+        rec.expiry += DAY
+        return rec
+
+    store.update_keys(keys, extend)
+    assert [key for key, _ in store.query_keys('expiry', False, (now + 7.5 * DAY, ''), 10, now=now)] == keys
+    assert store.activate(keys[0], 'HW-B', now)[0] == 'ok'
+
+def test_update_keys_failure_changes_nothing(store):
+    keys = add(store, 5)
+    before = {key: store.get_key(key).expiry for key in keys}
+    calls = []
+
+    def fails_midway(key, rec):
+        calls.append(key)
+        if len(calls) == 3:
+            raise RuntimeError('boom')
+        rec.expiry += DAY
+        return rec
+
+    def unserializable(key, rec):
+        rec.expiry = float('nan')
+        return rec
+
+    for change in (fails_midway, unserializable):
+        with pytest.raises((RuntimeError, ValueError)):
+            store.update_keys(keys, change)
+        assert {key: store.get_key(key).expiry for key in keys} == before
+
+def test_remove_keys_predicate(store):
+    now = time.time()
+    keys = add(store, 3, now=now)
+    store.activate(keys[0], 'HW-A', now)
+    assert store.remove_keys(keys, lambda key, rec: not rec.used) == 2
+    assert store.get_key(keys[0]) is not None and store.key_count() == 1
+    assert store.used_count() == 1
+    assert store.remove_keys([keys[0], 'NOPE']) == 1
+    assert store.used_count() == 0
+
+# ============================================================================
+# PROFILES
+# ============================================================================
+
+def test_profiles(store):
+    status, version, body = store.update_profile('HW-A', lambda current: {'theme': 'dark'})
+    assert status == 'ok' and version == 1
+    assert store.get_profile('HW-A') == {'theme': 'dark'}
+    assert store.profile_entry('HW-A')[0] == 1
+    assert store.profile_entry('HW-NONE') == (0, None)
+
+    status, version, _ = store.update_profile('HW-A', lambda current: dict(current, font=12), expect=1)
+    assert status == 'ok' and version == 2
+    # A writer still holding version 1 loses
+    assert store.update_profile('HW-A', lambda current: {'theme': 'light'}, expect=1)[0] == 'conflict'
+    assert store.get_profile('HW-A') == {'theme': 'dark', 'font': 12}
+    assert store.profile_count() == 1
+
+# ============================================================================
+# DURABILITY
+# ============================================================================
+
+def test_survives_restart(reopen):
+    store = reopen()
+    now = time.time()
+    keys = add(store, 3, now=now)
+    store.activate(keys[0], 'HW-A', now)
+    store.update_keys([keys[1]], lambda key, rec: setattr(rec, 'duration', '30days') or rec)
+    store.remove_keys([keys[2]])
+    store.update_profile('HW-A', lambda current: {'theme': 'dark'})
+
+    store = reopen()
+    assert store.key_count() == 2 and store.used_count() == 1
+    assert store.get_key(keys[0]).hwid == 'HW-A'
+    assert store.get_key(keys[1]).duration == '30days'
+    assert store.get_key(keys[2]) is None
+    assert store.get_profile('HW-A') == {'theme': 'dark'}
+
+def test_json_write_failure_raises(tmp_path):
+    """A batch that never reached disk must not be reported as saved"""
+    store = open_store('json', str(tmp_path))
+    now = time.time()
+    keys = add(store, 3, now=now)
+    store.committer.flush = lambda batch: False
+
+    with pytest.raises(storage.CommitFailed):
+        add(store, 1)
+    with pytest.raises(storage.CommitFailed):
+        store.activate(keys[0], 'HW-A', now)
+    with pytest.raises(storage.CommitFailed):
+        store.activate_many([(keys[1], 'HW-A')], now)
+    with pytest.raises(storage.CommitFailed):
+        store.update_keys([keys[2]], lambda key, rec: rec)
+    with pytest.raises(storage.CommitFailed):
+        store.remove_keys([keys[2]])
+    assert store.update_profile('HW-A', lambda current: {})[0] == 'failed'